@@ -12,27 +12,22 @@ import os, sys
 import numpy as np
 import pandas as pd
 
-from sklearn.externals import joblib
+import joblib
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import cross_val_score
 
 def random_forest(canc, targ, data, classes, orig_data, orig_classes):
     """
-    random_forest will train the random forest classifier using the pre-processed data.
+    random_forest will train the random forest classifier using the pre-processed data. The forest settings are
+    chosen by out-of-bag error (see trees.oobSearch).
     """
+    from classifiers import trees
 
     global rfc, rfc_pred, mean_acc
 
-    feat = (data.shape[1]-10)
-    while(feat < data.shape[1]-1):
-        trees = 5
-        while(trees <= 500):
-            rfc = RandomForestClassifier(n_estimators=trees, max_features=feat)
-            rfc.fit(data, classes)
-            trees = trees + 1500
-        feat = feat + 20
-        rfc_pred = rfc.predict(orig_data)
-        mean_acc = rfc.score(orig_data, orig_classes)
+    rfc, _ = trees.oobSearch(data, classes)
+    rfc_pred = rfc.predict(orig_data)
+    mean_acc = rfc.score(orig_data, orig_classes)
 
     return rfc, rfc_pred, mean_acc
 
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+attribution.py explains the individual MetOncoFit predictions as per-feature contributions.
+
+Each split on the path from the root to a leaf moves the class probabilities by the difference between the child
+and parent node, and that difference is credited to the feature the parent splits on. The class probabilities of a
+prediction are then the root (bias) probabilities plus the sum of the feature contributions, averaged over the trees.
+This is the path attribution of Saabas, which is what the TreeSHAP explainers compute in their approximate mode.
+
+The per-node contributions of every tree are stacked into one sparse node x (feature, class) matrix, so the
+contributions of all rows and all trees are a single product with the sparse decision paths of the forest.
+
+@authors: Krishna Dev Oruganty & Scott Campit
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+# In-memory cache of the gene x feature contribution matrices by (tissue, target)
+_attributionCache = {}
+
+
+def _nodeProbabilities(tree):
+    """
+    _nodeProbabilities returns the class probabilities of every node in a fitted decision tree.
+    """
+    values = tree.tree_.value[:, 0, :].astype(np.float64)
+    totals = values.sum(axis=1, keepdims=True)
+    totals[totals == 0] = 1.0
+    return values / totals
+
+
+def _nodeContributions(tree, nFeatures):
+    """
+    _nodeContributions returns the contribution of reaching each node of a fitted decision tree, as a sparse
+    node x (feature, class) matrix, and the class probabilities of the root node.
+    """
+    from scipy import sparse
+
+    probabilities = _nodeProbabilities(tree)
+    nNodes, nClasses = probabilities.shape
+
+    internal = np.flatnonzero(tree.tree_.children_left >= 0)
+    children = np.concatenate([tree.tree_.children_left[internal], tree.tree_.children_right[internal]])
+    parents = np.concatenate([internal, internal])
+
+    delta = probabilities[children] - probabilities[parents]
+    feature = tree.tree_.feature[parents]
+
+    rows = np.repeat(children, nClasses)
+    columns = (feature[:, np.newaxis] * nClasses + np.arange(nClasses)).ravel()
+    contributions = sparse.csr_matrix((delta.ravel(), (rows, columns)), shape=(nNodes, nFeatures * nClasses))
+    return contributions, probabilities[0]
+
+
+def forestContributions(model, X):
+    """
+    forestContributions computes the per-feature contribution to the class probabilities of every row.
+
+    :params:
+        model:         A trained random forest (or decision tree) classifier.
+        X:             A numpy array containing the data to explain.
+
+    :return:
+        bias:          A numpy array of shape (classes,) with the mean root probabilities of the trees.
+        contributions: A numpy array of shape (rows, features, classes). bias + contributions.sum(axis=1) is equal to
+            model.predict_proba(X).
+    """
+    from scipy import sparse
+
+    X = np.asarray(X, dtype=np.float32)
+    nFeatures = X.shape[1]
+    trees = getattr(model, "estimators_", [model])
+
+    blocks = []
+    bias = np.zeros(len(model.classes_))
+    for tree in trees:
+        block, root = _nodeContributions(tree, nFeatures)
+        blocks.append(block)
+        bias += root
+    bias /= len(trees)
+
+    if hasattr(model, "estimators_"):
+        paths, _ = model.decision_path(X)
+    else:
+        paths = model.decision_path(X)
+
+    # One product over the decision paths of every tree
+    contributions = paths.tocsr().astype(np.float64) @ sparse.vstack(blocks).tocsc()
+    contributions = contributions.toarray() / len(trees)
+    return bias, contributions.reshape(X.shape[0], nFeatures, len(model.classes_))
+
+
+def geneContributions(model, X, genes, features, label=None):
+    """
+    geneContributions returns the gene x feature contribution matrix for one predicted class. Genes with several rows
+    (ie: one per cell line) are averaged.
+
+    :params:
+        model:    A trained random forest classifier.
+        X:        A numpy array containing the data to explain.
+        genes:    A list of the gene name of each row in X.
+        features: A list of the feature names, in column order.
+        label:    The class to explain (ie: 'UPREG'). The default explains the first class of the model.
+
+    :return:
+        matrix:   A pandas dataframe of the contributions, with the genes as the index and the features as columns.
+        bias:     A float denoting the mean probability of the class before any split.
+    """
+    classes = list(model.classes_)
+    column = 0 if label is None else classes.index(label)
+
+    bias, contributions = forestContributions(model, X)
+    matrix = pd.DataFrame(contributions[:, :, column], columns=features)
+    matrix["Gene"] = np.asarray(genes)
+    matrix = matrix.groupby("Gene", sort=True).mean()
+    return matrix, float(bias[column])
+
+
+def loadContributions(tissue, target, model, X, genes, features, label=None, cachepath='./../output/attribution/'):
+    """
+    loadContributions returns the gene x feature contribution matrix for a tissue and target. The matrix is kept in
+    memory and written to cachepath, and is only recomputed when the model or the data changes.
+
+    :params:
+        tissue:    A string denoting the tissue name.
+        target:    A string denoting the target variable.
+        model:     A trained random forest classifier.
+        X:         A numpy array containing the data to explain.
+        genes:     A list of the gene name of each row in X.
+        features:  A list of the feature names, in column order.
+        label:     The class to explain (ie: 'UPREG').
+        cachepath: A string denoting the directory the matrices are cached in. None only caches in memory.
+
+    :return:
+        matrix:    A pandas dataframe of the contributions, with the genes as the index and the features as columns.
+        bias:      A float denoting the mean probability of the class before any split.
+    """
+    import joblib
+
+    digest = joblib.hash((model, np.asarray(X), list(genes), list(features), label))
+    key = (tissue, target, label)
+    if key in _attributionCache and _attributionCache[key][0] == digest:
+        return _attributionCache[key][1]
+
+    fileName = None
+    if cachepath is not None:
+        labelName = "" if label is None else "_" + str(label)
+        fileName = os.path.join(cachepath, tissue + "_" + target + labelName + "_attribution.pkl")
+        if os.path.exists(fileName):
+            cached = joblib.load(fileName)
+            if cached["digest"] == digest:
+                _attributionCache[key] = (digest, cached["result"])
+                return cached["result"]
+
+    result = geneContributions(model, X, genes, features, label=label)
+    _attributionCache[key] = (digest, result)
+
+    if fileName is not None:
+        if not os.path.exists(cachepath):
+            os.makedirs(cachepath)
+        joblib.dump({"digest": digest, "result": result}, fileName)
+    return result
+
+
+def explainGene(matrix, gene, topFeatures=10):
+    """
+    explainGene returns the features that push the prediction of one gene the most, in either direction.
+
+    :params:
+        matrix:      A gene x feature contribution matrix from geneContributions or loadContributions.
+        gene:        A string denoting the gene name.
+        topFeatures: An integer denoting the number of features to return.
+
+    :return:
+        explanation: A pandas dataframe with the Feature and Contribution columns, sorted by absolute contribution.
+    """
+    row = matrix.loc[gene]
+    order = np.argsort(-np.abs(row.to_numpy()))[:topFeatures]
+    return pd.DataFrame({"Feature": row.index[order], "Contribution": row.to_numpy()[order]})
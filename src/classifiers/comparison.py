@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+comparison.py compares MetOncoFit against the baseline classifiers from pyscripts_ML_ensemble.py (SVM, neural
+network, random forest, gradient boosting and AdaBoost).
+
+Instead of one exhaustive GridSearchCV per model family, every family is searched by successive halving: all settings
+are first scored on a small share of the training samples, and only the best 1/factor of them are carried over to the
+next round with factor times more samples. The cross-validation folds are built once and shared by every family, and
+the fits of all families in a round are run in a single pool of workers. The result is one leaderboard with the
+accuracy and fit time of every setting.
+
+@author: Krishna Oruganty & Scott Campit
+"""
+import os
+import time
+import math
+
+import numpy as np
+import pandas as pd
+
+
+def approximateSVM(rank=300, gamma=1.0, C=1.0, seed=0):
+    """
+    approximateSVM returns an RBF support vector machine approximated by a low-rank Nystroem feature map followed by a
+    linear SVM. Its cost grows linearly with the number of samples, unlike the exact svm.SVC.
+
+    :params:
+        rank:  An integer denoting the number of Nystroem components (the rank of the kernel approximation).
+        gamma: A float denoting the RBF kernel coefficient.
+        C:     A float denoting the regularization parameter of the linear SVM.
+        seed:  An integer denoting the random seed for sampling the Nystroem components.
+
+    :return:
+        model: A scikit-learn pipeline with the 'nystroem' and 'svc' steps.
+    """
+    from sklearn.kernel_approximation import Nystroem
+    from sklearn.pipeline import Pipeline
+    from sklearn.svm import LinearSVC
+
+    return Pipeline([("nystroem", Nystroem(kernel="rbf", gamma=gamma, n_components=rank, random_state=seed)),
+                     ("svc", LinearSVC(C=C, dual=False))])
+
+
+def modelFamilies(ranks=(100, 300, 1000)):
+    """
+    modelFamilies returns the baseline classifiers and the parameter grids from pyscripts_ML_ensemble.py, plus the
+    approximate-kernel SVM.
+
+    :params:
+        ranks:    A list of the Nystroem ranks searched for the approximate SVM.
+
+    :return:
+        families: A dictionary mapping the model name to an (estimator, parameter grid) tuple.
+    """
+    from sklearn import svm
+    from sklearn.neural_network import MLPClassifier
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.ensemble import GradientBoostingClassifier
+    from sklearn.ensemble import AdaBoostClassifier
+
+    families = {
+        "SVM": (svm.SVC(),
+                {'C': [10, 100, 1000, 10000],
+                 'gamma': [10.0, 100.0, 1000.0],
+                 'kernel': ['linear', 'rbf', 'poly'],
+                 'max_iter': [100, 500, 1000],
+                 'degree': [2, 3, 4, 5]}),
+        "Neural network": (MLPClassifier(),
+                           {'solver': ['adam'],
+                            'alpha': [0.1, 0.2, 0.5],
+                            'max_iter': [500, 1000, 5000],
+                            'hidden_layer_sizes': [(100, 10), (125, 10), (200, 10), (100, 5), (125, 5), (200, 5)]}),
+        "Random forest": (RandomForestClassifier(),
+                          {'max_features': [8, 9, 10, 15, 20, 25, 30, 40],
+                           'n_estimators': [100, 500, 1000]}),
+        "Gradient boosting": (GradientBoostingClassifier(),
+                              {'max_features': [8, 9, 10, 20, 25, 30, 40],
+                               'n_estimators': [50, 100, 500],
+                               'learning_rate': [0.1, 1.0, 2.0, 5.0]}),
+        "AdaBoost": (AdaBoostClassifier(),
+                     {'n_estimators': [50, 100, 500, 1000],
+                      'learning_rate': [0.1, 1.0, 2.0, 3.0, 5.0]}),
+        "Approximate SVM": (approximateSVM(),
+                            {'nystroem__n_components': list(ranks),
+                             'nystroem__gamma': [0.01, 0.1, 1.0, 10.0],
+                             'svc__C': [1, 10, 100, 1000]})
+    }
+    return families
+
+
+def buildFolds(classes, nFolds=5, seed=0, cacheFile=None):
+    """
+    buildFolds makes the stratified cross-validation folds once so every model family is scored on the same splits.
+    The training indices of each fold are shuffled, so successive halving rounds can subsample them in order (see
+    _stratifiedSubsample).
+
+    :params:
+        classes:   A numpy array containing the class labels.
+        nFolds:    An integer denoting the number of folds.
+        seed:      An integer denoting the random seed.
+        cacheFile: A string denoting a .npz file to store the folds in. If it exists and matches the labels, the
+            folds are read from it instead.
+
+    :return:
+        folds:     A list of (train indices, test indices) tuples.
+    """
+    from sklearn.model_selection import StratifiedKFold
+
+    classes = np.asarray(classes)
+    labelHash = str(pd.util.hash_array(classes.astype(str)).sum()) + "_" + str(nFolds) + "_" + str(seed)
+
+    if cacheFile is not None and os.path.exists(cacheFile):
+        cached = np.load(cacheFile)
+        if str(cached["labelHash"]) == labelHash:
+            return [(cached["train" + str(i)], cached["test" + str(i)]) for i in range(nFolds)]
+
+    rng = np.random.RandomState(seed)
+    splitter = StratifiedKFold(n_splits=nFolds, shuffle=True, random_state=seed)
+    folds = [(rng.permutation(train), test) for train, test in splitter.split(np.zeros(len(classes)), classes)]
+
+    if cacheFile is not None:
+        arrays = {"labelHash": np.array(labelHash)}
+        for i, (train, test) in enumerate(folds):
+            arrays["train" + str(i)] = train
+            arrays["test" + str(i)] = test
+        np.savez(cacheFile, **arrays)
+    return folds
+
+
+def _stratifiedSubsample(train, classes, size):
+    """
+    _stratifiedSubsample returns about size of the shuffled training indices of a fold, with every class in the same
+    proportion as in the fold and at least one sample of each class. The indices keep their shuffled order, so the
+    samples of a round are a subset of those of the next round.
+    """
+    if size >= len(train):
+        return train
+    labels = classes[train]
+    keep = np.zeros(len(train), dtype=bool)
+    for label, count in zip(*np.unique(labels, return_counts=True)):
+        quota = min(count, max(1, int(count * size // len(train))))
+        keep[np.flatnonzero(labels == label)[:quota]] = True
+    return train[keep]
+
+
+def _fitAndScore(estimator, params, data, classes, train, test):
+    """
+    _fitAndScore fits one setting on one fold and returns the hold-out accuracy and the fit time in seconds. A setting
+    that fails to fit is scored as NaN, as GridSearchCV does with error_score=np.nan, so it does not abort the search.
+    """
+    import warnings
+    from sklearn.base import clone
+
+    model = clone(estimator).set_params(**params)
+    failure = None
+    start = time.time()
+    with warnings.catch_warnings():
+        # Capped max_iter settings are expected not to converge on the small rounds
+        warnings.simplefilter("ignore")
+        try:
+            model.fit(data[train], classes[train])
+        except Exception as error:
+            failure = error
+    fitTime = time.time() - start
+    if failure is not None:
+        warnings.warn("The fit failed with " + repr(params) + ": " + str(failure))
+        return np.nan, fitTime
+    return model.score(data[test], classes[test]), fitTime
+
+
+def successiveHalving(data, classes, families=None, folds=None, factor=3, minResources=None, nJobs=-1):
+    """
+    successiveHalving searches the parameter grid of every model family by successive halving.
+
+    :params:
+        data:         A numpy array containing the training data.
+        classes:      A numpy array containing the training labels.
+        families:     A dictionary mapping the model name to an (estimator, parameter grid) tuple. The default is
+            modelFamilies().
+        folds:        A list of (train indices, test indices) tuples from buildFolds. They are built if not given.
+        factor:       An integer denoting the share of settings kept after each round (1/factor) and the growth of
+            the training samples between rounds.
+        minResources: An integer denoting the number of training samples per fold in the first round. The default
+            lets the largest grid finish with the full training folds.
+        nJobs:        An integer denoting the number of worker processes (-1 uses every core).
+
+    :return:
+        results:      A pandas dataframe with the score and fit time of every setting in every round.
+    """
+    from joblib import Parallel, delayed
+    from sklearn.model_selection import ParameterGrid
+
+    data = np.asarray(data)
+    classes = np.asarray(classes)
+    if families is None:
+        families = modelFamilies()
+    if folds is None:
+        folds = buildFolds(classes)
+
+    candidates = {name: list(ParameterGrid(grid)) for name, (_, grid) in families.items()}
+    maxResources = min(len(train) for train, _ in folds)
+    if minResources is None:
+        nRounds = max(int(math.ceil(math.log(max(len(c) for c in candidates.values()), factor))), 1)
+        minResources = maxResources // (factor ** (nRounds - 1))
+    minResources = max(minResources, 2 * len(np.unique(classes)))
+
+    rows = []
+    iteration = 0
+    active = {name: list(range(len(params))) for name, params in candidates.items()}
+    while active:
+        resources = int(min(maxResources, minResources * factor ** iteration))
+        tasks = [(name, index, fold)
+                 for name, indices in active.items()
+                 for index in indices
+                 for fold in range(len(folds))]
+        scores = Parallel(n_jobs=nJobs)(
+            delayed(_fitAndScore)(families[name][0], candidates[name][index], data, classes,
+                                  _stratifiedSubsample(folds[fold][0], classes, resources), folds[fold][1])
+            for name, index, fold in tasks)
+
+        scoreTable = pd.DataFrame([(name, index, fold, score, fitTime)
+                                   for (name, index, fold), (score, fitTime) in zip(tasks, scores)],
+                                  columns=["Model", "Setting", "Fold", "Accuracy", "Fit time"])
+        summary = scoreTable.groupby(["Model", "Setting"]).agg(
+            {"Accuracy": ["mean", "std"], "Fit time": "mean"})
+        summary.columns = ["Mean accuracy", "Sigma", "Mean fit time (s)"]
+        summary = summary.reset_index()
+        summary["Round"] = iteration
+        summary["Samples"] = resources
+        summary["Params"] = [str(candidates[name][index]) for name, index in zip(summary["Model"],
+                                                                                 summary["Setting"])]
+        rows.append(summary)
+
+        # Keep the best 1/factor of each family, and stop a family once it is down to one setting on all samples
+        survivors = {}
+        for name, group in summary.groupby("Model"):
+            if len(group) == 1 and resources >= maxResources:
+                continue
+            keep = max(1, int(math.ceil(len(group) / float(factor))))
+            best = group.sort_values(["Mean accuracy", "Mean fit time (s)"], ascending=[False, True]).head(keep)
+            survivors[name] = best["Setting"].tolist()
+        active = survivors
+        iteration += 1
+
+    return pd.concat(rows, ignore_index=True)
+
+
+def leaderboard(results):
+    """
+    leaderboard returns the best setting of every model family from its last round, ranked by accuracy.
+    """
+    last = results.loc[results.groupby("Model")["Round"].transform("max") == results["Round"]]
+    best = last.sort_values("Mean accuracy", ascending=False).groupby("Model").head(1)
+    columns = ["Model", "Params", "Mean accuracy", "Sigma", "Mean fit time (s)", "Samples", "Round"]
+    return best[columns].reset_index(drop=True)
+
+
+def kernelApproximationTradeoff(data, classes, ranks=(50, 100, 300, 1000), gamma=1.0, C=100.0, folds=None,
+                                nJobs=-1):
+    """
+    kernelApproximationTradeoff scores the approximate SVM at several ranks against the exact RBF svm.SVC with the same
+    gamma and C on the same folds, so the accuracy lost by the approximation can be weighed against the time saved.
+
+    :params:
+        data:    A numpy array containing the training data.
+        classes: A numpy array containing the training labels.
+        ranks:   A list of the Nystroem ranks to score.
+        gamma:   A float denoting the RBF kernel coefficient.
+        C:       A float denoting the regularization parameter.
+        folds:   A list of (train indices, test indices) tuples from buildFolds. They are built if not given.
+        nJobs:   An integer denoting the number of worker processes.
+
+    :return:
+        tradeoff: A pandas dataframe with the accuracy and fit time of every rank and of the exact SVC.
+    """
+    from joblib import Parallel, delayed
+    from sklearn import svm
+
+    data = np.asarray(data)
+    classes = np.asarray(classes)
+    if folds is None:
+        folds = buildFolds(classes)
+
+    models = [("Exact SVC", None, svm.SVC(kernel="rbf", gamma=gamma, C=C))]
+    models += [("Approximate SVM", rank, approximateSVM(rank=rank, gamma=gamma, C=C)) for rank in ranks]
+
+    tasks = [(model, fold) for model in range(len(models)) for fold in range(len(folds))]
+    scores = Parallel(n_jobs=nJobs)(
+        delayed(_fitAndScore)(models[model][2], {}, data, classes, folds[fold][0], folds[fold][1])
+        for model, fold in tasks)
+
+    scoreTable = pd.DataFrame([(model, score, fitTime) for (model, _), (score, fitTime) in zip(tasks, scores)],
+                              columns=["Index", "Accuracy", "Fit time"])
+    tradeoff = scoreTable.groupby("Index").agg({"Accuracy": ["mean", "std"], "Fit time": "mean"})
+    tradeoff.columns = ["Mean accuracy", "Sigma", "Mean fit time (s)"]
+    tradeoff.insert(0, "Model", [models[model][0] for model in tradeoff.index])
+    tradeoff.insert(1, "Rank", [models[model][1] for model in tradeoff.index])
+    tradeoff = tradeoff.reset_index(drop=True)
+
+    exact = tradeoff.iloc[0]
+    tradeoff["Accuracy change"] = tradeoff["Mean accuracy"] - exact["Mean accuracy"]
+    tradeoff["Speedup"] = exact["Mean fit time (s)"] / tradeoff["Mean fit time (s)"]
+    return tradeoff
+
+
+def compareTissues(filenames, target, exclude, labelFileName, factor=3, nJobs=-1, cachePath=None):
+    """
+    compareTissues runs the successive halving comparison on the oversampled training split of every tissue model.
+
+    :params:
+        filenames:     A list of paths to the tumor model .csv files.
+        target:        A string denoting the target variable.
+        exclude:       A string denoting which features to keep in the dataset.
+        labelFileName: The path to the file mapping the column names to the feature names.
+        factor:        An integer denoting the successive halving factor.
+        nJobs:         An integer denoting the number of worker processes.
+        cachePath:     A string denoting the directory the folds are cached in.
+
+    :return:
+        board:         A pandas dataframe with the best setting of every model family for every tissue.
+        results:       A pandas dataframe with every setting scored in every round.
+    """
+    import utils.DataPreparation as DataPreparation
+
+    boards = []
+    allResults = []
+    for filename in filenames:
+        tissue = os.path.splitext(os.path.basename(filename))[0]
+        Xtrain, _, Ytrain, _ = DataPreparation.processDataFromFile(filename, target, exclude, labelFileName)
+
+        cacheFile = None
+        if cachePath is not None:
+            cacheFile = os.path.join(cachePath, tissue + "_" + target + "_folds.npz")
+        folds = buildFolds(Ytrain, cacheFile=cacheFile)
+
+        results = successiveHalving(Xtrain, Ytrain, folds=folds, factor=factor, nJobs=nJobs)
+        results.insert(0, "Cancer", tissue)
+        board = leaderboard(results)
+        board.insert(0, "Cancer", tissue)
+        allResults.append(results)
+        boards.append(board)
+
+    return pd.concat(boards, ignore_index=True), pd.concat(allResults, ignore_index=True)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare the baseline classifiers across tissue models.")
+    parser.add_argument("filenames", nargs='+')
+    parser.add_argument("--target", default="DE")
+    parser.add_argument("--exclude", default="DE_and_CNV")
+    parser.add_argument("--labels", dest="labelFileName", default="./../srv/headers.txt")
+    parser.add_argument("--factor", type=int, default=3)
+    parser.add_argument("--jobs", dest="nJobs", type=int, default=-1)
+    parser.add_argument("--cache", dest="cachePath", default=None)
+    parser.add_argument("--output", default="./../output/Tables/leaderboard.csv")
+    args = parser.parse_args()
+
+    board, results = compareTissues(args.filenames, args.target, args.exclude, args.labelFileName,
+                                    factor=args.factor, nJobs=args.nJobs, cachePath=args.cachePath)
+    board.to_csv(args.output, index=False)
+    results.to_csv(os.path.splitext(args.output)[0] + "_rounds.csv", index=False)
+    print(board)
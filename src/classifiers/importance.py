@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+importance.py computes permutation feature importances for a trained MetOncoFit model.
+
+The Gini importances from `feature_importances_` favour the continuous flux features. Permutation importance measures
+the accuracy lost on held-out data when a feature is shuffled instead. Features can also be shuffled together as a
+family (flux KO, topology, kcat, expression, network), which gives grouped importances in the same pass. The permuted
+matrices are stacked and predicted in batches, and the batches are spread over a pool of worker processes that share
+one copy of the test set (see utils.shared).
+
+@authors: Krishna Dev Oruganty & Scott Campit
+"""
+import numpy as np
+import pandas as pd
+
+# Feature families, matched on the long feature names from srv/headers.txt
+familyPatterns = [
+    ("Flux KO", "Flux change in"),
+    ("Topology", "opological distance"),
+    ("kcat", "Catalytic efficiency"),
+    ("Expression", "gene expression"),
+    ("Expression", "CNV gain/loss ratio"),
+    ("Network", "RECON1 subsystem"),
+    ("Network", "Metabolic subnetwork")
+]
+
+
+def featureFamilies(features):
+    """
+    featureFamilies groups the feature columns into the flux KO, topology, kcat, expression and network families.
+
+    :params:
+        features: A list of the feature names, in column order.
+
+    :return:
+        families: A dictionary mapping the family name to a list of column indices. Features that do not match a
+            family are kept in a family of their own.
+    """
+    families = {}
+    for column, feature in enumerate(features):
+        family = feature
+        for name, pattern in familyPatterns:
+            if pattern in feature:
+                family = name
+                break
+        families.setdefault(family, []).append(column)
+    return families
+
+
+def _permutedAccuracies(model, handle, tasks, groups, batchSize):
+    """
+    _permutedAccuracies scores a chunk of (group, repeat, seed) tasks on the shared test set. The permuted copies of
+    Xtest are stacked so the model predicts batchSize matrices per call.
+    """
+    Xtest, Ytest = handle.X, handle.labels
+    if hasattr(model, "n_jobs"):
+        # The pool already uses every core. A shallow copy shares the fitted trees but not the caller's n_jobs
+        import copy
+        model = copy.copy(model)
+        model.n_jobs = 1
+
+    nRows = Xtest.shape[0]
+    accuracies = []
+    for start in range(0, len(tasks), batchSize):
+        batch = tasks[start:start + batchSize]
+        stacked = np.tile(Xtest, (len(batch), 1))
+        for i, (group, _, seed) in enumerate(batch):
+            columns = groups[group]
+            order = np.random.RandomState(seed).permutation(nRows)
+            stacked[i * nRows:(i + 1) * nRows, columns] = Xtest[order][:, columns]
+        Ypred = model.predict(stacked).reshape(len(batch), nRows)
+        accuracies.extend(np.mean(Ypred == Ytest[np.newaxis, :], axis=1))
+    return accuracies
+
+
+def permutationImportance(model, Xtest, Ytest, features, groups=None, nRepeats=10, nJobs=-1, batchSize=8, seed=0):
+    """
+    permutationImportance returns the drop in hold-out accuracy when each feature (or group of features) is shuffled.
+
+    :params:
+        model:     A trained classifier with a predict method.
+        Xtest:     A numpy array containing the test data.
+        Ytest:     A numpy array containing the test labels.
+        features:  A list of the feature names, in column order.
+        groups:    A dictionary mapping a name to a list of column indices that are shuffled together. The default
+            shuffles every feature on its own. Use featureFamilies(features) for grouped importances.
+        nRepeats:  An integer denoting the number of shuffles per feature or group.
+        nJobs:     An integer denoting the number of worker processes (-1 uses every core).
+        batchSize: An integer denoting the number of permuted matrices stacked per predict call.
+        seed:      An integer denoting the random seed.
+
+    :return:
+        importance: A pandas dataframe with the Feature, Importance (mean accuracy drop) and Sigma columns, sorted by
+            importance.
+    """
+    import os
+    from joblib import Parallel, delayed
+    from utils.shared import SharedDataset
+
+    Xtest = np.asarray(Xtest)
+    Ytest = np.asarray(Ytest)
+    if groups is None:
+        groups = {feature: [column] for column, feature in enumerate(features)}
+    names = list(groups)
+
+    baseline = np.mean(model.predict(Xtest) == Ytest)
+
+    rng = np.random.RandomState(seed)
+    tasks = [(name, repeat, rng.randint(np.iinfo(np.int32).max))
+             for name in names for repeat in range(nRepeats)]
+
+    workers = os.cpu_count() if nJobs is None or nJobs < 0 else nJobs
+    chunks = [tasks[i::workers] for i in range(workers) if tasks[i::workers]]
+    with SharedDataset(Xtest, Ytest) as shared:
+        results = Parallel(n_jobs=nJobs)(
+            delayed(_permutedAccuracies)(model, shared.handle, chunk, groups, batchSize) for chunk in chunks)
+
+    scores = pd.DataFrame([(name, accuracy)
+                           for chunk, accuracies in zip(chunks, results)
+                           for (name, _, _), accuracy in zip(chunk, accuracies)],
+                          columns=["Feature", "Accuracy"])
+    scores["Drop"] = baseline - scores["Accuracy"]
+    importance = scores.groupby("Feature")["Drop"].agg(["mean", "std"])
+    importance.columns = ["Importance", "Sigma"]
+    importance = importance.reindex(names).reset_index()
+
+    return importance.sort_values("Importance", ascending=False).reset_index(drop=True)
+
+
+def groupedImportance(model, Xtest, Ytest, features, nRepeats=10, nJobs=-1, batchSize=8, seed=0):
+    """
+    groupedImportance returns the permutation importance of each feature family (see featureFamilies).
+    """
+    return permutationImportance(model, Xtest, Ytest, features, groups=featureFamilies(features),
+                                 nRepeats=nRepeats, nJobs=nJobs, batchSize=batchSize, seed=seed)
+
+
+def cachedImportance(model, Xtest, Ytest, features, groups=None, nRepeats=10, nJobs=-1, batchSize=8, seed=0,
+                     cache=None):
+    """
+    cachedImportance returns permutationImportance from the artifact cache (see utils.cache), and computes and stores
+    it on a miss. The key is the hash of the model and test set, the features and groups, the number of repeats, the
+    seed and the source of this module. nJobs and batchSize do not change the result, so they are not part of the key.
+
+    :params:
+        cache: An ArtifactCache object. The default is the cache in utils.cache.defaultPath.
+    """
+    import sys
+    import joblib
+    from utils.cache import ArtifactCache
+
+    cache = ArtifactCache() if cache is None else cache
+    params = {"model": joblib.hash(model),
+              "Xtest": joblib.hash(np.asarray(Xtest)),
+              "Ytest": joblib.hash(np.asarray(Ytest)),
+              "features": list(features),
+              "groups": groups,
+              "nRepeats": nRepeats,
+              "seed": seed}
+    return cache.cached("importance", permutationImportance, params=params, code=[sys.modules[__name__]],
+                        args=(model, Xtest, Ytest, features),
+                        kwargs=dict(groups=groups, nRepeats=nRepeats, nJobs=nJobs, batchSize=batchSize, seed=seed))
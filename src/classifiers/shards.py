@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+shards.py trains the pan-cancer model as a set of sub-forests, one per shard, and merges them into one ensemble.
+
+The `complex` model is otherwise one forest fit on the concatenation of every tissue, so its fit time and peak
+memory grow with all of the tissues at once. Here each shard is either one tissue model, or a block of rows of a
+shared dataset, and is fit in its own worker process that only reads its own slice. The sub-forests are combined in
+a ShardedForest, which averages the class probabilities of every tree like a single random forest would. The trees
+are split between the shards in proportion to their size.
+
+Each tissue shard is scaled on its own (see DataPreparation.processDataFromFile), while the complex model is scaled
+on the concatenated table. Predictions should therefore be made on data scaled per tissue.
+
+@authors: Krishna Dev Oruganty & Scott Campit
+"""
+import numpy as np
+
+
+class ShardedForest():
+    """
+    ShardedForest merges random forests trained on different shards into one classifier. A shard that did not see
+    every class contributes zero probability for the classes it is missing.
+    """
+
+    def __init__(self, forests):
+        """
+        :params:
+            forests: A list of trained RandomForestClassifier objects with the same features.
+        """
+        self.forests = list(forests)
+        self.classes_ = np.unique(np.concatenate([forest.classes_ for forest in self.forests]))
+        self.n_estimators = sum(len(forest.estimators_) for forest in self.forests)
+        self.estimators_ = [tree for forest in self.forests for tree in forest.estimators_]
+        # The column of each shard's classes in the merged class list
+        self.columns = [np.searchsorted(self.classes_, forest.classes_) for forest in self.forests]
+
+    def predict_proba(self, X):
+        """
+        predict_proba returns the class probabilities averaged over every tree of every shard.
+        """
+        probabilities = np.zeros((np.asarray(X).shape[0], len(self.classes_)))
+        for forest, columns in zip(self.forests, self.columns):
+            probabilities[:, columns] += forest.predict_proba(X) * len(forest.estimators_)
+        return probabilities / self.n_estimators
+
+    def predict(self, X):
+        """
+        predict returns the most probable class of every row.
+        """
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+    def score(self, X, Y):
+        """
+        score returns the mean accuracy on the given data and labels.
+        """
+        return np.mean(self.predict(X) == np.asarray(Y))
+
+    @property
+    def feature_importances_(self):
+        """
+        feature_importances_ is the Gini importance of each feature, weighted by the number of trees in each shard.
+        """
+        weights = np.array([len(forest.estimators_) for forest in self.forests], dtype=float)
+        importances = np.stack([forest.feature_importances_ for forest in self.forests])
+        return np.average(importances, axis=0, weights=weights)
+
+
+def _forest(nTrees, seed):
+    """
+    _forest returns the random forest used for every shard.
+    """
+    from sklearn.ensemble import RandomForestClassifier
+
+    return RandomForestClassifier(n_estimators=nTrees,
+                                  criterion="gini",
+                                  max_features="sqrt",
+                                  bootstrap=True,
+                                  n_jobs=1,
+                                  random_state=seed)
+
+
+def _splitTrees(nTrees, sizes):
+    """
+    _splitTrees splits nTrees between the shards in proportion to their sizes, with at least one tree per shard.
+    """
+    sizes = np.asarray(sizes, dtype=float)
+    share = nTrees * sizes / sizes.sum()
+    trees = np.maximum(np.floor(share).astype(int), 1)
+    # Hand out the trees lost to rounding to the shards with the largest remainders
+    for shard in np.argsort(share - np.floor(share))[::-1][:max(nTrees - trees.sum(), 0)]:
+        trees[shard] += 1
+    return trees.tolist()
+
+
+def _fitTissueShard(filename, target, exclude, labelFileName, thresholds, nTrees, seed):
+    """
+    _fitTissueShard reads, scales and splits one tissue model, and fits its sub-forest.
+    """
+    from utils import DataPreparation
+
+    Xtrain, Xtest, Ytrain, Ytest = DataPreparation.processDataFromFile(filename, target, exclude, labelFileName,
+                                                                       thresholds=thresholds)
+    forest = _forest(nTrees, seed).fit(Xtrain, Ytrain)
+    return forest, np.asarray(Xtest), np.asarray(Ytest)
+
+
+def _fitRowShard(handle, rows, nTrees, seed):
+    """
+    _fitRowShard fits a sub-forest on a block of rows of a shared dataset.
+    """
+    rows = np.sort(rows)
+    return _forest(nTrees, seed).fit(handle.X[rows], handle.labels[rows])
+
+
+def trainTissueShards(filenames, target, exclude, labelFileName, nTrees=128, thresholds=None, nJobs=-1, seed=0):
+    """
+    trainTissueShards trains the pan-cancer model with one sub-forest per tissue model. Each worker only reads its own
+    tissue, so the peak memory of a worker is that of the largest tissue.
+
+    :params:
+        filenames:     A list of paths to the tissue model .csv files.
+        target:        A string denoting the target variable ('DE', 'CNV' or 'SURV').
+        exclude:       A string denoting which features to keep in the dataset.
+        labelFileName: The path to the file mapping the column names to the feature names.
+        nTrees:        An integer denoting the total number of trees.
+        thresholds:    A (low, high) tuple or a key of DataPreparation.thresholdSets (optional).
+        nJobs:         An integer denoting the number of worker processes (-1 uses every core).
+        seed:          An integer denoting the random seed.
+
+    :return:
+        RFC:             A ShardedForest object
+        RFC_prediction:  A numpy array of the predicted classes for the pooled test sets
+        HoldOutAccuracy: A float of the hold-out accuracy on the pooled test sets
+        Ytest:           A numpy array of the pooled test labels
+    """
+    import os
+    from joblib import Parallel, delayed
+
+    # The tissue files are not read here, so the trees are split by file size
+    trees = _splitTrees(nTrees, [os.path.getsize(filename) for filename in filenames])
+    shards = Parallel(n_jobs=nJobs)(
+        delayed(_fitTissueShard)(filename, target, exclude, labelFileName, thresholds, shardTrees, seed + shard)
+        for shard, (filename, shardTrees) in enumerate(zip(filenames, trees)))
+
+    RFC = ShardedForest([forest for forest, _, _ in shards])
+    Xtest = np.concatenate([Xtest for _, Xtest, _ in shards])
+    Ytest = np.concatenate([Ytest for _, _, Ytest in shards])
+    RFC_prediction = RFC.predict(Xtest)
+    HoldOutAccuracy = np.mean(RFC_prediction == Ytest)
+    return RFC, RFC_prediction, HoldOutAccuracy, Ytest
+
+
+def trainRowShards(X, Y, nShards=None, nTrees=128, nJobs=-1, seed=0):
+    """
+    trainRowShards trains a model as sub-forests on disjoint, stratified blocks of rows. The data is shared with the
+    workers through utils.shared, and each worker only reads the rows of its own block.
+
+    :params:
+        X:       A numpy array containing the training data.
+        Y:       A numpy array containing the training labels.
+        nShards: An integer denoting the number of row blocks. The default is the number of workers.
+        nTrees:  An integer denoting the total number of trees.
+        nJobs:   An integer denoting the number of worker processes (-1 uses every core).
+        seed:    An integer denoting the random seed.
+
+    :return:
+        RFC:     A ShardedForest object
+    """
+    import os
+    from joblib import Parallel, delayed
+    from sklearn.model_selection import StratifiedKFold
+    from utils.shared import SharedDataset
+
+    if nShards is None:
+        nShards = os.cpu_count() if nJobs is None or nJobs < 0 else nJobs
+    nShards = max(1, min(nShards, nTrees))
+
+    Y = np.asarray(Y)
+    if nShards == 1:
+        blocks = [np.arange(Y.shape[0])]
+    else:
+        # The held-out fold of each split is one block, so the blocks are disjoint and keep the class balance
+        folds = StratifiedKFold(n_splits=nShards, shuffle=True, random_state=seed)
+        blocks = [test for _, test in folds.split(np.zeros(Y.shape[0]), Y)]
+    trees = _splitTrees(nTrees, [len(block) for block in blocks])
+
+    with SharedDataset(X, Y) as shared:
+        forests = Parallel(n_jobs=nJobs)(
+            delayed(_fitRowShard)(shared.handle, block, shardTrees, seed + shard)
+            for shard, (block, shardTrees) in enumerate(zip(blocks, trees)))
+    return ShardedForest(forests)
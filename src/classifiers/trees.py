@@ -8,12 +8,31 @@ import os
 import numpy as np
 import joblib
 
+from utils import metrics, tracing
+
 def decisionTreeClassification(Xtrain, Ytrain, Xtest, Ytest):
     """
+    decisionTreeClassification will train a single decision tree classifier and outputs the trained classifier,
+    predictions, and accuracy.
+
+    :params:
+        Xtrain:          A numpy array containing the training data
+        Ytrain:          A numpy array containing the training labels
+        Xtest:           A numpy array containing the test data
+        Ytest:           A numpy array containing the test labels
 
     :return:
+        DTC:             A model object of the trained decision tree classifier
+        DTC_prediction:  A numpy array of the predicted class values from the decision tree classifier
+        HoldOutAccuracy: A float of the hold-out accuracy from the decision tree classifier
     """
-    from sklearn.ensemble
+    from sklearn.tree import DecisionTreeClassifier
+
+    DTC = DecisionTreeClassifier(criterion="gini", random_state=0)
+    DTC = DTC.fit(Xtrain, Ytrain)
+    DTC_prediction = DTC.predict(Xtest)
+    HoldOutAccuracy = DTC.score(Xtest, Ytest)
+    return DTC, DTC_prediction, HoldOutAccuracy
 
 
 def randomForestClassification(Xtrain, Ytrain, Xtest, Ytest):
@@ -36,8 +55,6 @@ def randomForestClassification(Xtrain, Ytrain, Xtest, Ytest):
     from sklearn.ensemble import RandomForestClassifier
     from sklearn.model_selection import cross_val_score as CV
 
-    from tqdm import tqdm
-
     # For reproducibility
     np.random.seed(0)
 
@@ -45,34 +62,120 @@ def randomForestClassification(Xtrain, Ytrain, Xtest, Ytest):
     totalTrees = 128
     print("Starting to train random forest model")
 
-    pbar = tqdm(total=initialTrees)
+    progress = metrics.ProgressMetrics("randomForestClassification", total=totalTrees - initialTrees + 1,
+                                       unit="fits")
     while(initialTrees <= totalTrees):
-        RFC = RandomForestClassifier(n_estimators=initialTrees,
-                                     criterion="gini",
-                                     max_features="auto",
-                                     bootstrap=True,
-                                     oob_score=True,
-                                     random_state=True)
-        RFC = RFC.fit(Xtrain, Ytrain)
+        with tracing.stage("fit", trees=initialTrees):
+            RFC = RandomForestClassifier(n_estimators=initialTrees,
+                                         criterion="gini",
+                                         max_features="sqrt",
+                                         bootstrap=True,
+                                         oob_score=True,
+                                         random_state=True)
+            RFC = RFC.fit(Xtrain, Ytrain)
         initialTrees += 1
-        pbar.update(1)
-    pbar.close()
-
-    RFC_prediction = RFC.predict(Xtest)
-    HoldOutAccuracy = RFC.score(Xtest, Ytest)
-    CVAccuracy = CV(RFC, Xtest, Ytest, cv=10).mean()
-    print("Finished training random forest")
+        progress.update()
+    summary = progress.close()
+
+    with tracing.stage("predict"):
+        RFC_prediction = RFC.predict(Xtest)
+        HoldOutAccuracy = RFC.score(Xtest, Ytest)
+    with tracing.stage("cross-validation"):
+        CVAccuracy = CV(RFC, Xtest, Ytest, cv=10).mean()
+    print("Finished training random forest (%.2f fits/s)" % summary["rate"])
     return RFC, RFC_prediction, HoldOutAccuracy, CVAccuracy
 
-def pickleModel(cancer, target, excluded="DE_and_CNV", mdl, savepath='./../models/'):
+def _oobScore(handle, bootstrapCounts, params, seed):
+    """
+    _oobScore fits one tree per bootstrap draw with the given settings and returns the out-of-bag error. The bootstrap
+    draws are passed in as sample counts, so every setting is scored on the same draws. The training data is read
+    from the shared dataset handle.
+    """
+    from sklearn.tree import DecisionTreeClassifier
+
+    Xtrain, Ytrain = handle.X, handle.Y
+
+    nClasses = int(Ytrain.max()) + 1
+    votes = np.zeros((Ytrain.shape[0], nClasses))
+    for tree, counts in enumerate(bootstrapCounts):
+        DTC = DecisionTreeClassifier(criterion="gini", random_state=seed + tree, **params)
+        DTC.fit(Xtrain, Ytrain, sample_weight=counts)
+        outOfBag = counts == 0
+        votes[np.ix_(outOfBag, DTC.classes_)] += DTC.predict_proba(Xtrain[outOfBag])
+
+    scored = votes.sum(axis=1) > 0
+    return 1.0 - np.mean(votes[scored].argmax(axis=1) == Ytrain[scored])
+
+
+def oobSearch(Xtrain, Ytrain, paramGrid=None, nTrees=128, nJobs=-1, seed=0):
+    """
+    oobSearch searches the random forest settings (max_features, max_depth, min_samples_leaf) by out-of-bag error, so
+    no extra train/test splits are needed. The bootstrap draws are made once and shared by every setting, and the
+    settings are scored in parallel. The best setting is refit as a RandomForestClassifier.
+
+    :params:
+        Xtrain:    A numpy array containing the training data
+        Ytrain:    A numpy array containing the training labels
+        paramGrid: A dictionary mapping the tree parameters to the values to search.
+        nTrees:    An integer denoting the number of trees (and bootstrap draws) per setting.
+        nJobs:     An integer denoting the number of worker processes (-1 uses every core).
+        seed:      An integer denoting the random seed.
+
+    :return:
+        RFC:       A model object of the random forest trained with the best setting
+        search:    A pandas dataframe with the out-of-bag error of every setting, best first
+    """
+    import pandas as pd
+    from joblib import Parallel, delayed
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.model_selection import ParameterGrid
+    from utils.shared import SharedDataset
+
+    if paramGrid is None:
+        paramGrid = {"max_features": ["sqrt", 0.2, 0.33, 0.5],
+                     "max_depth": [None, 10, 20],
+                     "min_samples_leaf": [1, 2, 5]}
+
+    Xtrain = np.asarray(Xtrain, dtype=np.float32)
+    _, Ycodes = np.unique(np.asarray(Ytrain), return_inverse=True)
+
+    # Bootstrap draws shared by every setting, stored as the number of times each sample is drawn
+    rng = np.random.RandomState(seed)
+    nSamples = Xtrain.shape[0]
+    bootstrapCounts = np.stack([np.bincount(rng.randint(0, nSamples, nSamples), minlength=nSamples)
+                                for _ in range(nTrees)]).astype(np.float64)
+
+    settings = list(ParameterGrid(paramGrid))
+    with tracing.stage("oob search", settings=len(settings)), SharedDataset(Xtrain, Ycodes) as shared:
+        errors = Parallel(n_jobs=nJobs)(
+            delayed(_oobScore)(shared.handle, bootstrapCounts, params, seed) for params in settings)
+
+    search = pd.DataFrame(settings)
+    search["OOB error"] = errors
+    search = search.sort_values("OOB error").reset_index(drop=True)
+
+    best = settings[int(np.argmin(errors))]
+    RFC = RandomForestClassifier(n_estimators=nTrees,
+                                 criterion="gini",
+                                 bootstrap=True,
+                                 oob_score=True,
+                                 n_jobs=nJobs,
+                                 random_state=seed,
+                                 **best)
+    with tracing.stage("fit", trees=nTrees):
+        RFC = RFC.fit(Xtrain, Ytrain)
+    return RFC, search
+
+
+def pickleModel(cancer, target, mdl, excluded="DE_and_CNV", savepath='./../models/'):
     """
     pickleModel saves the tumor-specific random forest model as a pickled object.
 
     :params:
         cancer: A string denoting the tumor name.
         target: A string denoting the target variable.
-        excluded: A string denoting which target variable excluded. The default value is "DE_and_CNV".
         mdl: A model object.
+        excluded: A string denoting which target variable excluded. The default value is "DE_and_CNV".
         savepath: A string denoting where the models will be saved to. If there is no directory path specified and the
             directory doesn't exist, a `models` directory will be made in the parent MetOncoFit directory.
 
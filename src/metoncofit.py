@@ -7,18 +7,19 @@
   3) The correlation value associated with each feature and differential gene expression, copy number variation, or cancer patient survival
   4) And the confusion matrix for model validation. The precision and recall values for the model are saved in separated excel files.
 
+The work is split into subcommands. Each subcommand imports only the modules it needs, so a data check or a prediction
+from a saved model does not load the plotting and Excel stack:
+    python metoncofit.py check    ./../data/median/breast.csv ./../srv/headers.txt
+    python metoncofit.py train    ./../data/median/breast.csv CNV DE_and_CNV ./../srv/headers.txt
+    python metoncofit.py train-pan CNV DE_and_CNV ./../srv/headers.txt ./../data/median/breast.csv ./../data/median/cns.csv
+    python metoncofit.py update   ./../data/median/ ./../data/delta/ ./../srv/headers.txt --targets CNV
+    python metoncofit.py validate ./../data/median/breast.csv CNV DE_and_CNV ./../srv/headers.txt --model model.pkl
+    python metoncofit.py predict  model.pkl ./../data/median/breast.csv ./../srv/headers.txt --output predictions.csv
+    python metoncofit.py figures  ./../output/Tables/ ./../output/Figures/
+
 @author: Scott Campit
 """
-
 import sys
-import utils.process
-import utils.DataPreparation
-import utils.validator
-import classifiers.trees
-import visualization.static
-
-import pandas as pd
-from openpyxl import load_workbook
 
 # Create data structures that will be used in the analysis
 #df, df1, header, canc, targ, data, classes, orig_data, orig_classes, excl_targ, freq = process.preprocess(
@@ -64,28 +65,262 @@ from openpyxl import load_workbook
 #  "tyrosine.txt"
 #]
 
-#genelist = r"/mnt/c/Users/scampit/Desktop/pyruvate.txt"
-#visualizations.specific_pathways_heatmap(final_df, importance, targ, canc, genelist, savepath=False, filename=False)
+# Pivot and index the tissue once, then render every pathway panel from the same matrix
+#matrix = visualization.static.pathwayMatrix(final_df, importance)
+#figures = visualization.static.pathwayHeatmapsMulti(final_df, importance, targ,
+#                                                    {fil: fil for fil in fils}, matrix=matrix)
 
-if __name__ == '__main__':
-    filename = './../data/breast.csv'
-    target = 'CNV'
-    exclude = 'DE_and_CNV'
-    labelFileName = './../srv/headers.txt'
-    Xtrain, Xtest, Ytrain, Ytest = utils.DataPreparation.processDataFromFile(
-                                        filename=filename,
-                                        target=target,
-                                        exclude=exclude,
-                                        labelFileName=labelFileName)
-    RFC, Ypred, HoldOutAcc, CVAcc = classifiers.trees.random_forest(Xtrain,
-                                                             Ytrain,
-                                                             Xtest,
-                                                             Ytest)
-
-    confusionMatrix, normalizedCM = utils.validator.computeConfusionMatrix(filename=filename,
-                                                           target=target,
-                                                           exclude=exclude,
-                                                           labelFileName=labelFileName,
-                                                           clf = RFC,
-                                                           iterations=1000)
+def check(args):
+    """
+    check reads a tumor model and reports its size and the class counts of each target, without training anything.
+    """
+    import utils.DataPreparation
+
+    model, _ = utils.DataPreparation.load_data(args.filename, args.labelFileName)
+    print(args.filename + ": " + str(model.shape[0]) + " rows, " + str(model.shape[1]) + " columns, " +
+          str(model.index.get_level_values(0).nunique()) + " genes")
+    for target in ["TCGA annotation", "CNV", "SURV"]:
+        if target not in model.columns:
+            print(target + ": missing")
+            continue
+        counts = model[target].value_counts()
+        print(target + ": " + ", ".join(str(label) + "=" + str(count) for label, count in counts.items()))
+    missing = model.isnull().sum().sum()
+    if missing:
+        print("Missing values: " + str(missing))
+
+
+def _fitModel(filename, target, exclude, labelFileName, scalerStatistics=None):
+    """
+    _fitModel processes a tumor model and trains its random forest. The scaler statistics are computed from the tumor
+    model unless they are given, and are kept with the forest (as scalerStatistics_), so predict scales new data the
+    same way.
+    """
+    import utils.DataPreparation
+    import utils.incremental
+    import classifiers.trees
+
+    if scalerStatistics is None:
+        scalerStatistics = utils.incremental.buildState(utils.incremental.readTumorModel(filename),
+                                                        labelFileName)["scaler"]
+    Xtrain, Xtest, Ytrain, Ytest = utils.DataPreparation.processDataFromFile(filename=filename,
+                                                                             target=target,
+                                                                             exclude=exclude,
+                                                                             labelFileName=labelFileName,
+                                                                             scalerStatistics=scalerStatistics)
+    RFC, Ypred, HoldOutAcc, CVAcc = classifiers.trees.randomForestClassification(Xtrain, Ytrain, Xtest, Ytest)
+    RFC.scalerStatistics_ = scalerStatistics
+    return RFC, Ypred, HoldOutAcc, CVAcc
+
+
+def _trainModel(filename, target, exclude, labelFileName, savepath, useCache=True, scalerStatistics=None):
+    """
+    _trainModel fits the random forest for a tumor model and target, and pickles it. The fitted model is taken from
+    the artifact cache when the tumor model, header file, parameters and training code are unchanged.
+    """
+    import os
+    import utils.DataPreparation
+    import classifiers.trees
+
+    fitArgs = (filename, target, exclude, labelFileName, scalerStatistics)
+    if not useCache:
+        RFC, Ypred, HoldOutAcc, CVAcc = _fitModel(*fitArgs)
+    else:
+        import joblib
+        import utils.incremental
+        from utils.cache import ArtifactCache
+
+        params = {"target": target, "exclude": exclude,
+                  "scalerStatistics": None if scalerStatistics is None else joblib.hash(scalerStatistics)}
+        RFC, Ypred, HoldOutAcc, CVAcc = ArtifactCache().cached(
+            "model", _fitModel, files=[filename, labelFileName], params=params,
+            code=[_fitModel, utils.DataPreparation, utils.incremental, classifiers.trees], args=fitArgs)
+    print("Hold-out accuracy: %.3f, 10-fold CV accuracy: %.3f" % (HoldOutAcc, CVAcc))
+
+    cancer = os.path.splitext(os.path.basename(filename))[0]
+    print("Saved the model to " + classifiers.trees.pickleModel(cancer, target, RFC, excluded=exclude,
+                                                                 savepath=savepath)[0])
+
+
+def train(args):
+    """
+    train fits the random forest for a tumor model and target, and pickles it.
+    """
+    _trainModel(args.filename, args.target, args.exclude, args.labelFileName, args.savepath,
+                useCache=not args.no_cache)
+
+
+def update(args):
+    """
+    update merges the new cell lines and genes in a directory of delta files into the tissue models, and refits only
+    the models of the tissues that changed, with the scaler statistics stored by the update.
+    """
+    import utils.incremental
+
+    changed = utils.incremental.updateTissues(args.dataPath, args.deltaPath, args.labelFileName,
+                                              statePath=args.statePath)
+    if not changed:
+        print("No tissue model changed")
+        return
+    for filename, (rows, scalerStatistics) in changed.items():
+        print("Updated %d rows of %s" % (rows, filename))
+        for target in args.targets:
+            _trainModel(filename, target, args.exclude, args.labelFileName, args.savepath,
+                        scalerStatistics=scalerStatistics)
+
+
+def trainPan(args):
+    """
+    trainPan trains the pan-cancer model as one sub-forest per tissue model, and pickles the merged forest.
+    """
+    import classifiers.shards
+    import classifiers.trees
+
+    RFC, _, HoldOutAcc, _ = classifiers.shards.trainTissueShards(args.filenames, args.target, args.exclude,
+                                                                 args.labelFileName, nTrees=args.trees,
+                                                                 nJobs=args.workers)
+    print("Pooled hold-out accuracy: %.3f" % HoldOutAcc)
+    print("Saved the model to " + classifiers.trees.pickleModel("complex", args.target, RFC, excluded=args.exclude,
+                                                                 savepath=args.savepath)[0])
+
+
+def validate(args):
+    """
+    validate computes the confusion matrix of a saved model over repeated train / test splits.
+    """
+    import utils.validator
+    import classifiers.trees
+
+    RFC = classifiers.trees.loadModel(args.model)
+    confusionMatrix, normalizedCM, report = utils.validator.computeConfusionMatrix(filename=args.filename,
+                                                                                   target=args.target,
+                                                                                   exclude=args.exclude,
+                                                                                   labelFileName=args.labelFileName,
+                                                                                   clf=RFC,
+                                                                                   iterations=args.iterations,
+                                                                                   tolerance=args.tolerance,
+                                                                                   confidence=args.confidence,
+                                                                                   minIterations=args.min_iterations)
     print(confusionMatrix)
+    print("Iterations: %d, accuracy: %.3f, widest %d%% confidence interval: %.4f" %
+          (report["Iterations"], report["Accuracy"], round(100 * report["Confidence"]), report["Max CI width"]))
+
+
+def predict(args):
+    """
+    predict labels every row of a tumor model with a saved model. The features are prepared the same way as in
+    training (label encoded, pruned and robust scaled with the scaler statistics of the training data).
+    """
+    import joblib
+    import pandas as pd
+    import utils.DataPreparation
+
+    RFC = joblib.load(args.model)
+    model, _ = utils.DataPreparation.load_data(args.filename, args.labelFileName)
+    model = utils.DataPreparation.label_encode(model)
+    prunedModel, _ = utils.DataPreparation.prune_targets(model, "DE", args.exclude)
+    statistics = getattr(RFC, "scalerStatistics_", None)
+    if statistics is None:
+        # Models saved before the statistics were kept with the forest
+        print("Warning: " + args.model + " has no scaler statistics, so the scaler is fit on the data to predict",
+              file=sys.stderr)
+    data = utils.DataPreparation.robust_scaler(prunedModel, statistics)
+
+    predictions = pd.DataFrame({"Prediction": RFC.predict(data)}, index=prunedModel.index)
+    if args.output is None:
+        predictions.to_csv(sys.stdout)
+    else:
+        predictions.to_csv(args.output)
+
+
+def figures(args):
+    """
+    figures renders the manuscript figures from the summary tables (see visualization.batch).
+    """
+    import visualization.batch
+
+    rendered = visualization.batch.renderAll(args.tablePath, args.savepath, workers=args.workers, fmt=args.fmt)
+    print("Rendered " + str(len(rendered)) + " figure bundles")
+
+
+def parser():
+    """
+    parser returns the command line parser with one subparser per command.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="MetOncoFit: predict metabolic gene changes in tumors.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    command = subparsers.add_parser("check", help="Report the size and class counts of a tumor model")
+    command.add_argument("filename")
+    command.add_argument("labelFileName")
+    command.set_defaults(function=check)
+
+    for name, function, helpText in [("train", train, "Train and pickle the random forest"),
+                                     ("validate", validate, "Compute the confusion matrix of a saved model")]:
+        command = subparsers.add_parser(name, help=helpText)
+        command.add_argument("filename")
+        command.add_argument("target", choices=["DE", "CNV", "SURV"])
+        command.add_argument("exclude", choices=["DE_and_CNV", "CNV_only"])
+        command.add_argument("labelFileName")
+        command.set_defaults(function=function)
+        if name == "train":
+            command.add_argument("--savepath", default="./../models/")
+            command.add_argument("--no-cache", action="store_true", help="Retrain even if the model is cached")
+        else:
+            command.add_argument("--model", required=True)
+            command.add_argument("--iterations", type=int, default=1000, help="The largest number of splits")
+            command.add_argument("--tolerance", type=float, default=None,
+                                 help="Stop once every confidence interval is narrower than this width")
+            command.add_argument("--confidence", type=float, default=0.95)
+            command.add_argument("--min-iterations", type=int, default=30)
+
+    command = subparsers.add_parser("train-pan", help="Train the pan-cancer model as one sub-forest per tissue")
+    command.add_argument("target", choices=["DE", "CNV", "SURV"])
+    command.add_argument("exclude", choices=["DE_and_CNV", "CNV_only"])
+    command.add_argument("labelFileName")
+    command.add_argument("filenames", nargs="+")
+    command.add_argument("--trees", type=int, default=128)
+    command.add_argument("--workers", type=int, default=-1)
+    command.add_argument("--savepath", default="./../models/")
+    command.set_defaults(function=trainPan)
+
+    command = subparsers.add_parser("update", help="Merge new cell lines and genes, and refit the changed tissues")
+    command.add_argument("dataPath")
+    command.add_argument("deltaPath")
+    command.add_argument("labelFileName")
+    command.add_argument("--targets", nargs="+", default=["DE", "CNV", "SURV"], choices=["DE", "CNV", "SURV"])
+    command.add_argument("--exclude", default="DE_and_CNV", choices=["DE_and_CNV", "CNV_only"])
+    command.add_argument("--savepath", default="./../models/")
+    command.add_argument("--state", dest="statePath", default="./../output/.incremental/")
+    command.set_defaults(function=update)
+
+    command = subparsers.add_parser("predict", help="Label a tumor model with a saved model")
+    command.add_argument("model")
+    command.add_argument("filename")
+    command.add_argument("labelFileName")
+    command.add_argument("--exclude", default="DE_and_CNV", choices=["DE_and_CNV", "CNV_only"])
+    command.add_argument("--output", default=None)
+    command.set_defaults(function=predict)
+
+    command = subparsers.add_parser("figures", help="Render the figures from the summary tables")
+    command.add_argument("tablePath")
+    command.add_argument("savepath")
+    command.add_argument("--workers", type=int, default=None)
+    command.add_argument("--format", dest="fmt", default="svg")
+    command.set_defaults(function=figures)
+    return parser
+
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    # The original interface took the training arguments directly: metoncofit.py <file> <target> <exclude> <labels>
+    if len(arguments) == 4 and arguments[0] not in ["check", "train", "train-pan", "update", "validate",
+                                                                 "predict", "figures"]:
+        arguments = ["train"] + arguments
+    args = parser().parse_args(arguments)
+    if args.command is None:
+        parser().print_help()
+        sys.exit(1)
+    args.function(args)
@@ -2,7 +2,7 @@
 #Main Figures 2-5 (With additional supplementary figures --> the first three for every cancer)
 
 # Figure 2: Differential expression
-python3 metoncofit.py ~/Data/MetOncoFit/median/breast.csv DE DE_and_CNV ~/Data/MetOncoFit/labels/real_headers.txt
+python3 metoncofit.py train ~/Data/MetOncoFit/median/breast.csv DE DE_and_CNV ~/Data/MetOncoFit/labels/real_headers.txt
 #python3 metoncofit.py melanoma.csv TCGA_annot var_excl
 
 # Figure 3: Predicing copy number variation
@@ -1,26 +1,74 @@
 
 
-def make_hr_statistics_table(file, targ):
+import pandas as pd
+
+# The label column of each target in the tumor model files
+targetColumns = {'DE': 'TCGA_annot', 'CNV': 'CNV', 'SURV': 'SURV'}
+
+# The HR thresholds of the lax / median / stringent model directories
+hr_threshold_dirs = {
+    './../data/lax/': 'lax',
+    './../data/median/': 'median',
+    './../data/stringent/': 'stringent'
+}
+
+
+def _data_preparation():
+    try:
+        from utils import DataPreparation
+    except ImportError:
+        import DataPreparation
+    return DataPreparation
+
+
+def make_hr_statistics_table(file, targ, labelFileName=None, thresholds=None):
     """
+    make_hr_statistics_table returns the label frequencies of a tumor model for one HR threshold.
+
+    targ is the target ('DE', 'CNV' or 'SURV'). If labelFileName is given, the DE and CNV labels are derived from the
+    stored fold change and gain/loss values of the model (see DataPreparation.ThresholdDataset), so one base model
+    serves every threshold. The threshold is then either given, or taken from the lax / median / stringent directory
+    of the file. Otherwise the labels stored in the file are counted.
     """
-    hr_dataset_type = file
+    DataPreparation = _data_preparation()
+    if targ not in targetColumns:
+        raise ValueError("The target must be one of " + ", ".join(targetColumns) + ", not '" + str(targ) + "'")
+
     cancer_tissue = file.split('.')[0].split('/')[-1]
-    if './../data/lax/' in hr_dataset_type:
-        hr_threshold = "[0.90 - 1.10]"
-    elif './../data/median/' in hr_dataset_type:
-        hr_threshold = "[0.75 - 1.33]"
-    elif './../data/stringent/' in hr_dataset_type:
-        hr_threshold = "[0.50 - 2.00]"
-    else:
+    if thresholds is None:
+        for directory, name in hr_threshold_dirs.items():
+            if directory in file:
+                thresholds = name
+    if thresholds is None:
         print("Error: no file input")
+        return None
+    if isinstance(thresholds, str):
+        thresholds = DataPreparation.thresholdSets[thresholds]
+    hr_threshold = "[%.2f - %.2f]" % tuple(thresholds)
 
-    df = pd.read_csv(file)
-    target_label_frequency = df[targ].value_counts()
+    if labelFileName is None:
+        column = targetColumns[targ]
+        target_label_frequency = pd.read_csv(file, usecols=[column])[column].value_counts()
+    else:
+        dataset = DataPreparation.loadThresholdDataset(file, labelFileName)
+        target_label_frequency = dataset.labels(targ, thresholds).value_counts()
     hr_statistics_table = pd.DataFrame(target_label_frequency).reset_index()
-    hr_statistics_table = hr_statistics_table.rename(
-        {targ: "Label Frequency", "index": "Label"}, axis='columns')
+    hr_statistics_table.columns = ["Label", "Label Frequency"]
     hr_statistics_table["Cancer Type"] = cancer_tissue
     hr_statistics_table["Prediction Target"] = targ
     hr_statistics_table["HR Thresholds"] = hr_threshold
 
-    return freq
+    return hr_statistics_table
+
+
+def make_hr_threshold_tables(file, targ, labelFileName, thresholds=None):
+    """
+    make_hr_threshold_tables returns the DE or CNV label frequencies of one base model for every HR threshold. The
+    model is parsed and scaled once, and the labels for each threshold are derived from the stored fold change and
+    gain/loss values instead of reading the lax / median / stringent copies.
+    """
+    if thresholds is None:
+        thresholds = _data_preparation().thresholdSets
+
+    tables = [make_hr_statistics_table(file, targ, labelFileName, threshold) for threshold in thresholds.values()]
+    return pd.concat(tables, ignore_index=True)
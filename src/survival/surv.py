@@ -9,53 +9,220 @@ To label the survival data, I will do the following:
 @author: Scott Campit
 """
 import os
+import itertools
+
+import numpy as np
 import pandas as pd
 
 
-def make_surv(input, cox, hr_up, hr_low, filename='str'):
+# Filters
+cancers = ["Breast cancer", "Ovarian cancer", "Colorectal cancer", "Lung cancer",
+           "Prostate cancer", "Skin cancer", "Brain cancer", "Renal cell carcinoma", "Blood cancer"]
+
+# Label codes used by the threshold sweep. Code -1 marks probes that the thresholds leave unlabeled.
+surv_labels = np.array(["UPREG", "NEUTRAL", "DOWNREG"])
+
+# (Cox p-value, upper HR, lower HR) used for the models in data/lax, data/median and data/stringent
+hr_thresholds = {
+    'lax': (0.05, 1.10, 0.90),
+    'median': (0.05, 1.33, 0.75),
+    'stringent': (0.05, 2.00, 0.50)
+}
+
+_prognoscan_cache = {}
+
+
+def load_prognoscan(input):
     """
-    make_surv will make a csv file containing the annotations by the Cox p-value and Hazard Ratio thresholds specified by the user. This file needs to be manually edited for multiple modes.
+    load_prognoscan parses the PrognoScan workbook into a numeric table containing the gene, cancer type, hazard ratio
+    and Cox p-value of every probe. The table is cached in memory and as a pickle next to the workbook, so the workbook
+    is only read again after it changes.
     """
-    # Filters
-    remove_col = ["TYPE", "ID_DESCRIPTION", "DATA_POSTPROCESSING", "DATASET", "SUBTYPE", "ENDPOINT", "COHORT", "CONTRIBUTOR",
-                  "PROBE ID", "ARRAY TYPE", "N", "CUTPOINT", "MINIMUM P-VALUE", "CORRECTED P-VALUE", "ln(HR-high / HR-low)", "ln(HR)"]
-    cancers = ["Breast cancer", "Ovarian cancer", "Colorectal cancer", "Lung cancer",
-               "Prostate cancer", "Skin cancer", "Brain cancer", "Renal cell carcinoma", "Blood cancer"]
+    mtime = os.path.getmtime(input)
+    key = (os.path.abspath(input), mtime)
+    if key in _prognoscan_cache:
+        return _prognoscan_cache[key]
 
-    # Process data and only get the COX P-value and Hazard ratio
-    df = pd.read_excel(input)
-    df = df.drop(columns=remove_col, axis=1)
-    df["HR [95% CI-low CI-upp]"] = df["HR [95% CI-low CI-upp]"].str.replace(
-        '\[(.*?)\]', '', regex=True)
-    df = df[df["CANCER TYPE"].isin(cancers)]
-    df["HR [95% CI-low CI-upp]"] = df["HR [95% CI-low CI-upp]"].apply(
-        pd.to_numeric)
-    df["SURV"] = ""
+    cache_file = os.path.splitext(input)[0] + '.pkl'
+    if os.path.exists(cache_file) and os.path.getmtime(cache_file) >= mtime:
+        table = pd.read_pickle(cache_file)
+    else:
+        # Process data and only get the COX P-value and Hazard ratio
+        df = pd.read_excel(input, usecols=["ID_NAME", "CANCER TYPE", "HR [95% CI-low CI-upp]", "COX P-VALUE"])
+        df = df[df["CANCER TYPE"].isin(cancers)]
+        hr = df["HR [95% CI-low CI-upp]"].astype(str).str.replace(
+            '\\[(.*?)\\]', '', regex=True)
+        table = pd.DataFrame({
+            "ID_NAME": df["ID_NAME"].values,
+            "CANCER TYPE": pd.Categorical(df["CANCER TYPE"].values),
+            "HR": pd.to_numeric(hr, errors='coerce').values,
+            "COX P-VALUE": pd.to_numeric(df["COX P-VALUE"], errors='coerce').values
+        })
+        table.to_pickle(cache_file)
+
+    _prognoscan_cache[key] = table
+    return table
 
-    # Make the actual labels
-    df["SURV"].loc[(df["HR [95% CI-low CI-upp]"] >= hr_up)
-                   & (df["COX P-VALUE"] <= cox)] = "UPREG"
-    df["SURV"].loc[(df["HR [95% CI-low CI-upp]"] <= hr_low)
-                   & (df["COX P-VALUE"] <= cox)] = "DOWNREG"
-    df["SURV"].loc[(df["HR [95% CI-low CI-upp]"] >= hr_up)
-                   & (df["COX P-VALUE"] > cox)] = "NEUTRAL"
-    df["SURV"].loc[(df["HR [95% CI-low CI-upp]"] <= hr_low)
-                   & (df["COX P-VALUE"] > cox)] = "NEUTRAL"
-    df["SURV"].loc[(df["HR [95% CI-low CI-upp]"] < hr_up)
-                   & (df["HR [95% CI-low CI-upp]"] > hr_low)] = "NEUTRAL"
+
+def threshold_grid(cox, hr_up, hr_low):
+    """
+    threshold_grid returns every combination of the Cox p-value, upper HR and lower HR thresholds, keyed by a name
+    that can be used as a file name.
+    """
+    grid = {}
+    for c, up, low in itertools.product(cox, hr_up, hr_low):
+        grid['cox%g_hr%g-%g' % (c, low, up)] = (c, up, low)
+    return grid
+
+
+def label_grid(table, thresholds):
+    """
+    label_grid labels every probe for a list of (cox, hr_up, hr_low) thresholds at once. The comparisons are
+    broadcast over a probes x thresholds array, which gives the same labels as applying make_surv to each setting:
+      * HR >= hr_up and Cox p-value <= cox is UPREG
+      * HR <= hr_low and Cox p-value <= cox is DOWNREG
+      * Everything else with a HR is NEUTRAL
+
+    :return:
+        codes: An int8 numpy array of shape (probes, thresholds) with indices into surv_labels, or -1 if unlabeled.
+    """
+    cox, hr_up, hr_low = np.asarray(thresholds, dtype=float).reshape(-1, 3).T
+    hr = table["HR"].to_numpy(dtype=float)[:, np.newaxis]
+    pvalue = table["COX P-VALUE"].to_numpy(dtype=float)[:, np.newaxis]
+
+    significant = pvalue <= cox
+    outside = (hr >= hr_up) | (hr <= hr_low)
+
+    codes = np.ones((hr.shape[0], cox.shape[0]), dtype=np.int8)
+    codes[(hr >= hr_up) & significant] = 0
+    codes[(hr <= hr_low) & significant] = 2
+    codes[np.isnan(hr) | (outside & np.isnan(pvalue))] = -1
+    return codes
+
+
+def _group_max(flat, values, size):
+    """
+    _group_max returns the largest value for each flat group index, or -inf for groups without values.
+    """
+    out = np.full(size, -np.inf)
+    order = np.lexsort((values, flat))
+    flat, values = flat[order], values[order]
+    last = np.append(flat[1:] != flat[:-1], True)
+    out[flat[last]] = values[last]
+    return out
+
+
+def vote_labels(table, codes, tiebreak='hr'):
+    """
+    vote_labels collapses the probe labels to one label per (gene, cancer type) by majority vote. The votes are
+    counted with integer codes for every group and threshold setting in one pass, and ties are broken by a rule
+    instead of returning every mode:
+      * 'hr':      the label of the probe with the strongest hazard ratio (largest |ln HR|)
+      * 'cox':     the label of the probe with the lowest Cox p-value
+      * 'neutral': NEUTRAL
+    Unlabeled probes do not vote, and genes without a labeled probe are NEUTRAL.
+
+    :params:
+        table:    The PrognoScan table from load_prognoscan.
+        codes:    The (probes, thresholds) label codes from label_grid.
+        tiebreak: A string denoting the tie-break rule.
+
+    :return:
+        keys:     A pandas dataframe with the ID_NAME and CANCER TYPE of every group.
+        winners:  An int8 numpy array of shape (groups, thresholds) with indices into surv_labels.
+    """
+    codes = np.asarray(codes).reshape(len(table), -1)
+    groups, keys = pd.MultiIndex.from_arrays(
+        [table["ID_NAME"], table["CANCER TYPE"]]).factorize(sort=True)
+    n_groups, n_labels, n_settings = len(keys), len(surv_labels), codes.shape[1]
+
+    # One flat index over (setting, group, label)
+    setting = np.broadcast_to(np.arange(n_settings), codes.shape)
+    voted = codes >= 0
+    flat = (setting[voted].astype(np.int64) * n_groups + np.broadcast_to(groups[:, np.newaxis], codes.shape)[voted]) \
+        * n_labels + codes[voted]
+    size = n_settings * n_groups * n_labels
+    counts = np.bincount(flat, minlength=size).reshape(n_settings, n_groups, n_labels)
+
+    if tiebreak == 'hr':
+        strength = np.abs(np.log(table["HR"].to_numpy(dtype=float)))
+    elif tiebreak == 'cox':
+        strength = -table["COX P-VALUE"].to_numpy(dtype=float)
+    elif tiebreak == 'neutral':
+        strength = None
+    else:
+        raise ValueError("tiebreak must be one of 'hr', 'cox' or 'neutral'")
+
+    neutral = np.flatnonzero(surv_labels == "NEUTRAL")[0]
+    top = counts == counts.max(axis=2, keepdims=True)
+    if strength is None:
+        # Any tie for the most votes is NEUTRAL, whether or not NEUTRAL is one of the tied labels
+        winners = np.argmax(counts, axis=2).astype(np.int8)
+        winners[top.sum(axis=2) > 1] = neutral
+    else:
+        strength = np.broadcast_to(strength[:, np.newaxis], codes.shape)[voted]
+        strength = np.where(np.isnan(strength), -np.inf, strength)
+        score = _group_max(flat, strength, size).reshape(counts.shape)
+        winners = np.argmax(np.where(top, score, -np.inf), axis=2).astype(np.int8)
+    winners[counts.sum(axis=2) == 0] = neutral
+
+    keys = keys.to_frame(index=False, name=["ID_NAME", "CANCER TYPE"])
+    return keys, winners.T
+
+
+def make_surv_sweep(input, thresholds=None, savepath='./', write=True, tiebreak='hr'):
+    """
+    make_surv_sweep labels the PrognoScan probes for a whole grid of thresholds from one parse of the workbook, and
+    writes one labels file per threshold setting named after its key.
+
+    :params:
+        input:      The path to the PrognoScan workbook.
+        thresholds: A dictionary mapping a name to a (cox, hr_up, hr_low) tuple. The default is hr_thresholds.
+        savepath:   The directory the labels files are written to.
+        write:      A boolean denoting whether to write the labels files.
+        tiebreak:   A string denoting how vote_labels breaks ties ('hr', 'cox' or 'neutral').
+
+    :return:
+        labels:     A pandas dataframe with the ID_NAME and CANCER TYPE columns and one label column per setting.
+    """
+    if thresholds is None:
+        thresholds = hr_thresholds
+    names = list(thresholds)
+
+    table = load_prognoscan(input)
+    codes = label_grid(table, [thresholds[name] for name in names])
 
     # Majority vote on the labels if there are multiple genes and they each have different labels
-    df = df.groupby(['ID_NAME', 'CANCER TYPE'])[
-                    'SURV'].agg(pd.Series.mode).to_frame()
-    df = df.reset_index()
+    labels, winners = vote_labels(table, codes, tiebreak=tiebreak)
+    for j, name in enumerate(names):
+        labels[name] = surv_labels[winners[:, j]]
+
+    if write:
+        for name in names:
+            out = labels[['ID_NAME', 'CANCER TYPE', name]].rename(columns={name: 'SURV'})
+            out.to_excel(os.path.join(savepath, name + '.xlsx'), index=False)
 
-    # I physically edited the xlsx file. Need to devise conditional rule set to automatically determine labels for multiple modes
-    df.to_excel(filename+'.xlsx', index=False)
+    return labels
+
+
+def make_surv(input, cox, hr_up, hr_low, filename='str', tiebreak='hr'):
+    """
+    make_surv will make a xlsx file containing the annotations by the Cox p-value and Hazard Ratio thresholds specified by the user. Genes with several probes get a single label by majority vote (see vote_labels).
+    """
+    return make_surv_sweep(input, {filename: (cox, hr_up, hr_low)}, tiebreak=tiebreak)
 
 # Make labels
 #make_surv("./../raw/prognoscan/prognoscan.xlsx", cox=0.05, hr_up=1.1, hr_low=0.9, filename='lax')
 #make_surv("./../raw/prognoscan/prognoscan.xlsx", cox=0.05, hr_up=2.0, hr_low=0.5, filename='stringent')
 
+# Make the lax, median and stringent labels in one pass
+#make_surv_sweep("./../raw/prognoscan/prognoscan.xlsx", hr_thresholds)
+
+# Threshold sensitivity study
+#make_surv_sweep("./../raw/prognoscan/prognoscan.xlsx",
+#                threshold_grid([0.01, 0.05], [1.1, 1.33, 1.5, 2.0], [0.9, 0.75, 0.67, 0.5]),
+#                savepath="./../raw/prognoscan/sweep/")
+
 def count_prognoscan(input):
     """
     Another sanity check
@@ -80,63 +247,120 @@ def count_prognoscan(input):
 
 #count_prognoscan("./raw/prognoscan/prognoscan.xlsx")
 
-def make_model(labels, filpath, filname):
+# PrognoScan cancer types mapped to the tissue model file names
+tissue_names = {
+    'Breast cancer': 'breast',
+    'Brain cancer': 'cns',
+    'Colorectal cancer': 'colon',
+    'Blood cancer': 'leukemia',
+    'Skin cancer': 'melanoma',
+    'Lung cancer': 'nsclc',
+    'Ovarian cancer': 'ovarian',
+    'Prostate cancer': 'prostate',
+    'Renal cell carcinoma': 'renal'
+    }
+
+
+def surv_lookup(labels):
     """
-    make_model makes new model and integrates the labels specified in the make_surv function.
+    surv_lookup returns a gene x tissue table of survival labels from the labels workbook (or dataframe) written by
+    make_surv, so a model can be labeled with a single gene-keyed reindex.
     """
-    canc_dict = {
-        'Breast cancer': 'breast',
-        'Brain cancer': 'cns',
-        'Colorectal cancer': 'colon',
-        'Blood cancer': 'leukemia',
-        'Skin cancer': 'melanoma',
-        'Lung cancer': 'nsclc',
-        'Ovarian cancer': 'ovarian',
-        'Prostate cancer': 'prostate',
-        'Renal cell carcinoma': 'renal'
-        }
+    df = pd.read_excel(labels) if isinstance(labels, str) else labels
+    df = df.replace({'CANCER TYPE': tissue_names})
+    return df.pivot_table(index='ID_NAME', columns='CANCER TYPE', values='SURV', aggfunc='first')
 
-    if filpath is None:
-        filpath = r"./data/original/"
 
-    # Skip pan cancer model
-    if filname == 'complex.csv':
-        pass
+def label_model(model, lookup, canc):
+    """
+    label_model replaces the survival labels of a tissue model (or a chunk of one) with the labels in lookup. Genes
+    without a label are NEUTRAL.
+    """
+    # Drop existing survival labels
+    model = model.drop(columns="SURV", errors='ignore')
+
+    if canc in lookup.columns:
+        model["SURV"] = lookup[canc].reindex(model["Gene"]).to_numpy()
+    else:
+        model["SURV"] = np.nan
+    model["SURV"] = model["SURV"].fillna('NEUTRAL')
 
-    df = pd.read_excel(labels)
-    df = df.replace({'CANCER TYPE': canc_dict})
+    columns = ['Gene', 'Cell Line'] + [col for col in model.columns if col not in ('Gene', 'Cell Line')]
+    return model[columns]
+
+
+def make_model(labels, filpath, filname, savepath='./../data/stringent/'):
+    """
+    make_model makes new model and integrates the labels specified in the make_surv function.
+    """
+    if filpath is None:
+        filpath = r"./data/original/"
 
     # Read in the existing model and format it for our analysis
-    model = pd.read_csv(filpath+fil)
+    model = pd.read_csv(os.path.join(filpath, filname))
     canc, _ = os.path.splitext(filname)
 
-    # Drop existing survival labels
-    model = model.drop(columns="SURV", axis=1)
+    model = label_model(model, surv_lookup(labels), canc)
+    model.to_csv(os.path.join(savepath, canc+'.csv'), index=False)
+    return model
 
-    # Create new survival label as empty and populate later
-    tmp = df[df["CANCER TYPE"] == canc]
-    tmp = tmp.drop(columns='CANCER TYPE')
 
-    model = pd.merge(model, tmp, how='left', left_on='Gene',
-                     right_on='ID_NAME').drop(columns='ID_NAME')
-    model = model.fillna('NEUTRAL')
+def make_all_models(labels, filpath=None, savepath='./../data/stringent/', pan_cancer='complex.csv',
+                    chunksize=100000):
+    """
+    make_all_models integrates the survival labels into every tissue model and builds the pan cancer model in one
+    streaming pass. The labels are read once into a gene-keyed table, and each model is read in chunks that are
+    written both to its tissue file and to the pan cancer file. The pan cancer model has the union of the tissue
+    columns, as pd.concat would give, and a tissue without a column has empty values in it.
 
-    model = model.set_index(['Gene', 'Cell Line'])
-    model = model.reset_index()
-    model.to_csv('./../data/stringent/'+canc+'.csv', index=False)
-    return model
+    :params:
+        labels:     The path to the labels workbook from make_surv, or the labels dataframe.
+        filpath:    The directory containing the tissue models.
+        savepath:   The directory the labeled models are written to.
+        pan_cancer: The file name of the pan cancer model. It is skipped as an input and rebuilt in savepath.
+        chunksize:  The number of rows read at a time.
+
+    :return:
+        written:    A dictionary mapping each tissue to the path of its labeled model.
+    """
+    if filpath is None:
+        filpath = r"./data/original/"
+
+    lookup = surv_lookup(labels)
+    files = sorted(fil for fil in os.listdir(filpath) if fil.endswith('.csv') and fil != pan_cancer)
+
+    # Each output is written to a temporary file in savepath and moved into place once its input has been read, so
+    # relabeling the models in place (savepath == filpath) never truncates an input before it is read
+    def temporary(fil):
+        return os.path.join(savepath, '.' + fil + '.' + str(os.getpid()) + '.tmp')
+
+    # The headers are read first, so every pan cancer row has the union of the columns in order of appearance
+    complex_columns = []
+    for fil in files:
+        header = pd.read_csv(os.path.join(filpath, fil), nrows=0)
+        for column in label_model(header, lookup, os.path.splitext(fil)[0]).columns:
+            if column not in complex_columns:
+                complex_columns.append(column)
+
+    written = {}
+    with open(temporary(pan_cancer), 'w', newline='') as complex_out:
+        pd.DataFrame(columns=complex_columns).to_csv(complex_out, index=False)
+        for fil in files:
+            canc, _ = os.path.splitext(fil)
+            with open(temporary(fil), 'w', newline='') as out:
+                header = True
+                for chunk in pd.read_csv(os.path.join(filpath, fil), chunksize=chunksize):
+                    chunk = label_model(chunk, lookup, canc)
+                    chunk.to_csv(out, index=False, header=header)
+                    header = False
+                    chunk.reindex(columns=complex_columns).to_csv(complex_out, index=False, header=False)
+            os.replace(temporary(fil), os.path.join(savepath, fil))
+            written[canc] = os.path.join(savepath, fil)
+    os.replace(temporary(pan_cancer), os.path.join(savepath, pan_cancer))
+
+    return written
 
 #path = r"./../data/original/"
-#folder = os.listdir(path)
-
-## Make cell line specific models
-#for fil in folder:
-#    model = make_model(r'./stringent.xlsx', filpath=path, filname=fil)
-
-# Make the pan cancer model
-#complex = []
-#for fil in folder:
-#    model = make_model(path, fil)
-#    complex.append(model)
-#df = pd.concat(complex)
-#df.to_csv('./data/lax/complex.csv', index=False)
+
+## Make the cell line specific models and the pan cancer model
+#make_all_models(r'./stringent.xlsx', filpath=path, savepath='./../data/stringent/')
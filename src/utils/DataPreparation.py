@@ -5,13 +5,20 @@ DataPreparation.py contains the functions that sets up the data to be fit into t
 
 @authors: Krishna Dev Oruganty & Scott Edward Campit
 """
+import os
 import sys
 import warnings
 
 import numpy as np
 import pandas as pd
-from sklearn import preprocessing
 
+try:
+    from utils import tracing
+except ImportError:
+    import tracing
+
+
+@tracing.traced("parse")
 def load_data(model_file, labelFileName):
     """
     load_data reads in the cancer model data (.csv file) and outputs a pandas dataframe.
@@ -26,7 +33,10 @@ def load_data(model_file, labelFileName):
         cancer:     A string denoting the tissue type from the name of the .csv file.
     """
 
-    import PrettifyLabels
+    try:
+        from utils import PrettifyLabels
+    except ImportError:
+        import PrettifyLabels
 
     column_names = PrettifyLabels.long_feature_names(labelFileName)
     cancer = model_file.strip(".")[0]
@@ -37,29 +47,34 @@ def load_data(model_file, labelFileName):
     return model, cancer
 
 
-def label_encode(model):
+@tracing.traced("encode")
+def label_encode(model, grow=False):
     """
-    label_encode uses the label_encoder function from scikit-learn for the RECON1 subsystem and Metabolic subnetwork
-        features. Note that these features may be removed in future MetOncoFit versions.
+    label_encode encodes the RECON1 subsystem and Metabolic subnetwork features with the global int16 codes in
+        utils.vocabulary, so a category has the same code in every tissue model. Note that these features may be removed
+        in future MetOncoFit versions.
 
     :params:
         model:               A pandas dataframe containing the cancer model data, with observations as rows and
             features as columns.
+        grow (optional):     A boolean denoting whether categories that are not in the vocabulary yet are added to it.
+            Only training adds categories. Otherwise they are encoded as -1.
 
     :return:
         label_encoded_model: A panda dataframe of the label-encoded model.
     """
 
-    label_encoder = preprocessing.LabelEncoder()
-    model['RECON1 subsystem'] = label_encoder.fit_transform(
-        model['RECON1 subsystem'])
-    model['Metabolic subnetwork'] = label_encoder.fit_transform(
-        model['Metabolic subnetwork'])
-    label_encoded_model = model.copy(deep=True)
+    try:
+        from utils import vocabulary
+    except ImportError:
+        import vocabulary
+
+    label_encoded_model = vocabulary.encodeColumns(model, grow=grow)
 
     return label_encoded_model
 
 
+@tracing.traced("prune")
 def prune_targets(model, target="DE", exclude="DE_and_CNV"):
     """
     prune_targets removes values that determined the target labels from the label encoded model.
@@ -80,11 +95,11 @@ def prune_targets(model, target="DE", exclude="DE_and_CNV"):
         - 'CNV_only':   Removes fold change values for copy number variation only.
     """
     label_encoded_model = model.copy(deep=True)
-    if exclude is 'DE_and_CNV':
+    if exclude == 'DE_and_CNV':
         label_encoded_model = label_encoded_model.drop(['TCGA gene expression fold change',
-                                                        'CNV gain/loss ratio'])
-    elif exclude is 'CNV_only':
-        label_encoded_model = label_encoded_model.drop(['CNV gain/loss ratio'])
+                                                        'CNV gain/loss ratio'], axis=1)
+    elif exclude == 'CNV_only':
+        label_encoded_model = label_encoded_model.drop(['CNV gain/loss ratio'], axis=1)
 
     targetVariables = {'DE':'TCGA annotation',
                        'CNV':'CNV',
@@ -98,24 +113,32 @@ def prune_targets(model, target="DE", exclude="DE_and_CNV"):
     return pruned_model, classes
 
 
-def robust_scaler(model):
+@tracing.traced("scale")
+def robust_scaler(model, statistics=None):
     """
     robust_scaler uses the scikit-learn RobustScaler function to scale the data using the interquartile ranges.
 
     :params:
-        model: A pandas dataframe containing the model without the target labels
+        model:      A pandas dataframe containing the model without the target labels
+        statistics: A pandas dataframe with the center and scale rows of every feature (see
+            incremental.scalerStatistics). If it is given, the model is scaled with these statistics instead of
+            refitting the scaler.
 
     :return:
         robust_model: A pandas dataframe containing the model that has been standardized by the IQR
     """
     from sklearn.preprocessing import RobustScaler
 
-    data = np.array(model).astype(np.float)
+    data = np.array(model).astype(float)
+    if statistics is not None:
+        statistics = statistics[list(model.columns)]
+        return (data - statistics.loc["center"].to_numpy()) / statistics.loc["scale"].to_numpy()
     robust_model = RobustScaler(with_centering=True, with_scaling=True).fit_transform(data)
 
     return robust_model
 
 
+@tracing.traced("oversample")
 def randomOversampling(model, classes, testSize=0.2):
     """
     randomOversampling takes a pandas dataframe and attempts to perform naive random oversampling on classes that are
@@ -145,18 +168,151 @@ def randomOversampling(model, classes, testSize=0.2):
     over_sampler = RandomOverSampler(sampling_strategy='auto',
                                      random_state=1)
 
-    Xtrain, Ytrain = over_sampler.fit_sample(Xtrain, Ytrain)
+    Xtrain, Ytrain = over_sampler.fit_resample(Xtrain, Ytrain)
 
     return Xtrain, Xtest, Ytrain, Ytest
 
-def processDataFromFile(filename, target, exclude, labelFileName):
-    model, cancer = load_data(filename, labelFileName)
-    labelEncodedModel = label_encode(model)
-    prunedModels, classes = prune_targets(labelEncodedModel, target, exclude)
-    robustModel = robust_scaler(prunedModels)
-    Xtrain, Xtest, Ytrain, Ytest = randomOversampling(robustModel, classes, testSize=0.2)
+def processDataFromFile(filename, target, exclude, labelFileName, thresholds=None, scalerStatistics=None):
+    """
+    processDataFromFile reads, encodes, scales and splits a tumor model.
+
+    :params:
+        thresholds (optional): A (low, high) tuple or a key of thresholdSets. If it is given, the labels are derived
+            from the fold change / gain-loss values with these thresholds (DE and CNV only), and the parsed and
+            scaled model is reused across calls (see ThresholdDataset).
+        scalerStatistics (optional): The stored center and scale of every feature (see robust_scaler).
+    """
+    tissue = os.path.splitext(os.path.basename(filename))[0]
+    with tracing.tags(tissue=tissue, target=target):
+        if thresholds is not None:
+            dataset = loadThresholdDataset(filename, labelFileName, exclude)
+            return dataset.split(target, thresholds, testSize=0.2)
+
+        model, cancer = load_data(filename, labelFileName)
+        labelEncodedModel = label_encode(model, grow=True)
+        prunedModels, classes = prune_targets(labelEncodedModel, target, exclude)
+        robustModel = robust_scaler(prunedModels, scalerStatistics)
+        Xtrain, Xtest, Ytrain, Ytest = randomOversampling(robustModel, classes, testSize=0.2)
     return Xtrain, Xtest, Ytrain, Ytest
 
+# Label thresholds (low, high) of the models in data/lax, data/median and data/stringent
+thresholdSets = {
+    'lax': (0.90, 1.10),
+    'median': (0.75, 1.33),
+    'stringent': (0.50, 2.00)
+}
+
+# The values each target label is derived from. The tumor models do not store the hazard ratios the SURV labels come
+# from (see survival/surv.py), so SURV can only use the labels stored in the model files.
+thresholdSources = {
+    'DE': 'TCGA gene expression fold change',
+    'CNV': 'CNV gain/loss ratio'
+}
+
+
+def thresholdLabels(values, target, low, high):
+    """
+    thresholdLabels labels fold change or hazard ratio values: values at or above high are up-regulated / gained,
+    values at or below low are down-regulated / lost, and everything else is neutral.
+
+    :params:
+        values: A pandas series containing the fold change or hazard ratio values.
+        target: A string denoting the target variable ('DE', 'CNV' or 'SURV').
+        low:    A float denoting the lower threshold.
+        high:   A float denoting the upper threshold.
+
+    :return:
+        labels: A pandas series containing the target labels.
+    """
+    if target == 'CNV':
+        up, neutral, down = "GAIN", "NEUT", "LOSS"
+    else:
+        up, neutral, down = "UPREG", "NEUTRAL", "DOWNREG"
+
+    index = values.index
+    values = values.to_numpy(dtype=float)
+    labels = np.select([values >= high, values <= low], [up, down], default=neutral)
+    return pd.Series(labels, index=index)
+
+
+class ThresholdDataset():
+    """
+    ThresholdDataset parses, label encodes and robust scales a tumor model once, and derives the DE and CNV labels for
+    any threshold from the stored fold change and gain/loss values when they are requested. One base dataset therefore
+    replaces the lax / median / stringent copies of the model for these targets.
+    """
+
+    def __init__(self, filename, labelFileName, exclude="DE_and_CNV"):
+        """
+        :params:
+            filename:      The path to the .csv file containing the base tumor model.
+            labelFileName: The path to the file mapping the column names to the feature names.
+            exclude:       A string denoting which fold change values are removed from the features (see
+                prune_targets).
+        """
+        model, self.cancer = load_data(filename, labelFileName)
+        model = label_encode(model, grow=True)
+
+        sources = [column for column in thresholdSources.values() if column in model.columns]
+        self.sources = model[sources].astype(float)
+        self.storedLabels = model[["TCGA annotation", "CNV", "SURV"]]
+
+        prunedModel, _ = prune_targets(model, "DE", exclude)
+        self.features = prunedModel.columns
+        self.index = prunedModel.index
+        self.X = robust_scaler(prunedModel)
+        self.labelCache = {}
+
+    def labels(self, target, thresholds=None):
+        """
+        labels returns the target labels for a threshold, computing them the first time they are requested.
+
+        :params:
+            target:     A string denoting the target variable ('DE', 'CNV' or 'SURV').
+            thresholds: A (low, high) tuple or a key of thresholdSets. The default returns the labels stored in the
+                model file. SURV only has the stored labels.
+
+        :return:
+            classes:    A pandas series containing the labels for the target variable.
+        """
+        if thresholds is None:
+            return self.storedLabels[{'DE': 'TCGA annotation', 'CNV': 'CNV', 'SURV': 'SURV'}[target]]
+        if isinstance(thresholds, str):
+            thresholds = thresholdSets[thresholds]
+
+        if target not in thresholdSources:
+            raise ValueError("The " + target + " labels can not be derived at a threshold, since the tumor models do "
+                             "not store the hazard ratios. Use the stored labels or the lax / median / stringent "
+                             "model files.")
+
+        key = (target, tuple(thresholds))
+        if key not in self.labelCache:
+            source = thresholdSources[target]
+            if source not in self.sources.columns:
+                raise ValueError("Relabeling " + target + " needs the '" + source + "' column in the base dataset")
+            self.labelCache[key] = thresholdLabels(self.sources[source], target, *thresholds)
+        return self.labelCache[key]
+
+    def split(self, target, thresholds=None, testSize=0.2):
+        """
+        split returns the oversampled train / test split of the scaled model for a target and threshold.
+        """
+        return randomOversampling(self.X, self.labels(target, thresholds), testSize=testSize)
+
+
+_thresholdDatasets = {}
+
+
+def loadThresholdDataset(filename, labelFileName, exclude="DE_and_CNV"):
+    """
+    loadThresholdDataset returns the ThresholdDataset for a model file, parsing it only the first time.
+    """
+    key = (filename, labelFileName, exclude)
+    if key not in _thresholdDatasets:
+        _thresholdDatasets[key] = ThresholdDataset(filename, labelFileName, exclude)
+    return _thresholdDatasets[key]
+
+
 def create_tissue_model(model, target):
     """
     create_tissue_model returns a tissue model containing single gene entries. The median values corresponding to each
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+cache.py is a content-addressed cache for the trained models and derived tables (the make-db figure frames and the
+permutation importances, see importance.cachedImportance). The scaler statistics are kept by utils.incremental, keyed
+by the digest of the tissue file.
+
+An artifact is stored under a key hashed from:
+    * the contents of the input files (ie: the tissue .csv and the header file)
+    * the source code of the functions that produce it
+    * the parameters (ie: target, exclusion and thresholds)
+so changing a tissue file, the code or a parameter gives a new key, and everything else is still a hit. The file
+hashes are remembered by (path, size, modification time), so unchanged inputs are not re-read.
+
+The artifacts are pickled with joblib under `<path>/objects/<2 characters>/<key>.pkl`. When the cache grows past
+maxBytes, the least recently used artifacts are removed.
+
+The default cache directory is output/.cache at the root of the repository (or METONCOFIT_CACHE), and it is only
+created when the first artifact is stored.
+
+Usage:
+    cache = ArtifactCache()
+    model = cache.cached("model", trainModel, files=[filename, labelFileName], params=dict(target=target),
+                         code=[trainModel], args=(filename, target))
+
+@author: Scott Campit
+"""
+import os
+import json
+import uuid
+import hashlib
+import pickle
+import inspect
+
+# Anchored to the repository rather than the working directory, so every script shares one cache
+defaultPath = os.environ.get(
+    "METONCOFIT_CACHE",
+    os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "output", ".cache")))
+
+# What a truncated or corrupt pickle raises when it is loaded
+_corruptErrors = (EOFError, ValueError, AttributeError, ImportError, IndexError, pickle.UnpicklingError)
+
+
+def hashFile(fileName, blockSize=1 << 20):
+    """
+    hashFile returns the SHA-1 digest of a file's contents.
+    """
+    digest = hashlib.sha1()
+    with open(fileName, "rb") as fil:
+        for block in iter(lambda: fil.read(blockSize), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def codeVersion(functions):
+    """
+    codeVersion returns a digest of the source code of the given functions (or classes and modules).
+    """
+    digest = hashlib.sha1()
+    for function in functions:
+        try:
+            source = inspect.getsource(function)
+        except (OSError, TypeError):
+            source = getattr(function, "__qualname__", repr(function))
+        digest.update(source.encode())
+    return digest.hexdigest()
+
+
+class ArtifactCache():
+    """
+    ArtifactCache stores pickled artifacts by the hash of their inputs, code and parameters.
+    """
+
+    def __init__(self, path=None, maxBytes=10 * 1024 ** 3):
+        """
+        :params:
+            path:     A string denoting the cache directory. The default is defaultPath. It is created when the first
+                artifact is stored.
+            maxBytes: An integer denoting the size the cache is trimmed to after a write. The default is 10 GB.
+        """
+        self.path = defaultPath if path is None else path
+        self.maxBytes = maxBytes
+        self.objects = os.path.join(self.path, "objects")
+        self.fileHashes = os.path.join(self.path, "files.json")
+
+    def _knownHashes(self):
+        if not os.path.exists(self.fileHashes):
+            return {}
+        try:
+            with open(self.fileHashes) as fil:
+                return json.load(fil)
+        except ValueError:
+            return {}
+
+    def fileDigests(self, fileNames):
+        """
+        fileDigests returns the content digest of each file, re-reading only the files whose size or modification
+        time changed since they were last hashed. New digests are merged into files.json under a file lock, so the
+        digests recorded by other processes are kept.
+        """
+        import fcntl
+
+        known = self._knownHashes()
+        digests = []
+        updates = {}
+        for fileName in fileNames:
+            path = os.path.abspath(fileName)
+            stat = os.stat(path)
+            stamp = [stat.st_size, stat.st_mtime_ns]
+            if path not in known or known[path][0] != stamp:
+                known[path] = updates[path] = [stamp, hashFile(path)]
+            digests.append(known[path][1])
+        if updates:
+            os.makedirs(self.path, exist_ok=True)
+            with open(self.fileHashes + ".lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                known = self._knownHashes()
+                known.update(updates)
+                temporary = self.fileHashes + "." + uuid.uuid4().hex + ".tmp"
+                with open(temporary, "w") as fil:
+                    json.dump(known, fil)
+                os.replace(temporary, self.fileHashes)
+        return digests
+
+    def key(self, kind, files=(), params=None, code=()):
+        """
+        key returns the content address of an artifact.
+
+        :params:
+            kind:   A string denoting the kind of artifact (ie: 'model', 'importance' or 'figure').
+            files:  A list of the input file paths.
+            params: A dictionary of the parameters.
+            code:   A list of the functions that produce the artifact.
+
+        :return:
+            key:    A string denoting the hexadecimal digest.
+        """
+        record = {
+            "kind": kind,
+            "files": self.fileDigests(files),
+            "params": params or {},
+            "code": codeVersion(code)
+        }
+        return hashlib.sha1(json.dumps(record, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _object(self, key):
+        return os.path.join(self.objects, key[:2], key + ".pkl")
+
+    def get(self, key, default=None):
+        """
+        get returns the artifact stored under a key, or default if there is none. An artifact that can not be
+        unpickled (ie: a truncated file) is removed and treated as missing.
+        """
+        import joblib
+
+        fileName = self._object(key)
+        try:
+            artifact = joblib.load(fileName)
+        except OSError:
+            return default
+        except _corruptErrors:
+            try:
+                os.remove(fileName)
+            except OSError:
+                pass
+            return default
+        # The modification time is the last use, for the eviction order
+        os.utime(fileName)
+        return artifact
+
+    def put(self, key, artifact):
+        """
+        put stores an artifact under a key and trims the cache to maxBytes.
+        """
+        import joblib
+
+        fileName = self._object(key)
+        os.makedirs(os.path.dirname(fileName), exist_ok=True)
+        temporary = fileName + "." + uuid.uuid4().hex + ".tmp"
+        joblib.dump(artifact, temporary)
+        os.replace(temporary, fileName)
+        self.evict()
+        return fileName
+
+    def cached(self, kind, function, files=(), params=None, code=None, args=(), kwargs=None):
+        """
+        cached returns the stored artifact for the inputs, code and parameters, and computes and stores it on a miss.
+
+        :params:
+            kind:     A string denoting the kind of artifact.
+            function: The function that computes the artifact.
+            files:    A list of the input file paths.
+            params:   A dictionary of the parameters that change the artifact.
+            code:     A list of the functions whose source is part of the key. The default is [function].
+            args:     The positional arguments of function.
+            kwargs:   The keyword arguments of function.
+        """
+        kwargs = kwargs or {}
+        key = self.key(kind, files, params, [function] if code is None else code)
+        missing = object()
+        artifact = self.get(key, missing)
+        if artifact is missing:
+            artifact = function(*args, **kwargs)
+            self.put(key, artifact)
+        return artifact
+
+    def size(self):
+        """
+        size returns the total size of the stored artifacts in bytes.
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    def _entries(self):
+        entries = []
+        for directory, _, names in os.walk(self.objects):
+            for name in names:
+                if name.endswith(".pkl"):
+                    fileName = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(fileName)
+                    except OSError:
+                        continue
+                    entries.append((fileName, stat.st_size, stat.st_mtime))
+        return entries
+
+    def evict(self, maxBytes=None):
+        """
+        evict removes the least recently used artifacts until the cache is no larger than maxBytes.
+
+        :return:
+            removed: An integer denoting the number of artifacts removed.
+        """
+        maxBytes = self.maxBytes if maxBytes is None else maxBytes
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for fileName, size, _ in entries:
+            if total <= maxBytes:
+                break
+            try:
+                os.remove(fileName)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(self):
+        """
+        clear removes every artifact.
+        """
+        return self.evict(maxBytes=0)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+incremental.py updates the tissue models when a new cell line or a batch of newly annotated genes arrives, without
+rebuilding every table and model.
+
+A delta file has the same columns as the tissue model it updates. Its rows are merged into the tissue model by
+(gene, cell line): new rows are added, and rows with the same key replace the old ones. Each row is hashed, so rows
+that are identical to the stored ones do not count as changes. Then:
+    * only the tissue files that changed are rewritten, so only their forests are refit (the fitted models are keyed
+      by the file contents in utils.cache), and only their figure frames are rebuilt by make-db.py
+    * the robust scaler statistics (median and interquartile range of each feature) are recomputed only for the
+      tissues that changed, and training uses the stored statistics instead of refitting the scaler (see
+      DataPreparation.robust_scaler)
+
+The scaler statistics of each tissue are kept in a state directory, next to the digest of the tissue file they were
+computed from. If the tissue file was changed by something else, the state is rebuilt.
+
+Usage:
+    changed = updateTissue('./../data/median/breast.csv', './../data/delta/breast.csv', './../srv/headers.txt')
+
+@author: Scott Campit
+"""
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+try:
+    from utils import cache
+except ImportError:
+    import cache
+
+# The label columns of a tumor model after the columns are renamed with the header file
+targetColumns = ["TCGA annotation", "CNV", "SURV"]
+
+defaultStatePath = './../output/.incremental/'
+
+
+def readTumorModel(fileName):
+    """
+    readTumorModel reads a tumor model with the original column names, indexed by its (gene, cell line) columns. The
+    values are parsed exactly, so a model that is written back and read again has the same row digests.
+    """
+    model = pd.read_csv(fileName, float_precision='round_trip')
+    return model.set_index(list(model.columns[:2]))
+
+
+def writeTumorModel(model, fileName):
+    """
+    writeTumorModel replaces a tumor model file atomically, so a crash never leaves a partial file.
+    """
+    temporary = fileName + "." + uuid.uuid4().hex + ".tmp"
+    model.reset_index().to_csv(temporary, index=False)
+    os.replace(temporary, fileName)
+
+
+def rowDigests(model):
+    """
+    rowDigests returns a 64-bit hash of every row of a tumor model, including its (gene, cell line) key.
+    """
+    return pd.util.hash_pandas_object(model, index=True)
+
+
+def mergeRows(model, delta):
+    """
+    mergeRows merges the rows of a delta into a tumor model.
+
+    :params:
+        model:   A pandas dataframe containing the tumor model, indexed by (gene, cell line).
+        delta:   A pandas dataframe with the same columns, containing the new or re-annotated rows.
+
+    :return:
+        merged:  A pandas dataframe of the updated tumor model. The existing rows keep their order, and the new rows
+            are added at the end.
+        changed: A pandas MultiIndex of the rows that were added or whose values changed.
+    """
+    missing = set(model.columns) - set(delta.columns)
+    if missing:
+        raise ValueError("The delta is missing the columns: " + ", ".join(sorted(missing)))
+    delta = delta[model.columns].astype(model.dtypes.to_dict(), errors='ignore')
+    delta.index.names = model.index.names
+    delta = delta[~delta.index.duplicated(keep='last')]
+
+    old = rowDigests(model)
+    new = rowDigests(delta)
+    changed = new.index[(old.reindex(new.index) != new).to_numpy()]
+    if len(changed) == 0:
+        return model, changed
+
+    replaced = model.index.isin(changed)
+    added = changed[~changed.isin(model.index)]
+    merged = pd.concat([model[~replaced], delta.loc[changed]])
+    merged = merged.reindex(model.index.append(added))
+    return merged, changed
+
+
+def scalerStatistics(model):
+    """
+    scalerStatistics returns the statistics a RobustScaler fits on the numeric features of a renamed, label encoded
+    tumor model: the median (center) and the interquartile range (scale) of every feature. Features with no spread get
+    a scale of 1, as in RobustScaler.
+    """
+    features = model.drop(columns=targetColumns, errors='ignore').select_dtypes(include=[np.number])
+    values = features.to_numpy(dtype=float)
+    q25, center, q75 = np.nanpercentile(values, [25, 50, 75], axis=0)
+    scale = q75 - q25
+    scale[scale == 0.0] = 1.0
+    return pd.DataFrame([center, scale], index=["center", "scale"], columns=features.columns)
+
+
+def _stateFile(fileName, statePath):
+    return os.path.join(statePath, os.path.splitext(os.path.basename(fileName))[0] + ".pkl")
+
+
+def loadState(fileName, statePath=defaultStatePath):
+    """
+    loadState returns the stored scaler statistics of a tissue model, or None if they are missing or were
+    computed from a different version of the file.
+    """
+    stateFile = _stateFile(fileName, statePath)
+    if not os.path.exists(stateFile) or not os.path.exists(fileName):
+        return None
+    state = pd.read_pickle(stateFile)
+    if state.get("digest") != cache.hashFile(fileName):
+        return None
+    return state
+
+
+def saveState(state, fileName, statePath=defaultStatePath):
+    """
+    saveState stores the scaler statistics of a tissue model, with the digest of the file.
+    """
+    os.makedirs(statePath, exist_ok=True)
+    stateFile = _stateFile(fileName, statePath)
+    state = dict(state, digest=cache.hashFile(fileName))
+    temporary = stateFile + "." + uuid.uuid4().hex + ".tmp"
+    pd.to_pickle(state, temporary)
+    os.replace(temporary, stateFile)
+
+
+def _features(model, labelFileName):
+    """
+    _features renames the columns of a tumor model and encodes its categorical columns, as DataPreparation does
+    before scaling. The update adds the new categories of the tissue models to the vocabulary, as training would.
+    """
+    try:
+        from utils import PrettifyLabels, vocabulary
+    except ImportError:
+        import PrettifyLabels
+        import vocabulary
+
+    model = model.rename(columns=PrettifyLabels.long_feature_names(labelFileName))
+    return vocabulary.encodeColumns(model, grow=True)
+
+
+def buildState(model, labelFileName):
+    """
+    buildState computes the scaler statistics of a whole tissue model.
+    """
+    return {"scaler": scalerStatistics(_features(model, labelFileName))}
+
+
+def updateTissue(fileName, deltaFileName, labelFileName, statePath=defaultStatePath):
+    """
+    updateTissue merges a delta into a tissue model and updates its stored scaler statistics. The tissue file is only
+    rewritten, and the statistics recomputed, if a row changed. A tissue file that does not exist yet is created from
+    the delta.
+
+    :params:
+        fileName:      The path to the tissue model .csv file.
+        deltaFileName: The path to the .csv file of new or re-annotated rows.
+        labelFileName: The path to the file mapping the column names to the feature names.
+        statePath:     A string denoting the directory of the stored scaler statistics.
+
+    :return:
+        changed:       A pandas MultiIndex of the (gene, cell line) rows that were added or changed.
+        state:         A dictionary with the scaler statistics.
+    """
+    delta = readTumorModel(deltaFileName)
+    state = loadState(fileName, statePath)
+    if os.path.exists(fileName):
+        model = readTumorModel(fileName)
+        merged, changed = mergeRows(model, delta)
+    else:
+        merged, changed = delta[~delta.index.duplicated(keep='last')], delta.index.unique()
+
+    if len(changed) == 0 and state is not None:
+        return changed, state
+    state = buildState(merged, labelFileName)
+
+    # The state is written after the tissue file, so an interrupted update leaves a stale state that is rebuilt
+    if len(changed) > 0:
+        writeTumorModel(merged, fileName)
+    saveState(state, fileName, statePath)
+    return changed, state
+
+
+def updateTissues(dataPath, deltaPath, labelFileName, statePath=defaultStatePath):
+    """
+    updateTissues applies every delta file in deltaPath to the tissue model with the same name in dataPath.
+
+    :return:
+        changed: A dictionary mapping the path of each tissue file that changed to the number of rows added or changed
+            and its scaler statistics.
+    """
+    changed = {}
+    for name in sorted(os.listdir(deltaPath)):
+        if not name.endswith(".csv"):
+            continue
+        fileName = os.path.join(dataPath, name)
+        rows, state = updateTissue(fileName, os.path.join(deltaPath, name), labelFileName, statePath)
+        if len(rows) > 0:
+            changed[fileName] = (len(rows), state["scaler"])
+    return changed
@@ -0,0 +1,480 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+jobqueue.py is a work queue for the cohort sweeps (tissues x targets x exclusions x thresholds x iterations) that
+only needs a shared directory or a local SQLite file, with no broker.
+
+A job is a task name ('module:function') and its keyword arguments. Workers claim a job with a lease, renew the lease
+with heartbeats while the job runs, and record the result. A job whose lease runs out (ie: its worker died) is handed
+to the next worker, and a job that raises is retried until it has been attempted maxAttempts times.
+
+Two backends share the same interface:
+    * SQLiteQueue:    one SQLite file. Claims are transactions, so this is the backend for the workers of one node.
+    * DirectoryQueue: one directory on a shared filesystem. Each job is a JSON file that moves between the queued,
+                      running, done and failed directories, and a claim is an atomic rename, so workers on several
+                      nodes can drain the same queue.
+
+Usage (from the src directory):
+    queue = jobqueue.openQueue('./../output/sweep.db')        # or a directory path
+    queue.submit([{'task': 'utils.validator:computeConfusionMatrix', 'kwargs': {...}}, ...])
+    python -m utils.jobqueue worker ./../output/sweep.db      # on every node / core
+    python -m utils.jobqueue status ./../output/sweep.db
+
+@author: Scott Campit
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+states = ["queued", "running", "done", "failed"]
+
+
+def _jsonDefault(value):
+    """
+    _jsonDefault converts the numpy and pandas values that task results are made of (ie: the confusion matrices of
+    validator.computeConfusionMatrix) to JSON types.
+    """
+    import numpy as np
+
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    raise TypeError("Object of type " + type(value).__name__ + " is not JSON serializable")
+
+
+def workerName():
+    """
+    workerName returns a name that is unique to this process on this node.
+    """
+    return socket.gethostname() + ":" + str(os.getpid()) + ":" + uuid.uuid4().hex[:6]
+
+
+class SQLiteQueue():
+    """
+    SQLiteQueue keeps the jobs in one table of a SQLite file.
+    """
+
+    def __init__(self, path, maxAttempts=3):
+        """
+        :params:
+            path:        A string denoting the path of the SQLite file. It is created if it does not exist.
+            maxAttempts: An integer denoting the number of times a job is attempted before it is marked failed.
+        """
+        import sqlite3
+
+        self.path = path
+        self.maxAttempts = maxAttempts
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                                       id INTEGER PRIMARY KEY,
+                                       payload TEXT NOT NULL,
+                                       state TEXT NOT NULL DEFAULT 'queued',
+                                       worker TEXT,
+                                       lease_until REAL,
+                                       attempts INTEGER NOT NULL DEFAULT 0,
+                                       result TEXT,
+                                       error TEXT)""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_until)")
+
+    def submit(self, payloads):
+        """
+        submit adds jobs to the queue and returns their ids.
+        """
+        ids = []
+        self.connection.execute("BEGIN IMMEDIATE")
+        for payload in payloads:
+            cursor = self.connection.execute("INSERT INTO jobs (payload) VALUES (?)", (json.dumps(payload),))
+            ids.append(str(cursor.lastrowid))
+        self.connection.execute("COMMIT")
+        return ids
+
+    def claim(self, worker, lease=300):
+        """
+        claim leases the next queued job (or a job whose lease has run out) to a worker.
+
+        :return:
+            job: A (job id, payload, attempt) tuple, or None if there is nothing to do.
+        """
+        now = time.time()
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._expire(now)
+            row = self.connection.execute("SELECT id, payload, attempts FROM jobs WHERE state = 'queued' "
+                                          "ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            self.connection.execute("UPDATE jobs SET state = 'running', worker = ?, lease_until = ?, "
+                                    "attempts = attempts + 1 WHERE id = ?", (worker, now + lease, row[0]))
+            return str(row[0]), json.loads(row[1]), row[2] + 1
+        finally:
+            self.connection.execute("COMMIT")
+
+    def _expire(self, now):
+        """
+        _expire requeues (or fails) the running jobs whose lease has run out.
+        """
+        self.connection.execute("UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+                                "error = 'lease expired', worker = NULL WHERE state = 'running' AND lease_until < ?",
+                                (self.maxAttempts, now))
+
+    def heartbeat(self, jobId, worker, lease=300):
+        """
+        heartbeat extends the lease of a running job. It returns False if the worker no longer holds the job.
+        """
+        cursor = self.connection.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? "
+                                         "AND state = 'running'", (time.time() + lease, int(jobId), worker))
+        return cursor.rowcount == 1
+
+    def complete(self, jobId, worker, result):
+        """
+        complete stores the result of a job held by the worker.
+        """
+        cursor = self.connection.execute("UPDATE jobs SET state = 'done', result = ?, lease_until = NULL "
+                                         "WHERE id = ? AND worker = ? AND state = 'running'",
+                                         (json.dumps(result, default=_jsonDefault), int(jobId), worker))
+        return cursor.rowcount == 1
+
+    def fail(self, jobId, worker, error):
+        """
+        fail requeues a job that raised, or marks it failed once it has been attempted maxAttempts times.
+        """
+        cursor = self.connection.execute("UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' "
+                                         "ELSE 'queued' END, error = ?, worker = NULL, lease_until = NULL "
+                                         "WHERE id = ? AND worker = ? AND state = 'running'",
+                                         (self.maxAttempts, str(error), int(jobId), worker))
+        return cursor.rowcount == 1
+
+    def status(self):
+        """
+        status returns the number of jobs in each state.
+        """
+        self.connection.execute("BEGIN IMMEDIATE")
+        self._expire(time.time())
+        self.connection.execute("COMMIT")
+        counts = dict(self.connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        return {state: counts.get(state, 0) for state in states}
+
+    def results(self):
+        """
+        results returns a dictionary mapping the job id to its payload, state, result and error.
+        """
+        rows = self.connection.execute("SELECT id, payload, state, result, error, attempts FROM jobs ORDER BY id")
+        return {str(jobId): {"payload": json.loads(payload), "state": state,
+                             "result": None if result is None else json.loads(result),
+                             "error": error, "attempts": attempts}
+                for jobId, payload, state, result, error, attempts in rows}
+
+
+class DirectoryQueue():
+    """
+    DirectoryQueue keeps each job as a JSON file in a shared directory. A job file moves from queued/ to running/ to
+    done/ (or failed/) by atomic renames, and the modification time of a running job is its last heartbeat.
+    """
+
+    def __init__(self, path, maxAttempts=3, lease=300):
+        """
+        :params:
+            path:        A string denoting the queue directory. It is created if it does not exist.
+            maxAttempts: An integer denoting the number of times a job is attempted before it is marked failed.
+            lease:       An integer denoting the default lease in seconds.
+        """
+        self.path = path
+        self.maxAttempts = maxAttempts
+        self.lease = lease
+        for state in states:
+            os.makedirs(os.path.join(path, state), exist_ok=True)
+
+    def _file(self, state, name):
+        return os.path.join(self.path, state, name)
+
+    def _write(self, fileName, record):
+        """
+        _write writes a job file through a temporary file, so readers never see a partial record.
+        """
+        temporary = fileName + "." + uuid.uuid4().hex + ".tmp"
+        with open(temporary, "w") as fil:
+            json.dump(record, fil, default=_jsonDefault)
+        os.replace(temporary, fileName)
+
+    def _read(self, fileName):
+        with open(fileName) as fil:
+            return json.load(fil)
+
+    def submit(self, payloads):
+        """
+        submit adds jobs to the queue and returns their ids.
+        """
+        ids = []
+        for payload in payloads:
+            # Time-ordered ids, so jobs are claimed in submission order
+            jobId = "%020d-%s" % (time.time() * 1e6, uuid.uuid4().hex[:8])
+            self._write(self._file("queued", jobId + ".json"), {"id": jobId, "payload": payload, "attempts": 0})
+            ids.append(jobId)
+        return ids
+
+    def _running(self):
+        """
+        _running returns the (job id, worker, file name) of every running job.
+        """
+        running = []
+        for name in os.listdir(os.path.join(self.path, "running")):
+            if name.endswith(".json"):
+                jobId, worker = name[:-len(".json")].split("@", 1)
+                running.append((jobId, worker, self._file("running", name)))
+        return running
+
+    def _expire(self, now):
+        """
+        _expire requeues (or fails) the running jobs whose last heartbeat is older than their lease.
+        """
+        for jobId, worker, fileName in self._running():
+            try:
+                record = self._read(fileName)
+                if os.path.getmtime(fileName) + record.get("lease", self.lease) >= now:
+                    continue
+                # Only one worker wins the rename of an expired job
+                expired = fileName + ".expired"
+                os.rename(fileName, expired)
+            except (OSError, ValueError):
+                continue
+            record["error"] = "lease expired"
+            state = "failed" if record["attempts"] >= self.maxAttempts else "queued"
+            self._write(self._file(state, jobId + ".json"), record)
+            os.remove(expired)
+
+    def claim(self, worker, lease=None):
+        """
+        claim leases the next queued job (or a job whose lease has run out) to a worker.
+
+        :return:
+            job: A (job id, payload, attempt) tuple, or None if there is nothing to do.
+        """
+        lease = self.lease if lease is None else lease
+        self._expire(time.time())
+        for name in sorted(os.listdir(os.path.join(self.path, "queued"))):
+            if not name.endswith(".json"):
+                continue
+            jobId = name[:-len(".json")]
+            running = self._file("running", jobId + "@" + worker + ".json")
+            try:
+                os.rename(self._file("queued", name), running)
+                # The lease starts now, not when the job was submitted
+                os.utime(running)
+            except OSError:
+                # Another worker claimed it first
+                continue
+            record = self._read(running)
+            record["attempts"] += 1
+            record["lease"] = lease
+            self._write(running, record)
+            return jobId, record["payload"], record["attempts"]
+        return None
+
+    def heartbeat(self, jobId, worker, lease=None):
+        """
+        heartbeat extends the lease of a running job. It returns False if the worker no longer holds the job.
+        """
+        try:
+            os.utime(self._file("running", jobId + "@" + worker + ".json"))
+            return True
+        except OSError:
+            return False
+
+    def _finish(self, jobId, worker, state, **values):
+        """
+        _finish moves a job held by the worker to a new state. The running file is first renamed to a private name,
+        so a job whose lease expired meanwhile is either finished here or requeued by _expire, never both.
+        """
+        running = self._file("running", jobId + "@" + worker + ".json")
+        finishing = running + "." + uuid.uuid4().hex + ".finishing"
+        try:
+            os.rename(running, finishing)
+        except OSError:
+            # The lease expired and another worker took the job back
+            return False
+        try:
+            record = self._read(finishing)
+            record.update(values)
+            if state == "queued" and record["attempts"] >= self.maxAttempts:
+                state = "failed"
+            self._write(self._file(state, jobId + ".json"), record)
+        except Exception:
+            # The job is still held, so the lease or a retry can finish it
+            os.rename(finishing, running)
+            raise
+        os.remove(finishing)
+        return True
+
+    def complete(self, jobId, worker, result):
+        """
+        complete stores the result of a job held by the worker.
+        """
+        return self._finish(jobId, worker, "done", result=result)
+
+    def fail(self, jobId, worker, error):
+        """
+        fail requeues a job that raised, or marks it failed once it has been attempted maxAttempts times.
+        """
+        return self._finish(jobId, worker, "queued", error=str(error))
+
+    def status(self):
+        """
+        status returns the number of jobs in each state.
+        """
+        self._expire(time.time())
+        return {state: sum(name.endswith(".json") for name in os.listdir(os.path.join(self.path, state)))
+                for state in states}
+
+    def results(self):
+        """
+        results returns a dictionary mapping the job id to its payload, state, result and error.
+        """
+        results = {}
+        for state in states:
+            for name in sorted(os.listdir(os.path.join(self.path, state))):
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    record = self._read(os.path.join(self.path, state, name))
+                except (OSError, ValueError):
+                    continue
+                results[record["id"]] = {"payload": record["payload"], "state": state,
+                                         "result": record.get("result"), "error": record.get("error"),
+                                         "attempts": record["attempts"]}
+        return results
+
+
+def openQueue(path, maxAttempts=3):
+    """
+    openQueue opens a SQLiteQueue for a path ending in .db or .sqlite, and a DirectoryQueue otherwise.
+    """
+    if path.endswith(".db") or path.endswith(".sqlite"):
+        return SQLiteQueue(path, maxAttempts=maxAttempts)
+    return DirectoryQueue(path, maxAttempts=maxAttempts)
+
+
+def resolveTask(task):
+    """
+    resolveTask imports the function named by a 'module:function' string.
+    """
+    import importlib
+
+    module, function = task.split(":")
+    return getattr(importlib.import_module(module), function)
+
+
+def runWorker(path, worker=None, lease=300, heartbeat=None, maxJobs=None, wait=0):
+    """
+    runWorker claims and runs jobs until the queue is drained. The lease is renewed from a background thread while
+    a job runs, so long jobs are not handed to another worker.
+
+    :params:
+        path:      A string denoting the queue path (see openQueue).
+        worker:    A string denoting the worker name. The default is unique to this process and node.
+        lease:     An integer denoting the lease in seconds.
+        heartbeat: A float denoting the seconds between heartbeats. The default is a third of the lease.
+        maxJobs:   An integer denoting the number of jobs to run before returning (optional).
+        wait:      A float denoting how long to keep polling an empty queue before returning, so the worker can
+            pick up the jobs released by expired leases.
+
+    :return:
+        completed: An integer denoting the number of jobs this worker completed.
+    """
+    queue = openQueue(path)
+    worker = workerName() if worker is None else worker
+    heartbeat = lease / 3.0 if heartbeat is None else heartbeat
+
+    completed = 0
+    idleSince = time.time()
+    while maxJobs is None or completed < maxJobs:
+        job = queue.claim(worker, lease)
+        if job is None:
+            if time.time() - idleSince >= wait:
+                break
+            time.sleep(min(1.0, max(wait, 0.1)))
+            continue
+        jobId, payload, attempt = job
+
+        # SQLite connections cannot be shared between threads, so the heartbeat thread opens its own queue
+        stop = threading.Event()
+
+        def beat():
+            beatQueue = openQueue(path)
+            while not stop.wait(heartbeat):
+                if not beatQueue.heartbeat(jobId, worker, lease):
+                    break
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            result = resolveTask(payload["task"])(**payload.get("kwargs", {}))
+            stop.set()
+            thread.join()
+            if queue.complete(jobId, worker, result):
+                completed += 1
+            else:
+                logger.warning("Job %s lost its lease, so its result was not stored", jobId)
+        except Exception as error:
+            stop.set()
+            thread.join()
+            logger.warning("Job %s failed on attempt %d: %s", jobId, attempt, error)
+            queue.fail(jobId, worker, error)
+        idleSince = time.time()
+    return completed
+
+
+def sweepJobs(task, grid, iterations=1, seedArgument=None):
+    """
+    sweepJobs expands a parameter grid into job payloads, one per setting and iteration.
+
+    :params:
+        task:         A string denoting the 'module:function' to run.
+        grid:         A dictionary mapping the keyword arguments to the lists of values to sweep (ie: tissues,
+            targets, exclusions and thresholds).
+        iterations:   An integer denoting the number of jobs per setting.
+        seedArgument: A string denoting the keyword argument that receives the iteration of each job, for tasks
+            that take a random seed (optional).
+
+    :return:
+        payloads:     A list of job payloads for submit.
+    """
+    from itertools import product
+
+    names = sorted(grid)
+    payloads = []
+    for values in product(*[grid[name] for name in names]):
+        for iteration in range(iterations):
+            kwargs = dict(zip(names, values))
+            if seedArgument is not None:
+                kwargs[seedArgument] = iteration
+            payloads.append({"task": task, "kwargs": kwargs})
+    return payloads
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run or inspect a MetOncoFit job queue.")
+    parser.add_argument("command", choices=["worker", "status", "results"])
+    parser.add_argument("path")
+    parser.add_argument("--lease", type=int, default=300)
+    parser.add_argument("--wait", type=float, default=0)
+    parser.add_argument("--max-jobs", dest="maxJobs", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == "worker":
+        print("Completed " + str(runWorker(args.path, lease=args.lease, maxJobs=args.maxJobs, wait=args.wait)) +
+              " jobs")
+    elif args.command == "status":
+        print(json.dumps(openQueue(args.path).status(), indent=2))
+    else:
+        print(json.dumps(openQueue(args.path).results(), indent=2))
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+metrics.py reports the progress of long-running jobs (ie: forest fits and confusion matrix iterations) in
+machine-readable form, in place of the tqdm progress bars.
+
+Each job exposes the number of completed and remaining work items (the queue depth), the throughput in items per
+second, the ETA and the time of the last update, so a scheduler can track long runs and spot stragglers. The metrics
+of every job in the process are written to:
+    * a Prometheus text-format file per process, which the node exporter textfile collector can pick up. The process
+      id is added to the file name (metoncofit.prom is written as metoncofit.<pid>.prom) and to the labels, so parallel
+      workers never overwrite each other's metrics
+    * a JSON-lines log, with one record per update
+
+Nothing is written unless configure() is called, or the METONCOFIT_METRICS and METONCOFIT_METRICS_LOG environment
+variables name the files. Updates are written at most once per interval, and always when a job finishes.
+
+Usage:
+    from utils import metrics
+    metrics.configure(metricsFile='./../output/metoncofit.prom', logFile='./../output/metoncofit.jsonl')
+    progress = metrics.ProgressMetrics('randomForestClassification', total=65, unit='fits')
+    for ...:
+        ...
+        progress.update()
+    progress.close()
+
+@author: Scott Campit
+"""
+import os
+import json
+import time
+import threading
+
+_settings = {
+    "metricsFile": os.environ.get("METONCOFIT_METRICS"),
+    "logFile": os.environ.get("METONCOFIT_METRICS_LOG"),
+    "interval": 1.0
+}
+_jobs = {}
+_lock = threading.Lock()
+
+
+def configure(metricsFile=None, logFile=None, interval=1.0):
+    """
+    configure sets where the metrics are written.
+
+    :params:
+        metricsFile: A string denoting the path of the Prometheus text-format file.
+        logFile:     A string denoting the path of the JSON-lines log.
+        interval:    A float denoting the minimum number of seconds between two writes for the same job.
+    """
+    _settings["metricsFile"] = metricsFile
+    _settings["logFile"] = logFile
+    _settings["interval"] = interval
+
+
+def _formatLabels(labels):
+    """
+    _formatLabels returns the Prometheus label set for a dictionary of labels.
+    """
+    escaped = ['%s="%s"' % (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+               for key, value in sorted(labels.items())]
+    return "{" + ",".join(escaped) + "}"
+
+
+def processFile(fileName):
+    """
+    processFile returns the Prometheus file written by this process: the process id is inserted before the extension.
+    """
+    root, extension = os.path.splitext(fileName)
+    return root + "." + str(os.getpid()) + extension
+
+
+def _writePrometheus(fileName):
+    """
+    _writePrometheus writes the current metrics of every job in this process to the file of the process (see
+    processFile). The file is replaced atomically, so a collector never reads a partial file.
+    """
+    gauges = [
+        ("metoncofit_job_completed", "Work items completed by the job", "completed"),
+        ("metoncofit_job_total", "Work items in the job", "total"),
+        ("metoncofit_job_queue_depth", "Work items left in the job", "remaining"),
+        ("metoncofit_job_rate_per_second", "Work items completed per second", "rate"),
+        ("metoncofit_job_eta_seconds", "Estimated seconds until the job finishes", "eta"),
+        ("metoncofit_job_start_timestamp_seconds", "Unix time the job started", "started"),
+        ("metoncofit_job_last_update_timestamp_seconds", "Unix time of the last completed work item", "updated"),
+        ("metoncofit_job_finished", "Whether the job has finished", "finished")
+    ]
+    with _lock:
+        snapshots = [job.snapshot() for job in _jobs.values()]
+
+    lines = []
+    for name, description, key in gauges:
+        lines.append("# HELP " + name + " " + description)
+        lines.append("# TYPE " + name + " gauge")
+        for snapshot in snapshots:
+            value = snapshot[key]
+            if value is None:
+                continue
+            labels = dict(snapshot["labels"], job=snapshot["job"], unit=snapshot["unit"], pid=os.getpid())
+            lines.append(name + _formatLabels(labels) + " " + repr(float(value)))
+
+    fileName = processFile(fileName)
+    directory = os.path.dirname(fileName)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    temporary = fileName + ".tmp"
+    with open(temporary, "w") as fil:
+        fil.write("\n".join(lines) + "\n")
+    os.replace(temporary, fileName)
+
+
+def _writeLog(fileName, snapshot):
+    """
+    _writeLog appends one JSON record to the log.
+    """
+    directory = os.path.dirname(fileName)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(fileName, "a") as fil:
+        fil.write(json.dumps(dict(snapshot, time=time.time())) + "\n")
+
+
+class ProgressMetrics():
+    """
+    ProgressMetrics tracks the progress of one job and publishes it to the configured metrics file and log.
+    """
+
+    def __init__(self, job, total=None, unit="items", labels=None):
+        """
+        :params:
+            job:    A string denoting the job name (ie: 'randomForestClassification').
+            total:  An integer denoting the number of work items in the job, if it is known.
+            unit:   A string denoting the work item (ie: 'fits' or 'iterations').
+            labels: A dictionary of extra labels (ie: tissue and target).
+        """
+        self.job = job
+        self.total = total
+        self.unit = unit
+        self.labels = {} if labels is None else dict(labels)
+        self.completed = 0
+        self.started = time.time()
+        self.updated = self.started
+        self.finished = False
+        self.lastWrite = 0.0
+        self.key = (job, tuple(sorted(self.labels.items())), id(self))
+        with _lock:
+            _jobs[self.key] = self
+        self.publish(force=True)
+
+    def snapshot(self):
+        """
+        snapshot returns the current metrics of the job as a dictionary.
+        """
+        elapsed = max(self.updated - self.started, 1e-9)
+        rate = self.completed / elapsed if self.completed else 0.0
+        remaining = None if self.total is None else max(self.total - self.completed, 0)
+        eta = None
+        if remaining is not None and rate > 0:
+            eta = remaining / rate
+        return {"job": self.job, "unit": self.unit, "labels": self.labels, "completed": self.completed,
+                "total": self.total, "remaining": remaining, "rate": rate, "eta": eta, "started": self.started,
+                "updated": self.updated, "finished": int(self.finished)}
+
+    def publish(self, force=False):
+        """
+        publish writes the metrics file and log, at most once per configured interval unless force is set.
+        """
+        metricsFile, logFile = _settings["metricsFile"], _settings["logFile"]
+        if metricsFile is None and logFile is None:
+            return
+        now = time.time()
+        if not force and now - self.lastWrite < _settings["interval"]:
+            return
+        self.lastWrite = now
+        if metricsFile is not None:
+            _writePrometheus(metricsFile)
+        if logFile is not None:
+            _writeLog(logFile, self.snapshot())
+
+    def update(self, n=1):
+        """
+        update records n more completed work items.
+        """
+        self.completed += n
+        self.updated = time.time()
+        self.publish()
+
+    def close(self):
+        """
+        close marks the job as finished, publishes the final metrics and returns them.
+        """
+        self.finished = True
+        self.publish(force=True)
+        with _lock:
+            _jobs.pop(self.key, None)
+        return self.snapshot()
@@ -6,6 +6,7 @@ the figures in the manuscript.
 
 @authors: Krishna Dev Oruganty & Scott Campit
 """
+import os
 import sys
 import copy
 import operator
@@ -22,6 +23,11 @@ from sklearn.preprocessing import MinMaxScaler
 from imblearn.over_sampling import RandomOverSampler
 from sklearn.model_selection import train_test_split
 
+try:
+    from utils import vocabulary
+except ImportError:
+    import vocabulary
+
 
 def preprocess(datapath='/path', fil='filename', targ='targ', exclude='exclusion'):
     """
@@ -101,10 +107,8 @@ def preprocess(datapath='/path', fil='filename', targ='targ', exclude='exclusion
 
     df = df.set_index(['Genes', 'Cell Line'])
 
-    # We are label encoding the subsystem and datapath labels
-    le = preprocessing.LabelEncoder()
-    df["RECON1 subsystem"] = le.fit_transform(df["RECON1 subsystem"])
-    df["Metabolic subnetwork"] = le.fit_transform(df["Metabolic subnetwork"])
+    # We are encoding the subsystem and datapath labels with the codes shared by every tissue
+    df = vocabulary.encodeColumns(df, grow=True)
 
     excl_targ = {'TCGA annotation', 'SURV', 'CNV'}
     tmp = excl_targ.remove(targ)
@@ -123,19 +127,19 @@ def preprocess(datapath='/path', fil='filename', targ='targ', exclude='exclusion
     df = df.drop(columns=targ)  # doesn't contain targ classes
 
     # Robust scaling the dataset with random oversampling
-    data = np.array(df).astype(np.float)
+    data = np.array(df).astype(float)
     data = RobustScaler().fit_transform(data)
 
     new_data, orig_data, new_classes, orig_classes = train_test_split(
         data, classes, test_size=0.3)
 
     ros = RandomOverSampler()
-    data, classes = ros.fit_sample(new_data, new_classes)
+    data, classes = ros.fit_resample(new_data, new_classes)
 
     return df, df1, header, canc, targ, data, classes, orig_data, orig_classes, excl_targ, freq
 
 
-def one_gene_only(df, targ, header, rfc, canc):
+def one_gene_only(df, targ, header, rfc, canc, savepath=None):
     """
     one_gene_only will merge the gene targ value by majority rules and will take the median values for all numerical values. This code primarily designed to make the figures.
 
@@ -150,6 +154,8 @@ def one_gene_only(df, targ, header, rfc, canc):
     INPUTS:
         df: DataFrame structure from the preprocess function.
         targ: The targ we are going to predict (CNV, DE, SURV)
+        savepath: The directory the importance table is exported to (ImpCNV.csv, ImpSurv.csv or ImpTCGA.csv). It is
+            not exported by default.
 
     OUTPUTS:
         one_gene_df, one_gene_class: Dataframe structure will all unique genes data and classes
@@ -216,24 +222,22 @@ def one_gene_only(df, targ, header, rfc, canc):
     gini = []
     corr = []
 
-    x = 0
-    while(x < 137):  # Get the first 10 features
-        tempa = sorted_d[x]
+    for tempa in sorted_d[:137]:  # Get the first 137 features, or every feature of a smaller model
         feat.append(tempa[0])
         gini.append(tempa[1])
         corr.append(str(column_squigly[tempa[0]]))
-        x = x+1
 
     importance = pd.DataFrame({"Feature": feat, "Gini": gini, "R": corr})
     supp_fig = importance.copy(deep=True)
     importance = importance.head(137)
 
-    if targ == "CNV":
-        export_csv = importance.to_csv (r'/Users/kirksmith/Documents/GitHub.nosync/MetOncoFit/metoncofit/ImpCNV.csv', index = None, header=True) #Don't forget to add '.csv' at the end of the path
-    elif targ == "SURV":
-        export_csv = importance.to_csv (r'/Users/kirksmith/Documents/GitHub.nosync/MetOncoFit/metoncofit/ImpSurv.csv', index = None, header=True) #Don't forget to add '.csv' at the end of the path
-    else:
-        export_csv = importance.to_csv (r'/Users/kirksmith/Documents/GitHub.nosync/MetOncoFit/metoncofit/ImpTCGA.csv', index = None, header=True) #Don't forget to add '.csv' at the end of the path
+    if savepath is not None:
+        if targ == "CNV":
+            export_csv = importance.to_csv(os.path.join(savepath, 'ImpCNV.csv'), index=None, header=True)
+        elif targ == "SURV":
+            export_csv = importance.to_csv(os.path.join(savepath, 'ImpSurv.csv'), index=None, header=True)
+        else:
+            export_csv = importance.to_csv(os.path.join(savepath, 'ImpTCGA.csv'), index=None, header=True)
 
 
     # Map to label
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+shared.py holds one copy of a scaled feature matrix, its labels and its (gene, cell line) codes for every worker
+process of a parallel run (repeated hold-out, LOCO, LOFO, permutation importance and grid searches).
+
+The arrays are written once as .npy files in a shared directory (/dev/shm when it exists, so the pages stay in
+memory), and each worker memory-maps them. Workers receive a SharedHandle, which only holds the directory path, so
+it pickles in a few hundred bytes and attaching is a memory map of files that are already in the page cache. The
+pages are shared by every process, so the memory used does not grow with the number of workers.
+
+Usage:
+    with SharedDataset(X, Y, index=model.index) as shared:
+        results = Parallel(n_jobs=-1)(delayed(work)(shared.handle, ...) for ...)
+
+    def work(handle, ...):
+        X, Y = handle.X, handle.labels
+
+@author: Scott Campit
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# Memory maps opened in this process, by directory
+_attached = {}
+
+
+def _evictClosed():
+    """
+    _evictClosed drops the memory maps of datasets whose directory was removed. Persistent workers (ie: the loky pool
+    reused by joblib) never see close() in the parent, so their maps are dropped here, the next time they attach a
+    dataset.
+    """
+    for path in [path for path in _attached if not os.path.isdir(path)]:
+        del _attached[path]
+
+arrayNames = ["X", "Y", "classes", "genes", "cellLines", "geneNames", "cellLineNames"]
+
+
+class SharedHandle():
+    """
+    SharedHandle is the lightweight, picklable reference to a SharedDataset that is sent to the workers. The arrays
+    are memory-mapped read-only the first time they are used in a process.
+    """
+
+    def __init__(self, path):
+        """
+        :params:
+            path: A string denoting the directory holding the shared arrays.
+        """
+        self.path = path
+
+    def array(self, name):
+        """
+        array returns one of the shared arrays (X, Y, classes, genes, cellLines, geneNames or cellLineNames), or None
+        if the dataset was made without it.
+        """
+        if self.path not in _attached:
+            _evictClosed()
+        arrays = _attached.setdefault(self.path, {})
+        if name not in arrays:
+            fileName = os.path.join(self.path, name + ".npy")
+            if not os.path.exists(fileName):
+                arrays[name] = None
+            elif name in ["classes", "geneNames", "cellLineNames"]:
+                # Object arrays cannot be memory-mapped, and these are small
+                arrays[name] = np.load(fileName, allow_pickle=True)
+            else:
+                arrays[name] = np.load(fileName, mmap_mode='r')
+        return arrays[name]
+
+    @property
+    def X(self):
+        """
+        X is the read-only feature matrix.
+        """
+        return self.array("X")
+
+    @property
+    def Y(self):
+        """
+        Y is the integer code of each label (see classes).
+        """
+        return self.array("Y")
+
+    @property
+    def classes(self):
+        """
+        classes holds the label of each code in Y.
+        """
+        return self.array("classes")
+
+    @property
+    def labels(self):
+        """
+        labels returns the labels of every row.
+        """
+        return self.classes[self.Y]
+
+    @property
+    def genes(self):
+        """
+        genes is the integer code of the gene of each row (see geneNames).
+        """
+        return self.array("genes")
+
+    @property
+    def cellLines(self):
+        """
+        cellLines is the integer code of the cell line of each row (see cellLineNames).
+        """
+        return self.array("cellLines")
+
+    @property
+    def geneNames(self):
+        return self.array("geneNames")
+
+    @property
+    def cellLineNames(self):
+        return self.array("cellLineNames")
+
+    def detach(self):
+        """
+        detach closes the memory maps opened in this process.
+        """
+        _attached.pop(self.path, None)
+
+
+class SharedDataset():
+    """
+    SharedDataset writes the feature matrix, labels and (gene, cell line) codes once to a shared directory, and hands
+    out SharedHandle objects to the workers. The files are removed by close(), or when the with block ends.
+    """
+
+    def __init__(self, X, Y=None, index=None, directory=None):
+        """
+        :params:
+            X:         A numpy array or pandas dataframe containing the scaled features.
+            Y:         A numpy array or pandas series containing the labels.
+            index:     A pandas MultiIndex of (Genes, Cell Line), ie: the index of the tumor model. The default takes
+                the index of Y or X when they are pandas objects with two levels.
+            directory: A string denoting the directory the shared files are created in. The default is /dev/shm when
+                it exists, and the temporary directory otherwise.
+        """
+        if index is None:
+            for candidate in [Y, X]:
+                if isinstance(candidate, (pd.Series, pd.DataFrame)) and candidate.index.nlevels == 2:
+                    index = candidate.index
+                    break
+        if directory is None and os.path.isdir("/dev/shm"):
+            directory = "/dev/shm"
+        self.path = tempfile.mkdtemp(prefix="metoncofit_shared_", dir=directory)
+
+        arrays = {"X": np.ascontiguousarray(np.asarray(X))}
+        if Y is not None:
+            arrays["Y"], arrays["classes"] = self._codes(Y)
+        if index is not None:
+            arrays["genes"], arrays["geneNames"] = self._codes(index.get_level_values(0))
+            arrays["cellLines"], arrays["cellLineNames"] = self._codes(index.get_level_values(1))
+
+        for name, array in arrays.items():
+            np.save(os.path.join(self.path, name + ".npy"), array, allow_pickle=(array.dtype == object))
+        self.handle = SharedHandle(self.path)
+
+    @staticmethod
+    def _codes(values):
+        """
+        _codes returns the smallest integer codes of a label vector and the label of each code.
+        """
+        codes, uniques = pd.factorize(np.asarray(values), sort=True)
+        dtype = np.int8 if len(uniques) < 128 else np.int16 if len(uniques) < 32768 else np.int32
+        return codes.astype(dtype), np.asarray(uniques, dtype=object)
+
+    @classmethod
+    def fromFile(cls, filename, target, labelFileName, exclude="DE_and_CNV", thresholds=None, directory=None):
+        """
+        fromFile shares the scaled features and labels of a tumor model (see DataPreparation.ThresholdDataset).
+        """
+        try:
+            from utils import DataPreparation
+        except ImportError:
+            import DataPreparation
+
+        dataset = DataPreparation.loadThresholdDataset(filename, labelFileName, exclude)
+        return cls(dataset.X, dataset.labels(target, thresholds), index=dataset.index, directory=directory)
+
+    def close(self):
+        """
+        close removes the shared files. Workers that still have the arrays mapped keep their pages until they exit.
+        """
+        self.handle.detach()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+synthetic.py writes synthetic tumor models with the same schema as the MetOncoFit inputs in data/median, so the
+pipeline can be load tested without the patient-derived data.
+
+The columns are read from srv/headers.txt and filled by family:
+    * flux KO:    mostly zero, with a sparse change in flux after the gene knockout
+    * topology:   small integer path lengths from the media and to the biomass components
+    * kcat:       log-normal catalytic efficiencies
+    * expression: log-normal NCI-60 gene expression, shifted by the DE label
+    * network:    the RECON1 subsystem (taken from the flux KO subsystems) and the metabolic subnetwork categoricals
+    * targets:    the TCGA and CNV fold changes, and the TCGA annotation, CNV and SURV labels
+
+Every gene has one row per cell line. The gene-level columns (subsystem, subnetwork, topology, kcat and the target
+labels) are the same across the cell lines, as in the real models, and the target labels follow the class imbalance
+in classBalance. The fold changes agree with the labels under the median thresholds.
+
+The model is written in chunks of genes, so files far larger than memory can be produced.
+
+Usage (from the src directory):
+    python -m utils.synthetic ./../data/synthetic/breast.csv --scale 10
+
+@author: Scott Campit
+"""
+import numpy as np
+import pandas as pd
+
+# A real tissue model has about this many metabolic genes and cell lines
+referenceGenes = 1500
+referenceCellLines = 8
+
+# Fraction of genes in each class, per target column. Most metabolic genes are neutral in every target.
+classBalance = {
+    "TCGA_annot": {"NEUTRAL": 0.64, "UPREG": 0.20, "DOWNREG": 0.16},
+    "CNV": {"NEUT": 0.72, "GAIN": 0.16, "LOSS": 0.12},
+    "SURV": {"NEUTRAL": 0.80, "UPREG": 0.11, "DOWNREG": 0.09}
+}
+
+# Fold change ranges that give each label under the median thresholds (0.75, 1.33)
+foldChangeRanges = {
+    "UPREG": (1.33, 4.0), "GAIN": (1.33, 4.0),
+    "NEUTRAL": (0.75, 1.33), "NEUT": (0.75, 1.33),
+    "DOWNREG": (0.25, 0.75), "LOSS": (0.25, 0.75)
+}
+
+metabolicSubnetworks = ["Amino acid metabolism", "Carbohydrate metabolism", "Cofactor and vitamin metabolism",
+                        "Energy metabolism", "Lipid metabolism", "Nucleotide metabolism", "Transport", "Other"]
+
+
+def columnFamilies(labelFileName):
+    """
+    columnFamilies groups the raw column names in srv/headers.txt by feature family.
+
+    :params:
+        labelFileName: The path to the file mapping the column names to the feature names.
+
+    :return:
+        columns:       A list of the raw column names, in file order.
+        families:      A dictionary mapping the family name to a list of raw column names.
+        subsystems:    A list of the RECON1 subsystems named by the flux KO features.
+    """
+    headers = pd.read_csv(labelFileName, sep='\t', names=['Original', 'New'])
+    families = {"flux": [], "topology": [], "kcat": [], "expression": [], "other": []}
+    subsystems = []
+    for original, new in zip(headers['Original'], headers['New']):
+        if original in ["Gene", "Cell Line", "subsys", "path_label", "TCGA_val", "CNV_val"] + list(classBalance):
+            continue
+        if new.startswith("Flux change in"):
+            families["flux"].append(original)
+            subsystems.append(new[len("Flux change in "):-len(" after gene KO")])
+        elif "opological distance" in new:
+            families["topology"].append(original)
+        elif new == "Catalytic efficiency":
+            families["kcat"].append(original)
+        elif new.endswith("gene expression"):
+            families["expression"].append(original)
+        else:
+            families["other"].append(original)
+    return headers['Original'].tolist(), families, subsystems
+
+
+def _geneTable(genes, families, subsystems, rng):
+    """
+    _geneTable draws the gene-level columns: the target labels and fold changes, the categoricals, topology and kcat.
+    """
+    nGenes = len(genes)
+    table = pd.DataFrame({"Gene": genes})
+    for column, balance in classBalance.items():
+        labels = list(balance)
+        table[column] = rng.choice(labels, nGenes, p=[balance[label] for label in labels])
+
+    for column, valueColumn in [("TCGA_annot", "TCGA_val"), ("CNV", "CNV_val")]:
+        low, high = np.array([foldChangeRanges[label] for label in table[column]]).T
+        table[valueColumn] = np.exp(rng.uniform(np.log(low), np.log(high)))
+
+    table["subsys"] = rng.choice(subsystems, nGenes)
+    table["path_label"] = rng.choice(metabolicSubnetworks, nGenes)
+    for column in families["topology"]:
+        table[column] = rng.poisson(6, nGenes)
+    for column in families["kcat"]:
+        table[column] = rng.lognormal(2.0, 1.5, nGenes)
+    return table
+
+
+def _cellLineTable(geneTable, cellLines, families, rng):
+    """
+    _cellLineTable expands the gene-level columns to one row per cell line and draws the cell line-specific flux and
+    expression features.
+    """
+    nCellLines = len(cellLines)
+    rows = geneTable.loc[geneTable.index.repeat(nCellLines)].reset_index(drop=True)
+    rows.insert(1, "Cell Line", np.tile(cellLines, len(geneTable)))
+    nRows = rows.shape[0]
+
+    # The flux changes after a knockout are mostly zero, and larger for the differentially expressed genes
+    shift = rows["TCGA_annot"].map({"UPREG": 1.0, "NEUTRAL": 0.0, "DOWNREG": -1.0}).to_numpy()
+    flux = rng.standard_normal((nRows, len(families["flux"])))
+    flux *= rng.rand(nRows, len(families["flux"])) < 0.15
+    flux += 0.5 * shift[:, np.newaxis] * (rng.rand(nRows, len(families["flux"])) < 0.05)
+    rows = pd.concat([rows, pd.DataFrame(flux, columns=families["flux"])], axis=1)
+
+    for column in families["expression"]:
+        rows[column] = rng.lognormal(3.0 + 0.8 * shift, 1.0)
+    for column in families["other"]:
+        rows[column] = rng.standard_normal(nRows)
+    return rows
+
+
+def writeTumorModel(fileName, labelFileName, nGenes=None, nCellLines=None, scale=1.0, chunkGenes=500, seed=0):
+    """
+    writeTumorModel streams a synthetic tumor model to a .csv file, in the column order of srv/headers.txt.
+
+    :params:
+        fileName:      A string denoting the path of the .csv file to write.
+        labelFileName: The path to the file mapping the column names to the feature names.
+        nGenes:        An integer denoting the number of genes. The default is the number of genes in a real tissue.
+        nCellLines:    An integer denoting the number of cell lines. The default is scale times the number of cell
+            lines in a real tissue.
+        scale:         A float denoting the size of the model relative to a real tissue (ie: 10 or 100).
+        chunkGenes:    An integer denoting the number of genes held in memory at a time.
+        seed:          An integer denoting the random seed.
+
+    :return:
+        nRows:         An integer denoting the number of rows written.
+    """
+    columns, families, subsystems = columnFamilies(labelFileName)
+    nGenes = referenceGenes if nGenes is None else nGenes
+    nCellLines = int(round(referenceCellLines * scale)) if nCellLines is None else nCellLines
+
+    width = len(str(nGenes))
+    cellLines = np.array(["CL" + str(line).zfill(len(str(nCellLines))) for line in range(nCellLines)])
+    rng = np.random.RandomState(seed)
+
+    nRows = 0
+    for start in range(0, nGenes, chunkGenes):
+        genes = ["GENE" + str(gene).zfill(width) for gene in range(start, min(start + chunkGenes, nGenes))]
+        geneTable = _geneTable(genes, families, subsystems, rng)
+        rows = _cellLineTable(geneTable, cellLines, families, rng)
+        rows = rows[[column for column in columns if column in rows.columns]]
+        rows.to_csv(fileName, mode='w' if start == 0 else 'a', header=(start == 0), index=False)
+        nRows += rows.shape[0]
+    return nRows
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write a synthetic MetOncoFit tumor model.")
+    parser.add_argument("fileName")
+    parser.add_argument("--labels", dest="labelFileName", default="./../srv/headers.txt")
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--genes", dest="nGenes", type=int, default=None)
+    parser.add_argument("--cell-lines", dest="nCellLines", type=int, default=None)
+    parser.add_argument("--chunk", dest="chunkGenes", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    nRows = writeTumorModel(args.fileName, args.labelFileName, nGenes=args.nGenes, nCellLines=args.nCellLines,
+                            scale=args.scale, chunkGenes=args.chunkGenes, seed=args.seed)
+    print("Wrote " + str(nRows) + " rows to " + args.fileName)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+tracing.py records the wall time, CPU time and peak memory of each pipeline stage (parsing, encoding, scaling,
+oversampling, fitting, predicting and metrics).
+
+Tracing is off by default. It is switched on with enable(), or by setting the METONCOFIT_TRACE environment variable to
+the path of the trace file. When it is off, a traced function costs one extra function call and a None check.
+
+The memory of a stage is the high-water mark of the process resident memory when the stage ends, along with how
+much the stage raised it. Every stage is recorded with the tags in effect when it ran (ie: tissue, target and
+iteration), and is written as a complete event in the Chrome trace format, which chrome://tracing and
+https://ui.perfetto.dev can open. A summary table per stage is printed when tracing is switched off or the
+interpreter exits.
+
+Usage:
+    from utils import tracing
+    tracing.enable('./../output/trace.json')
+    with tracing.tags(tissue='breast', target='CNV'):
+        Xtrain, Xtest, Ytrain, Ytest = DataPreparation.processDataFromFile(...)
+    summary = tracing.disable()
+
+@author: Scott Campit
+"""
+import os
+import json
+import time
+import atexit
+import threading
+import functools
+from contextlib import contextmanager
+
+_tracer = None
+
+
+class Tracer():
+    """
+    Tracer collects the stage events of one traced run.
+    """
+
+    def __init__(self, traceFile=None, printSummary=True):
+        """
+        :params:
+            traceFile:    A string denoting the path of the Chrome trace JSON file. None only keeps the events in
+                memory.
+            printSummary: A boolean denoting whether to print the summary table when tracing is switched off.
+        """
+        self.traceFile = traceFile
+        self.printSummary = printSummary
+        self.events = []
+        self.tags = {}
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+
+    def record(self, name, start, wall, cpu, peakRSS, rssGrowth, tags):
+        """
+        record stores one finished stage.
+        """
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": (start - self.origin) * 1e6,
+            "dur": wall * 1e6,
+            "pid": self.pid,
+            "tid": threading.get_ident(),
+            "args": dict(tags, cpu_s=cpu, peak_rss_mb=peakRSS, rss_growth_mb=rssGrowth)
+        }
+        with self.lock:
+            self.events.append(event)
+
+    def write(self):
+        """
+        write saves the events as Chrome trace JSON.
+        """
+        if self.traceFile is None:
+            return
+        directory = os.path.dirname(self.traceFile)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(self.traceFile, "w") as fil:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, fil)
+
+    def summary(self):
+        """
+        summary returns a pandas dataframe with the number of calls, total and mean wall time, total CPU time and peak
+        resident memory of every stage.
+        """
+        import pandas as pd
+
+        columns = ["Stage", "Calls", "Wall (s)", "Mean wall (s)", "CPU (s)", "Peak RSS (MB)"]
+        if not self.events:
+            return pd.DataFrame(columns=columns)
+
+        events = pd.DataFrame({"Stage": [event["name"] for event in self.events],
+                               "Wall": [event["dur"] / 1e6 for event in self.events],
+                               "CPU": [event["args"]["cpu_s"] for event in self.events],
+                               "RSS": [event["args"]["peak_rss_mb"] for event in self.events]})
+        summary = events.groupby("Stage", sort=False).agg({"Wall": ["count", "sum", "mean"], "CPU": "sum",
+                                                           "RSS": "max"})
+        summary.columns = columns[1:]
+        return summary.reset_index().sort_values("Wall (s)", ascending=False).reset_index(drop=True)
+
+
+def _peakRSS():
+    """
+    _peakRSS returns the high-water mark of the resident memory of the process in MB.
+    """
+    import resource
+    import sys
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kB on Linux
+    return peak / 1024.0 ** 2 if sys.platform == "darwin" else peak / 1024.0
+
+
+def enable(traceFile=None, printSummary=True):
+    """
+    enable switches tracing on for the rest of the run.
+
+    :params:
+        traceFile:    A string denoting the path of the Chrome trace JSON file.
+        printSummary: A boolean denoting whether to print the summary table when tracing is switched off.
+
+    :return:
+        tracer:       The Tracer object collecting the events.
+    """
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer(traceFile, printSummary)
+    return _tracer
+
+
+def disable():
+    """
+    disable switches tracing off, writes the trace file and returns the summary table.
+    """
+    global _tracer
+    if _tracer is None:
+        return None
+    tracer, _tracer = _tracer, None
+    tracer.write()
+    summary = tracer.summary()
+    if tracer.printSummary and not summary.empty:
+        print(summary.to_string(index=False))
+    return summary
+
+
+def enabled():
+    """
+    enabled returns whether tracing is on.
+    """
+    return _tracer is not None
+
+
+@contextmanager
+def tags(**values):
+    """
+    tags adds tags (ie: tissue, target, iteration) to every stage recorded inside the block.
+    """
+    if _tracer is None:
+        yield
+        return
+    previous = _tracer.tags
+    _tracer.tags = dict(previous, **values)
+    try:
+        yield
+    finally:
+        _tracer.tags = previous
+
+
+@contextmanager
+def stage(name, **values):
+    """
+    stage records the wall time, CPU time and peak memory of the block as one stage.
+
+    :params:
+        name:   A string denoting the stage name.
+        values: Tags added to this stage only.
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield
+        return
+    stageTags = dict(tracer.tags, **values)
+    startRSS = _peakRSS()
+    startCPU = time.process_time()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - start
+        cpu = time.process_time() - startCPU
+        peakRSS = _peakRSS()
+        tracer.record(name, start, wall, cpu, peakRSS, peakRSS - startRSS, stageTags)
+
+
+def traced(name):
+    """
+    traced is a decorator that records every call of a function as a stage.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return function(*args, **kwargs)
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+if os.environ.get("METONCOFIT_TRACE"):
+    enable(os.environ["METONCOFIT_TRACE"])
+atexit.register(disable)
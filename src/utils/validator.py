@@ -12,67 +12,179 @@ Python Dependencies:
 
 @authors: Krishna Oruganty & Scott Campit
 """
-from tqdm import tqdm
-
 import pandas as pd
 import numpy as np
 np.seterr(divide='ignore', invalid='ignore')
 from random import shuffle
 import scipy
-from scipy import stats, interp
+from scipy import stats
 
-import DataPreparation
-import Classifier
+try:
+    import utils.DataPreparation as DataPreparation
+except ImportError:
+    import DataPreparation
+import classifiers.trees as Classifier
+from utils import metrics, tracing
 
-def computeConfusionMatrix(filename, target, exclude, labelFileName,
-                           clf, iterations=1000):
+class SequentialStopping():
+    """
+    SequentialStopping keeps running means and variances of statistics computed once per iteration (ie: the accuracy
+    and every normalized confusion matrix cell), and stops a repeated hold-out validation once the confidence interval
+    of every statistic is narrower than a tolerance.
     """
 
-    :param filename:
-    :param target:
-    :param exclude:
-    :param labelFileName:
-    :param clf:
-    :param iterations:
-    :return:
+    def __init__(self, tolerance=None, confidence=0.95, minIterations=30):
+        """
+        :params:
+            tolerance:     A float denoting the largest confidence interval width (ie: 0.01 for +/- 0.005). If it is
+                None, the validation never stops early.
+            confidence:    A float denoting the confidence level of the intervals.
+            minIterations: An integer denoting the number of iterations run before stopping is considered.
+        """
+        self.tolerance = tolerance
+        self.confidence = confidence
+        self.minIterations = minIterations
+        self.iterations = 0
+        self.count = None
+
+    def update(self, values):
+        """
+        update adds the statistics of one iteration. NaN values (ie: a class missing from a test set) are skipped.
+        """
+        values = np.ravel(np.asarray(values, dtype=float))
+        if self.count is None:
+            self.count = np.zeros(values.shape[0])
+            self.mean = np.zeros(values.shape[0])
+            self.squares = np.zeros(values.shape[0])
+        valid = ~np.isnan(values)
+        # Welford's update, so the variance is stable over thousands of iterations
+        self.count[valid] += 1
+        delta = values[valid] - self.mean[valid]
+        self.mean[valid] += delta / self.count[valid]
+        self.squares[valid] += delta * (values[valid] - self.mean[valid])
+        self.iterations += 1
+
+    def widths(self):
+        """
+        widths returns the width of the Student t confidence interval of each statistic's mean. Statistics with fewer
+        than two values have an infinite width.
+        """
+        widths = np.full(self.count.shape, np.inf)
+        enough = self.count > 1
+        n = self.count[enough]
+        quantile = stats.t.ppf(0.5 + self.confidence / 2.0, n - 1)
+        widths[enough] = 2.0 * quantile * np.sqrt(self.squares[enough] / (n - 1) / n)
+        return widths
+
+    def converged(self):
+        """
+        converged returns whether every confidence interval is narrower than the tolerance.
+        """
+        if self.tolerance is None or self.count is None or self.iterations < self.minIterations:
+            return False
+        observed = self.count > 0
+        return bool(np.all(self.widths()[observed] < self.tolerance))
+
+    def report(self):
+        """
+        report returns the number of iterations used and the precision reached.
+        """
+        widths = self.widths()[self.count > 0] if self.count is not None else np.array([np.inf])
+        return {"Iterations": self.iterations,
+                "Converged": self.converged(),
+                "Tolerance": self.tolerance,
+                "Confidence": self.confidence,
+                "Accuracy": self.mean[0] if self.count is not None else np.nan,
+                "Accuracy CI width": widths[0],
+                "Max CI width": widths.max()}
+
+
+def _iterationStatistics(Ytest, Ypred, labels):
+    """
+    _iterationStatistics returns the confusion matrix of one iteration, and its accuracy followed by the row normalized
+    cells.
     """
     from sklearn.metrics import confusion_matrix
+
+    matrix = confusion_matrix(Ytest, Ypred, labels=labels)
+    normalized = matrix.astype('float') / matrix.sum(axis=1)[:, np.newaxis]
+    accuracy = np.trace(matrix) / float(matrix.sum())
+    return matrix, np.concatenate([[accuracy], normalized.ravel()])
+
+
+def computeConfusionMatrix(filename, target, exclude, labelFileName,
+                           clf, iterations=1000, tolerance=None, confidence=0.95, minIterations=30):
+    """
+    computeConfusionMatrix sums the confusion matrices of a model over repeated train / test splits. If a tolerance
+    is given, the splits stop as soon as the confidence intervals of the accuracy and of every normalized cell are
+    narrower than the tolerance (see SequentialStopping), and iterations is the cap.
+
+    :param filename:      The path to the .csv file containing the tumor model.
+    :param target:        A string denoting the target variable.
+    :param exclude:       A string denoting which features to keep in the dataset.
+    :param labelFileName: The path to the file mapping the column names to the feature names.
+    :param clf:           A trained classifier.
+    :param iterations:    An integer denoting the largest number of splits.
+    :param tolerance:     A float denoting the largest confidence interval width (optional).
+    :param confidence:    A float denoting the confidence level of the intervals.
+    :param minIterations: An integer denoting the smallest number of splits when stopping early.
+    :return:
+        matrix:           A numpy array of the summed confusion matrix.
+        normalizedMatrix: A numpy array of the row normalized confusion matrix.
+        report:           A dictionary with the number of iterations used and the precision reached.
+    """
     np.set_printoptions(precision=2)
 
     count = 0
-    pbar = tqdm(total=count)
+    tissue = filename.split('/')[-1].split('.')[0]
+    labels = getattr(clf, "classes_", None)
+    stopping = SequentialStopping(tolerance, confidence, minIterations)
+    progress = metrics.ProgressMetrics("computeConfusionMatrix", total=iterations + 1, unit="iterations",
+                                       labels={"tissue": tissue, "target": target})
     print("Computing confusion matrix")
 
-    while (count <= iterations):
-        Xtrain, Xtest, Ytrain, Ytest = DataPreparation.processDataFromFile(filename, target, exclude, labelFileName)
-        Ypred = clf.predict(Xtest)
-        if count is 0:
-            matrix = confusion_matrix(Ytest, Ypred)
-        elif count > 1:
-            matrix = np.add(matrix, confusion_matrix(Ytest, Ypred))
+    while (count <= iterations) and not stopping.converged():
+        with tracing.tags(iteration=count):
+            Xtrain, Xtest, Ytrain, Ytest = DataPreparation.processDataFromFile(filename, target, exclude,
+                                                                               labelFileName)
+            with tracing.stage("predict", target=target):
+                Ypred = clf.predict(Xtest)
+            with tracing.stage("metrics", target=target):
+                iterationMatrix, statistics = _iterationStatistics(Ytest, Ypred, labels)
+                stopping.update(statistics)
+                if count == 0:
+                    matrix = iterationMatrix
+                else:
+                    matrix = np.add(matrix, iterationMatrix)
         count += 1
-        pbar.update(1)
-    pbar.close()
+        progress.update()
+    progress.close()
     normalizedMatrix = matrix.astype('float') / matrix.sum(axis=1)[:, np.newaxis]
 
-    return matrix, normalizedMatrix
+    return matrix, normalizedMatrix, stopping.report()
 
-def Summarize(filename, target, exclude, iterations=1000):
+def Summarize(filename, target, exclude, labelFileName, iterations=1000, tolerance=None, confidence=0.95,
+              minIterations=30):
     """
     Summarize outputs several statistical metrics used to evaluate the MetOncoFit model.
 
     :params:
-        filename:   The path to the .csv file containing the rows as observations and the columns as features.
-        target:     A string denoting the target variable of interest.
-        exclude:    A string denoting which features to keep in the dataset.
-        iterations: An integer denoting the number of times to compute the summary statistics.
+        filename:      The path to the .csv file containing the rows as observations and the columns as features.
+        target:        A string denoting the target variable of interest.
+        exclude:       A string denoting which features to keep in the dataset.
+        labelFileName: The path to the file mapping the column names to the feature names.
+        iterations:    An integer denoting the largest number of times to compute the summary statistics.
+        tolerance:     A float denoting the largest confidence interval width of the accuracy and of every normalized
+            confusion matrix cell. If it is given, the iterations stop once every interval is narrower (optional).
+        confidence:    A float denoting the confidence level of the intervals.
+        minIterations: An integer denoting the smallest number of iterations when stopping early.
 
     :return:
-        Summary: A pandas dataframe that stores several statistical values, including:
+        Summary: A pandas series that stores several statistical values, including:
             CV:        10-fold cross validation score
-            Accuracy:  Out-of-bag accuracy
-            Mean:      Mean of the out-of-bag accuracy values
-            Sigma:     The standard deviation of the out-of-bag accuracy values
+            Accuracy:  Hold-out accuracy
+            Mean:      Mean of the hold-out accuracy values
+            Sigma:     The standard deviation of the hold-out accuracy values
             Kappa:     Cohen's kappa coefficient
             F1:        F1 score or harmonic average of the precision and recall
             Precision: The average precision score across all classes
@@ -83,57 +195,60 @@ def Summarize(filename, target, exclude, iterations=1000):
                 upregulated/gain and downregulated/loss class
             T-score: the T-score of accuracy
             P-value: the P-value of accuracy using a Two-Tailed T-test
+            Iterations: The number of iterations used
+            Converged:  Whether every confidence interval reached the tolerance
+            Max CI width: The widest confidence interval of the accuracy and normalized confusion matrix cells
     """
-    from random import shuffle
-    from sklearn.metrics import f1_score, classification_report, \
+    from sklearn.metrics import f1_score, precision_score, recall_score, classification_report, \
         matthews_corrcoef, cohen_kappa_score as coh_kap
 
-    if target is 'CNV':
-        labels = ['GAIN', 'NEUTRAL', 'LOSS']
+    if target == 'CNV':
+        labels = ['GAIN', 'NEUT', 'LOSS']
     else:
         labels = ["UPREG", "NEUTRAL", "DOWNREG"]
-    cancer = filename.split('.')[0]
+    cancer = filename.split('/')[-1].split('.')[0]
 
-    Summary = pd.DataFrame(columns=['CV', 'Accuracy', 'Sigma', 'Mean', 'Kappa', 'F1', 'MCC'
-                                            'Precision', 'Recall', 'UPREG/GAIN Precision',
-                                            'DOWNREG/LOSS Precision', 'UPREG/GAIN Recall',
-                                            'DOWNREG/LOSS Recall', 'T-score', 'P-value'])
+    rows = []
     count = 0
-    while(count <= iterations):
-        Xtrain, Xtest, Ytrain, Ytest = DataPreparation.processDataFromFile(filename, target, exclude)
-        _, Ypred, OOBAccuracy, CVAccuracy = Classifier.random_forest(Xtrain, Ytrain, Xtest, Ytest)
+    stopping = SequentialStopping(tolerance, confidence, minIterations)
+    while(count <= iterations) and not stopping.converged():
+        Xtrain, Xtest, Ytrain, Ytest = DataPreparation.processDataFromFile(filename, target, exclude, labelFileName)
+        RFC, Ypred, HoldOutAccuracy, CVAccuracy = Classifier.randomForestClassification(Xtrain, Ytrain, Xtest, Ytest)
+        stopping.update(_iterationStatistics(Ytest, Ypred, RFC.classes_)[1])
 
         report = classification_report(Ytest, Ypred, output_dict=True)
-        report = pd.DataFrame.from_dict(report).round(2)
-
-        Summary[count, 'Accuracy'] = OOBAccuracy
-        Summary[count, 'CV'] = CVAccuracy
-        Summary[count, 'Kappa'] = coh_kap(Ytest, Ypred)
-        Summary[count, 'F1'] = f1_score(Ytest, Ypred, average='micro')
-        Summary[count, 'MCC'] = matthews_corrcoef(Ytest, Ypred)
-
-        Summary[count, 'Precision'] = report.loc[['precision'], ['micro avg']].values[0]
-        Summary[count, 'UPREG/GAIN Precision'] = report.loc[['precision'], [labels[0]]].values[0]
-        Summary[count, 'DOWNREG/LOSS Precision'] = report.loc[['precision'], [labels[2]]].values[0]
-
-        Summary[count, 'Recall'] = report.loc[['recall'], ['micro avg']].values[0]
-        Summary[count, 'UPREG/GAIN Recall'] = report.loc[['recall'], [labels[0]]].values[0]
-        Summary[count, 'DOWNREG/LOSS Recall'] = report.loc[['recall'], [labels[2]]].values[0]
-
+        rows.append({
+            'CV': CVAccuracy,
+            'Accuracy': HoldOutAccuracy,
+            'Kappa': coh_kap(Ytest, Ypred),
+            'F1': f1_score(Ytest, Ypred, average='micro'),
+            'MCC': matthews_corrcoef(Ytest, Ypred),
+            'Precision': precision_score(Ytest, Ypred, average='micro'),
+            'Recall': recall_score(Ytest, Ypred, average='micro'),
+            'UPREG/GAIN Precision': report.get(labels[0], {}).get('precision', np.nan),
+            'DOWNREG/LOSS Precision': report.get(labels[2], {}).get('precision', np.nan),
+            'UPREG/GAIN Recall': report.get(labels[0], {}).get('recall', np.nan),
+            'DOWNREG/LOSS Recall': report.get(labels[2], {}).get('recall', np.nan)
+        })
         count += 1
 
-    sigma = Summary['Accuracy'].std(axis=1)
-    mu = Summary['Accuracy'].mean(axis=1)
-    tscore, pvalue = scipy.stats.ttest_1samp(Summary['Accuracy'], mu)
+    Summary = pd.DataFrame(rows)
+    sigma = Summary['Accuracy'].std()
+    mu = Summary['Accuracy'].mean()
+    tscore, pvalue = stats.ttest_1samp(Summary['Accuracy'], mu)
     if pvalue < 1E-50:
         pvalue = 1E-50
 
-    Summary = Summary.mean(axis=1)
+    Summary = Summary.mean()
     Summary['T-score'] = tscore
     Summary['P-Value'] = pvalue
     Summary['Sigma'] = sigma
     Summary['Mean'] = mu
     Summary['Cancer'] = cancer
+    report = stopping.report()
+    Summary['Iterations'] = report['Iterations']
+    Summary['Converged'] = report['Converged']
+    Summary['Max CI width'] = report['Max CI width']
 
     return Summary
 
@@ -149,7 +264,7 @@ def PearsonCorrelation(diffExpDFs, target):
         targ_labels = ["UPREG","NEUTRAL","DOWNREG"]
 
     model, cancer = DataPreparation.load_data(filename)
-    label_encoded_model = DataPreparation.label_encode(model)
+    label_encoded_model = DataPreparation.label_encode(model, grow=True)
     prune_models, classes = DataPreparation.prune_targets(label_encoded_model, target, exclude)
     prune_models = prune_models.drop(columns=['Genes', 'Cell Line'])
     robust_model = DataPreparation.robust_scaler(prune_models)
@@ -202,17 +317,11 @@ def leave_one_feat_out(df, canc, targ):
 
         new_data, orig_data, new_classes, orig_classes = train_test_split(df, classes, test_size=0.3)
 
-        feat = (new_data.shape[1]-10)
-        while(feat < new_data.shape[1]-1):
-            trees = 5
-            while(trees <= 500):
-                rfc = RandomForestClassifier(n_estimators=trees, max_features=feat)
-                rfc.fit(new_data, new_classes)
-                trees = trees + 1500
-            feat = feat + 20
-            rfc_pred = rfc.predict(orig_data)
-            mean_acc = rfc.score(orig_data, orig_classes)
-            output.append([canc, targ, lofo, mean_acc])
+        # The forest settings are chosen by out-of-bag error (see trees.oobSearch)
+        rfc, _ = Classifier.oobSearch(new_data, new_classes)
+        rfc_pred = rfc.predict(orig_data)
+        mean_acc = rfc.score(orig_data, orig_classes)
+        output.append([canc, targ, lofo, mean_acc])
 
     # Return data frame to be saved
     lofo_df = pd.DataFrame(output, columns=["Cancer", "Target", "Held-out feature set", "Mean class accuracy"])
@@ -235,7 +344,7 @@ def leave_one_cell_out(df2, canc, targ):
     classes = pd.DataFrame(classes, index=df2.index)
 
     # Robust scaling (since this is not done in the process script)
-    num = RobustScaler().fit_transform(np.array(df2).astype(np.float))
+    num = RobustScaler().fit_transform(np.array(df2).astype(float))
     df2 = pd.DataFrame(num, columns=df2.columns, index=df2.index)
 
     # Unite the datasets together again
@@ -256,19 +365,13 @@ def leave_one_cell_out(df2, canc, targ):
 
         # Now we can do random oversampling
         ros = RandomOverSampler()
-        data, classes = ros.fit_sample(new_data, new_classes)
-
-        feat = (data.shape[1]-10)
-        while(feat < data.shape[1]-1):
-            trees = 5
-            while(trees <= 500):
-                rfc = RandomForestClassifier(n_estimators=trees, max_features=feat)
-                rfc.fit(data, classes)
-                trees = trees + 1500
-            feat = feat + 20
-            rfc_pred = rfc.predict(orig_data)
-            mean_acc = rfc.score(orig_data, orig_classes)
-            output.append([canc, targ, cell, mean_acc])
+        data, classes = ros.fit_resample(new_data, new_classes)
+
+        # The forest settings are chosen by out-of-bag error (see trees.oobSearch)
+        rfc, _ = Classifier.oobSearch(data, classes)
+        rfc_pred = rfc.predict(orig_data)
+        mean_acc = rfc.score(orig_data, orig_classes)
+        output.append([canc, targ, cell, mean_acc])
 
     # Return data frame to be saved
     loco = pd.DataFrame(output, columns=["Cancer", "Target", "Held-out cell line", "Mean class accuracy"])
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+vocabulary.py encodes the categorical features (RECON1 subsystem and Metabolic subnetwork) with one global dictionary
+that is shared by every tissue model.
+
+A LabelEncoder fitted on each file gives the same subsystem a different integer in each tissue, so the tissue models
+cannot be concatenated or scored with another tissue's forest without re-encoding them. Here the categories of each
+column are kept in data/vocabulary.json at the root of the repository, and the code of a category is its position in
+that list. New categories are appended and existing codes never change. The codes are stored as int16, and missing
+values are -1.
+
+Encoding is a vectorized lookup (pandas.Index.get_indexer) against the stored categories. Unknown categories are
+encoded as -1, unless the caller passes grow=True: only the paths that train models or update the tissue models
+(DataPreparation.processDataFromFile, make-db.py, process.py and utils.incremental) add categories, so predictions,
+benchmarks and synthetic runs never change the shared file. Adding categories re-reads and rewrites the file under a
+file lock, so parallel workers agree on the codes.
+
+Usage:
+    model = vocabulary.encodeColumns(model)
+    names = vocabulary.load().decode(model["RECON1 subsystem"], "RECON1 subsystem")
+
+@author: Scott Campit
+"""
+import os
+import json
+import uuid
+
+import numpy as np
+import pandas as pd
+
+categoricalColumns = ["RECON1 subsystem", "Metabolic subnetwork"]
+
+# Anchored to the repository rather than the working directory, so every script shares one vocabulary
+defaultVocabularyFile = os.environ.get(
+    "METONCOFIT_VOCABULARY",
+    os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "vocabulary.json")))
+
+codeType = np.int16
+
+# Vocabularies loaded in this process, by absolute path
+_vocabularies = {}
+
+
+class Vocabulary():
+    """
+    Vocabulary maps the categories of each categorical column to stable int16 codes.
+    """
+
+    def __init__(self, fileName=defaultVocabularyFile):
+        """
+        :params:
+            fileName: A string denoting the path of the JSON file holding the categories of each column.
+        """
+        self.fileName = fileName
+        self.categories = {}
+        self.reload()
+
+    def reload(self):
+        """
+        reload reads the stored categories of each column.
+        """
+        if os.path.exists(self.fileName):
+            with open(self.fileName) as fil:
+                self.categories = json.load(fil)
+        self.indexes = {column: pd.Index(categories) for column, categories in self.categories.items()}
+
+    def _save(self):
+        directory = os.path.dirname(self.fileName)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = self.fileName + "." + uuid.uuid4().hex + ".tmp"
+        with open(temporary, "w") as fil:
+            json.dump(self.categories, fil, indent=1)
+        os.replace(temporary, self.fileName)
+
+    def extend(self, column, values):
+        """
+        extend appends the categories of values that are not in the vocabulary yet, and saves it. The file is locked
+        and re-read first, so categories added by another process keep their codes.
+        """
+        import fcntl
+
+        directory = os.path.dirname(self.fileName)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.fileName + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.reload()
+            known = self.indexes.get(column, pd.Index([]))
+            new = pd.Index(pd.unique(pd.Series(values).dropna().astype(str))).difference(known)
+            if len(new) > 0:
+                if len(known) + len(new) > np.iinfo(codeType).max:
+                    raise ValueError("The '" + column + "' vocabulary does not fit in " + np.dtype(codeType).name)
+                self.categories[column] = list(known) + list(new)
+                self._save()
+                self.reload()
+
+    def encode(self, values, column, grow=False):
+        """
+        encode returns the int16 code of each value.
+
+        :params:
+            values: A pandas series or array containing the categories.
+            column: A string denoting the categorical column (ie: 'RECON1 subsystem').
+            grow:   A boolean denoting whether unknown categories are added to the vocabulary. Otherwise they are
+                encoded as -1. Only the training and update paths add categories.
+
+        :return:
+            codes:  A numpy array of int16 codes.
+        """
+        values = pd.Series(np.asarray(values, dtype=object))
+        missing = values.isnull().to_numpy()
+        values = values.astype(str).where(~missing)
+        codes = self.indexes.get(column, pd.Index([], dtype=object)).get_indexer(values)
+        unknown = (codes == -1) & ~missing
+        if grow and unknown.any():
+            self.extend(column, values[unknown])
+            codes = self.indexes[column].get_indexer(values)
+        return codes.astype(codeType)
+
+    def decode(self, codes, column):
+        """
+        decode returns the category of each code. The code -1 is decoded as NaN.
+        """
+        codes = np.asarray(codes)
+        categories = np.asarray(self.categories.get(column, []), dtype=object)
+        names = np.full(codes.shape, np.nan, dtype=object)
+        valid = (codes >= 0) & (codes < len(categories))
+        names[valid] = categories[codes[valid]]
+        return names
+
+
+def load(fileName=None):
+    """
+    load returns the vocabulary stored in a file, reading it only the first time in a process.
+    """
+    fileName = defaultVocabularyFile if fileName is None else fileName
+    path = os.path.abspath(fileName)
+    if path not in _vocabularies:
+        _vocabularies[path] = Vocabulary(fileName)
+    return _vocabularies[path]
+
+
+def encodeColumns(model, columns=None, fileName=None, grow=False):
+    """
+    encodeColumns replaces the categorical columns of a tumor model with their global int16 codes.
+
+    :params:
+        model:    A pandas dataframe containing the tumor model.
+        columns:  A list of the columns to encode. The default is categoricalColumns.
+        fileName: A string denoting the path of the vocabulary file. The default is defaultVocabularyFile.
+        grow:     A boolean denoting whether unknown categories are added to the vocabulary. Otherwise they are
+            encoded as -1.
+
+    :return:
+        encoded:  A pandas dataframe with the categorical columns encoded.
+    """
+    vocabulary = load(fileName)
+    encoded = model.copy(deep=True)
+    for column in categoricalColumns if columns is None else columns:
+        if column in encoded.columns:
+            encoded[column] = vocabulary.encode(encoded[column], column, grow=grow)
+    return encoded
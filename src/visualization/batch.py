@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+batch.py renders the manuscript figures for every tissue and target from precomputed summary tables.
+
+Each (tissue, target) bundle is rendered in its own worker process with the headless Agg backend, so bundles do not
+share pyplot state and run in parallel. The tables are written by utils/make-db.py to ./../output/Tables/, named
+`<tissue>_<target>_<table>.csv` with the targets DE, CNV and SURV:
+    * importance: the Feature, Gini and R columns of the top features
+    * figure:     the melted Genes, feature, value and type columns of the top features
+    * confusion:  the hold-out confusion matrix (no header)
+    * stats:      a single row with the CV and Z-score columns (optional, not written by make-db.py)
+
+A manifest of input hashes is kept in the output directory, and bundles whose tables have not changed are skipped.
+
+Usage (from the src directory):
+    python -m visualization.batch ./../output/Tables/ ./../output/Figures/ --workers 4 --format svg
+
+@author: Scott Campit
+"""
+import os
+import glob
+import json
+import hashlib
+
+tableNames = ["importance", "figure", "confusion", "stats"]
+figureNames = ["dotplot", "importance", "confusion"]
+manifestName = ".batch_manifest.json"
+
+
+def findBundles(tablePath):
+    """
+    findBundles collects the summary tables in a directory by (tissue, target).
+
+    :params:
+        tablePath: A string denoting the directory containing the summary tables.
+
+    :return:
+        bundles:   A dictionary mapping (tissue, target) to a dictionary of table name and file path.
+    """
+    bundles = {}
+    for fileName in sorted(glob.glob(os.path.join(tablePath, "*_importance.csv"))):
+        stem = os.path.basename(fileName)[:-len("_importance.csv")]
+        if "_" not in stem:
+            continue
+        tissue, target = stem.split("_", 1)
+        tables = {}
+        for table in tableNames:
+            path = os.path.join(tablePath, stem + "_" + table + ".csv")
+            if os.path.exists(path):
+                tables[table] = path
+        if "figure" in tables and "confusion" in tables:
+            bundles[(tissue, target)] = tables
+    return bundles
+
+
+def bundleHash(tables, settings):
+    """
+    bundleHash returns a SHA-1 digest of the bundle tables and the render settings.
+    """
+    digest = hashlib.sha1(json.dumps(settings, sort_keys=True).encode())
+    for table in tableNames:
+        if table in tables:
+            digest.update(table.encode())
+            with open(tables[table], "rb") as fil:
+                for block in iter(lambda: fil.read(1 << 20), b""):
+                    digest.update(block)
+    return digest.hexdigest()
+
+
+def renderBundle(tissue, target, tables, savepath, fmt="svg", topFeatures=10, mode="strip"):
+    """
+    renderBundle draws the dot plot, importance plot and confusion matrix for one tissue and target. It is meant to
+    run inside a worker process, and switches matplotlib to the Agg backend before pyplot is imported.
+
+    :params:
+        tissue:      A string denoting the tissue name.
+        target:      A string denoting the target variable.
+        tables:      A dictionary mapping the table name to the file path.
+        savepath:    A string denoting the directory the figures are saved to.
+        fmt:         A string denoting the image format.
+        topFeatures: An integer denoting the number of features shown in the dot plot and importance plot.
+        mode:        A string denoting the dot plot mode ('strip', 'violin' or 'heat').
+
+    :return:
+        outputs:     A list of the figure paths that were written.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import numpy as np
+    import pandas as pd
+
+    import visualization.static as static
+
+    importance = pd.read_csv(tables["importance"]).head(topFeatures)
+    df = pd.read_csv(tables["figure"])
+    df = df.loc[df["feature"].isin(importance["Feature"])]
+    cm = np.loadtxt(tables["confusion"], delimiter=",")
+    if "stats" in tables:
+        row = pd.read_csv(tables["stats"]).iloc[0]
+        stats = [row.get("CV", ""), row.get("Z-score", "")]
+    else:
+        stats = ["", ""]
+
+    axes = {
+        "dotplot": static.dotplot(df, importance, target, title_name=tissue, mode=mode),
+        "importance": static.variableImportance(importance),
+        "confusion": static.confusionMatrix(cm, target, stats, normalize=True)
+    }
+
+    outputs = []
+    for name in figureNames:
+        fileName = os.path.join(savepath, tissue + "_" + target + "_" + name + "." + fmt)
+        figure = axes[name].get_figure()
+        figure.savefig(fileName, bbox_inches="tight")
+        plt.close(figure)
+        outputs.append(fileName)
+    return outputs
+
+
+def renderAll(tablePath, savepath, workers=None, fmt="svg", topFeatures=10, mode="strip", force=False):
+    """
+    renderAll renders every bundle found in tablePath in a pool of worker processes, skipping the bundles whose
+    tables and settings match the manifest from the previous run.
+
+    :params:
+        tablePath:   A string denoting the directory containing the summary tables.
+        savepath:    A string denoting the directory the figures are saved to.
+        workers:     An integer denoting the number of worker processes. The default uses every core.
+        fmt:         A string denoting the image format.
+        topFeatures: An integer denoting the number of features shown in the dot plot and importance plot.
+        mode:        A string denoting the dot plot mode ('strip', 'violin' or 'heat').
+        force:       A boolean denoting whether to render bundles that have not changed.
+
+    :return:
+        rendered:    A dictionary mapping (tissue, target) to the figure paths, or the error raised by the worker.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    if not os.path.exists(savepath):
+        os.makedirs(savepath)
+
+    manifestFile = os.path.join(savepath, manifestName)
+    manifest = {}
+    if os.path.exists(manifestFile):
+        with open(manifestFile) as fil:
+            manifest = json.load(fil)
+
+    settings = {"format": fmt, "topFeatures": topFeatures, "mode": mode}
+    pending = {}
+    for (tissue, target), tables in findBundles(tablePath).items():
+        key = tissue + "_" + target
+        digest = bundleHash(tables, settings)
+        outputs = [os.path.join(savepath, key + "_" + name + "." + fmt) for name in figureNames]
+        if not force and manifest.get(key) == digest and all(os.path.exists(out) for out in outputs):
+            continue
+        pending[(tissue, target)] = (tables, digest)
+
+    rendered = {}
+    if not pending:
+        return rendered
+
+    # Spawned workers start with a clean interpreter, so no pyplot state leaks in from the parent
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {
+            pool.submit(renderBundle, tissue, target, tables, savepath, fmt, topFeatures, mode): (tissue, target)
+            for (tissue, target), (tables, _) in pending.items()
+        }
+        for future, (tissue, target) in futures.items():
+            try:
+                rendered[(tissue, target)] = future.result()
+                manifest[tissue + "_" + target] = pending[(tissue, target)][1]
+            except Exception as error:
+                rendered[(tissue, target)] = error
+                print("Failed to render " + tissue + " " + target + ": " + str(error))
+
+    with open(manifestFile, "w") as fil:
+        json.dump(manifest, fil, indent=2, sort_keys=True)
+
+    return rendered
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Render the MetOncoFit figures for every tissue and target.")
+    parser.add_argument("tablePath")
+    parser.add_argument("savepath")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--format", dest="fmt", default="svg")
+    parser.add_argument("--top", dest="topFeatures", type=int, default=10)
+    parser.add_argument("--mode", default="strip", choices=["strip", "violin", "heat"])
+    parser.add_argument("--force", action="store_true")
+    args = parser.parse_args()
+
+    rendered = renderAll(args.tablePath, args.savepath, workers=args.workers,
+                         fmt=args.fmt, topFeatures=args.topFeatures, mode=args.mode, force=args.force)
+    print("Rendered " + str(len(rendered)) + " figure bundles")
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+interactive.py serves the MetOncoFit heatmaps from a local Bokeh server.
+
+The static page from `utils/make_html.py` ships every (gene, feature) rect to the browser and filters them in
+JavaScript. Here the long-format MetOncoFit table stays in Python: it is indexed once into dense feature x gene
+matrices per (cancer, target, label), and each widget change only pushes the genes on the current page. When a page
+holds more genes than the heatmap can draw, neighbouring genes are averaged into bins so the number of glyphs sent to
+the client never exceeds what the viewport can show.
+
+Usage:
+    python interactive.py metoncofit.json --port 5006
+
+@author: Scott Campit
+"""
+from functools import lru_cache
+from math import pi
+
+import numpy as np
+import pandas as pd
+
+# Display names used by the widgets mapped to the values stored in the MetOncoFit table
+cancerNames = {
+    "Breast Cancer": "Breast",
+    "Glioma": "CNS",
+    "Colorectal Cancer": "Colorectal",
+    "Lung Cancer": "Lung",
+    "Melanoma": "Melanoma",
+    "Renal Cancer": "Renal",
+    "Prostate Cancer": "Prostate",
+    "Ovarian Cancer": "Ovarian",
+    "B-cell Lymphoma": "Leukemia",
+    "Pan Cancer": "Pan"
+}
+targetNames = {
+    "Differential Expression": "TCGA",
+    "Copy Number Variation": "CNV",
+    "Cancer Patient Survival": "SURV"
+}
+
+# Each label is drawn in one of the three heatmaps (up / neutral / down)
+labelPanels = {
+    "UPREG": 0, "UPREGULATED": 0, "GAIN": 0,
+    "NEUTRAL": 1, "NEUT": 1,
+    "DOWNREG": 2, "DOWNREGULATED": 2, "LOSS": 2
+}
+
+# makeDB.py and one_gene_only() do not agree on the column names
+columnAliases = {"Genes": "Gene", "Feature": "feature", "Value": "value", "Type": "type"}
+
+
+class HeatmapIndex():
+    """
+    HeatmapIndex holds the MetOncoFit table as one dense matrix per (cancer, target, label). Filtering by cancer and
+    target is a dictionary lookup, and a page of genes is a column slice of the matching matrix.
+    """
+
+    def __init__(self, df):
+        """
+        :params:
+            df: A long-format pandas dataframe with the Gene, feature, value, type, Cancer and Target columns.
+        """
+        df = df.rename(columns=columnAliases)
+        df = df.assign(panel=df["type"].map(labelPanels))
+        df = df.dropna(subset=["panel"])
+
+        self.blocks = {}
+        for (cancer, target), group in df.groupby(["Cancer", "Target"], sort=False):
+            # The first appearance of a feature follows the importance ranking
+            features = pd.unique(group["feature"])
+            panels = []
+            for panel in range(3):
+                subset = group.loc[group["panel"] == panel]
+                wide = subset.pivot_table(index="feature", columns="Gene",
+                                          values="value", aggfunc="mean")
+                wide = wide.reindex(features)
+                panels.append((wide.columns.to_numpy(dtype=str),
+                               features.astype(str),
+                               wide.to_numpy(dtype=np.float32)))
+            self.blocks[(cancer, target)] = panels
+
+    def numberOfGenes(self, cancer, target):
+        """
+        numberOfGenes returns the gene count of the largest label panel for a cancer and target.
+        """
+        if (cancer, target) not in self.blocks:
+            return 0
+        return max(len(genes) for genes, _, _ in self.blocks[(cancer, target)])
+
+    def window(self, cancer, target, panel, start, stop, maxColumns):
+        """
+        window returns the glyph data for genes[start:stop] of one label panel. If the slice holds more genes than
+        maxColumns, contiguous genes are averaged into maxColumns bins.
+
+        :params:
+            cancer:     A string denoting the cancer stored in the table (ie: 'Breast').
+            target:     A string denoting the target stored in the table (ie: 'CNV').
+            panel:      An integer denoting the up (0), neutral (1) or down (2) heatmap.
+            start:      An integer denoting the first gene position on the page.
+            stop:       An integer denoting the gene position after the last gene on the page.
+            maxColumns: An integer denoting the number of columns the heatmap can draw.
+
+        :return:
+            data:       A dictionary of Gene, feature and value arrays for a ColumnDataSource.
+            genes:      A list of the gene (or gene bin) labels in drawing order.
+            features:   A list of the features in drawing order.
+        """
+        if (cancer, target) not in self.blocks:
+            return dict(Gene=[], feature=[], value=[]), [], []
+
+        genes, features, values = self.blocks[(cancer, target)][panel]
+        genes = genes[start:stop]
+        values = values[:, start:stop]
+
+        if len(genes) > maxColumns:
+            edges = np.unique(np.linspace(0, len(genes), maxColumns + 1).astype(int))
+            observed = ~np.isnan(values)
+            sums = np.add.reduceat(np.where(observed, values, 0.0), edges[:-1], axis=1)
+            counts = np.add.reduceat(observed, edges[:-1], axis=1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                values = np.where(counts > 0, sums / counts, np.nan)
+            genes = np.array([genes[left] if right - left == 1 else genes[left] + u"…" + genes[right - 1]
+                              for left, right in zip(edges[:-1], edges[1:])])
+
+        x = np.tile(genes, len(features))
+        y = np.repeat(features, len(genes))
+        value = values.ravel()
+        keep = ~np.isnan(value)
+
+        data = dict(Gene=x[keep], feature=y[keep], value=value[keep])
+        return data, genes.tolist(), features.tolist()
+
+
+@lru_cache(maxsize=None)
+def load_index(filename):
+    """
+    load_index reads the MetOncoFit json table once and returns the cached HeatmapIndex.
+    """
+    df = pd.read_json(filename, orient='columns')
+    return HeatmapIndex(df)
+
+
+def make_document(doc, index, genesPerPage=100, plotWidth=400, pixelsPerGene=4):
+    """
+    make_document builds the three heatmaps and the widgets that drive them in a Bokeh server document.
+
+    :params:
+        doc:           The Bokeh document to fill.
+        index:         A HeatmapIndex object.
+        genesPerPage:  An integer denoting the initial number of genes shown per page.
+        plotWidth:     An integer denoting the width of each heatmap in pixels.
+        pixelsPerGene: An integer denoting the narrowest column that is still drawn before genes are binned.
+    """
+    from bokeh.layouts import column, row
+    from bokeh.models import ColorBar, ColumnDataSource, FactorRange, LinearColorMapper, Select, Slider
+    from bokeh.palettes import brewer
+    from bokeh.plotting import figure
+    from bokeh.transform import transform
+
+    maxColumns = max(1, plotWidth // pixelsPerGene)
+
+    # Color bar and params
+    colors = brewer["RdBu"][8]
+    mapper = LinearColorMapper(palette=colors, low=0, high=1)
+    color_bar = ColorBar(color_mapper=mapper, major_label_text_font_size="7pt",
+                         border_line_color=None, location=(0, 0))
+
+    tools_in_figure = "hover,save,pan,box_zoom,reset,wheel_zoom"
+    TOOLTIPS = [('Feature', '@feature'), ('Gene', '@Gene'), ('Value', '@value')]
+
+    sources = []
+    heatmaps = []
+    for panel in range(3):
+        source = ColumnDataSource(data=dict(Gene=[], feature=[], value=[]))
+        hm = figure(x_range=FactorRange(), y_range=FactorRange(), x_axis_location='above',
+                    width=plotWidth, height=400, tools=tools_in_figure,
+                    toolbar_location='right', tooltips=TOOLTIPS)
+        hm.rect(x="Gene", y="feature", width=1, height=1, source=source,
+                line_color=None, fill_color=transform('value', mapper))
+        hm.grid.grid_line_color = None
+        hm.axis.axis_line_color = None
+        hm.axis.major_tick_line_color = None
+        hm.axis.major_label_text_font_size = '7pt'
+        hm.axis.major_label_standoff = 0
+        hm.xaxis.major_label_orientation = pi/3
+        hm.yaxis.visible = (panel == 0)
+        sources.append(source)
+        heatmaps.append(hm)
+    heatmaps[0].add_layout(color_bar, 'left')
+
+    # Drop down menus to choose cancer and target, and sliders to page through the genes
+    cancer_type = Select(title="Cancer type:", value="Pan Cancer", options=list(cancerNames))
+    target_type = Select(title="MetOncoFit Predictions:", value="Differential Expression",
+                         options=list(targetNames))
+    gene_select = Slider(start=5, end=500, value=genesPerPage, step=5, title="Number of genes per page")
+    page_select = Slider(start=1, end=2, value=1, step=1, title="Page")
+
+    def selection():
+        return cancerNames[cancer_type.value], targetNames[target_type.value]
+
+    def update_pages():
+        cancer, target = selection()
+        pages = max(1, -(-index.numberOfGenes(cancer, target) // gene_select.value))
+        # Bokeh refuses sliders with start == end
+        page_select.end = max(2, pages)
+        if page_select.value > pages:
+            page_select.value = 1
+
+    def update_heatmaps():
+        cancer, target = selection()
+        start = (page_select.value - 1) * gene_select.value
+        stop = start + gene_select.value
+        for panel in range(3):
+            data, genes, features = index.window(cancer, target, panel, start, stop, maxColumns)
+            heatmaps[panel].x_range.factors = genes
+            heatmaps[panel].y_range.factors = features[::-1]
+            sources[panel].data = data
+
+    def on_selection(attr, old, new):
+        update_pages()
+        update_heatmaps()
+
+    def on_page(attr, old, new):
+        update_heatmaps()
+
+    cancer_type.on_change('value', on_selection)
+    target_type.on_change('value', on_selection)
+    gene_select.on_change('value_throttled', on_selection)
+    page_select.on_change('value_throttled', on_page)
+
+    on_selection('value', None, None)
+
+    widgets = column(cancer_type, target_type, gene_select, page_select)
+    doc.add_root(row(widgets, *heatmaps))
+    doc.title = "MetOncoFit"
+    return doc
+
+
+def serve(filename, port=5006, show=True):
+    """
+    serve starts a local Bokeh server for the MetOncoFit table. The table is indexed once and shared by every session.
+
+    :params:
+        filename: A string denoting the path to the MetOncoFit json table.
+        port:     An integer denoting the port to serve on.
+        show:     A boolean denoting whether to open the page in a browser.
+    """
+    from bokeh.server.server import Server
+
+    index = load_index(filename)
+    server = Server({'/': lambda doc: make_document(doc, index)}, port=port)
+    server.start()
+    if show:
+        server.io_loop.add_callback(server.show, '/')
+    server.io_loop.start()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve the MetOncoFit heatmaps from a local Bokeh server.")
+    parser.add_argument("filename", nargs='?', default="metoncofit.json")
+    parser.add_argument("--port", type=int, default=5006)
+    parser.add_argument("--no-show", dest="show", action="store_false")
+    args = parser.parse_args()
+    serve(args.filename, port=args.port, show=args.show)
@@ -92,12 +92,88 @@ def confusionMatrix(cm, targ, stats, normalize=True):
 
     return ax
 
-def dotplot(df, importance, targ):
+def binnedDensity(df, features, labels, bins=50, valueRange=(0.0, 1.0)):
+    """
+    Bin the feature values for every (feature, label) pair into fixed histograms in a single pass
+    :param df:         A pandas dataframe containing the feature, value and type columns
+    :param features:   A list of the features to bin, in plotting order
+    :param labels:     A list of the target labels to bin, in plotting order
+    :param bins:       An integer denoting the number of bins per histogram
+    :param valueRange: A tuple denoting the range covered by the bins. Values outside are put in the edge bins.
+    :return counts:    A numpy array of shape (features, labels, bins) containing the bin counts
+    :return edges:     A numpy array containing the bin edges
+    """
+    features = list(features)
+    labels = list(labels)
+    featureCodes = pd.Categorical(df['feature'], categories=features).codes
+    labelCodes = pd.Categorical(df['type'], categories=labels).codes
+    values = df['value'].to_numpy(dtype=float)
+    keep = (featureCodes >= 0) & (labelCodes >= 0) & ~np.isnan(values)
+
+    edges = np.linspace(valueRange[0], valueRange[1], bins + 1)
+    binCodes = np.clip(np.searchsorted(edges, values[keep], side='right') - 1, 0, bins - 1)
+    flat = (featureCodes[keep].astype(np.int64) * len(labels) + labelCodes[keep]) * bins + binCodes
+    counts = np.bincount(flat, minlength=len(features) * len(labels) * bins)
+
+    return counts.reshape(len(features), len(labels), bins), edges
+
+def densityStrips(ax, counts, edges, targ_labels, class_col, style='violin'):
+    """
+    Draw binned feature distributions as mirrored violins or heat strips, one per (feature, label) pair
+    :param ax:          A matplotlib axes object to draw on
+    :param counts:      A numpy array of shape (features, labels, bins) from binnedDensity
+    :param edges:       A numpy array containing the bin edges
+    :param targ_labels: A list of strings for each class
+    :param class_col:   A dictionary containing the hex codes associated with each color
+    :param style:       A string denoting the strip style. Either 'violin' or 'heat'.
+    :return ax:         A matplotlib object containing the density strips
+    """
+    from matplotlib.colors import LinearSegmentedColormap
+
+    nFeatures, nLabels, _ = counts.shape
+    centers = (edges[:-1] + edges[1:]) / 2.0
+    peak = counts.max(axis=2, keepdims=True)
+    density = np.divide(counts, peak, out=np.zeros(counts.shape), where=peak > 0)
+
+    # Medians are read off the cumulative bin counts, so they cost the same for any number of genes
+    cumulative = counts.cumsum(axis=2)
+    total = cumulative[:, :, -1:]
+    medianBin = np.argmax(cumulative >= total / 2.0, axis=2)
+    medians = np.where(total[:, :, 0] > 0, centers[medianBin], np.nan)
+
+    # Same dodge as the stripplot, with the first feature on top
+    halfWidth = 0.8 / nLabels
+    offsets = (np.arange(nLabels) - (nLabels - 1) / 2.0) * halfWidth
+    for j, label in enumerate(targ_labels):
+        color = class_col[label]
+        cmap = LinearSegmentedColormap.from_list(label, ['#FFFFFF', color])
+        for i in range(nFeatures):
+            y = i + offsets[j]
+            if style == 'heat':
+                ax.imshow(density[i, j][np.newaxis, :], cmap=cmap, vmin=0, vmax=1, aspect='auto',
+                          interpolation='nearest', zorder=1,
+                          extent=(edges[0], edges[-1], y + halfWidth / 2.0, y - halfWidth / 2.0))
+            else:
+                ax.fill_between(centers, y - density[i, j] * halfWidth / 2.0,
+                                y + density[i, j] * halfWidth / 2.0,
+                                color=color, alpha=0.6, linewidth=0, zorder=1)
+        ax.scatter(medians[:, j], np.arange(nFeatures) + offsets[j], color=color,
+                   marker='D', s=12, zorder=2)
+
+    ax.set_yticks(np.arange(nFeatures))
+    ax.set_ylim((nFeatures - 0.5, -0.5))
+    return ax
+
+def dotplot(df, importance, targ, title_name='', mode='strip', bins=50):
     """
     Create dotplot showing data distribution
     :param df:         A pandas dataframe containing the raw values
     :param importance: A pandas dataframe containing an importance dataframe
     :param targ:       A string denoting the specific target for prediction.
+    :param title_name: A string denoting the title shown next to the plot.
+    :param mode:       A string denoting how observations are drawn. 'strip' draws every observation, while 'violin'
+                       and 'heat' draw binned histograms whose render time does not depend on the number of genes.
+    :param bins:       An integer denoting the number of bins used by the 'violin' and 'heat' modes.
     :return ax:        A matplotlib object containing the dot plot data.
     """
     from matplotlib.lines import Line2D
@@ -122,27 +198,34 @@ def dotplot(df, importance, targ):
                label=list(class_col.keys())[2])
     ]
 
-    # Show each observation in scatter plot
     sns.set_style("whitegrid")
-    sns.stripplot(x="value", y="feature", data=df,
-                  hue="type", hue_order=targ_labels,
-                  palette=class_col,
-                  order=importance['Feature'],
-                  dodge=True, jitter=True,
-                  alpha=0.3, zorder=1, size=2.75, ax=ax)
-
-    # Show the conditional median and standard deviation
-    sns.pointplot(x="value", y="feature", data=df1,
-                  hue="type", hue_order=targ_labels,
-                  palette=class_col,
-                  order=importance['Feature'],
-                  dodge=0.532, join=False,
-                  markers="D", scale=0.75, ci="sd",
-                  estimator=median, errwidth=1.00, ax=ax)
-
-    # Dotplot specific handles
-    handles, labels = ax.get_legend_handles_labels()
-    labels, handles = zip(*sorted(zip(labels, handles), key=lambda t: t[0]))
+    if mode in ('violin', 'heat'):
+        # Show the binned distribution and its median for each feature and label
+        counts, edges = binnedDensity(df, importance['Feature'], targ_labels, bins=bins)
+        densityStrips(ax, counts, edges, targ_labels, class_col, style=mode)
+        ax.set_yticklabels(importance['Feature'])
+    else:
+        # Show each observation in scatter plot
+        sns.stripplot(x="value", y="feature", data=df,
+                      hue="type", hue_order=targ_labels,
+                      palette=class_col,
+                      order=importance['Feature'],
+                      dodge=True, jitter=True,
+                      alpha=0.3, zorder=1, size=2.75, ax=ax)
+
+        # Show the conditional median and standard deviation
+        sns.pointplot(x="value", y="feature", data=df,
+                      hue="type", hue_order=targ_labels,
+                      palette=class_col,
+                      order=importance['Feature'],
+                      dodge=0.532, join=False,
+                      markers="D", scale=0.75, ci="sd",
+                      estimator=median, errwidth=1.00, ax=ax)
+
+        # Dotplot specific handles
+        handles, labels = ax.get_legend_handles_labels()
+        labels, handles = zip(*sorted(zip(labels, handles), key=lambda t: t[0]))
+
     ax.legend(handles=legend_elements,
               bbox_to_anchor=(-1.50, -0.1),
               loc=3, ncol=3,
@@ -241,52 +324,108 @@ def concatFigures(cmPlt, dotPlt, varImpPlt):
 
     return figure, axarr
 
-def pathwayHeatmaps(df, importance, targ, genelist):
+def readGeneList(genelist):
     """
-    Create heatmap showing data values corresponding to specific pathways.
+    Read a pathway gene list file. The first line is the pathway name and every other line is a gene symbol.
+    :param genelist: A string denoting the path to the gene list file
+    :return genes:   A list of gene symbols
+    """
+    with open(genelist, "r") as file:
+        genes = file.read().split('\n')
+    del genes[0]
+    return [gene.strip() for gene in genes if gene.strip()]
+
+def geneRowIndex(genes):
+    """
+    Map each gene symbol to the row positions where it appears.
+    :param genes:  An array-like of gene symbols, one per row
+    :return index: A dictionary mapping each gene symbol to a numpy array of row positions. Rows without a gene
+                   symbol are left out.
+    """
+    codes, uniques = pd.factorize(np.asarray(genes))
+    # Missing symbols get the code -1, and would shift every other gene's rows if they were sorted in
+    rows = np.flatnonzero(codes >= 0)
+    order = rows[np.argsort(codes[rows], kind='stable')]
+    stops = np.cumsum(np.bincount(codes[rows], minlength=len(uniques)))
+    starts = np.concatenate(([0], stops[:-1]))
+    return {gene: order[start:stop] for gene, start, stop in zip(uniques, starts, stops)}
+
+def pathwayMatrix(df, importance):
+    """
+    Pivot the melted values once into a wide (label, gene) x feature matrix and index its rows by gene. Build this
+    once per tissue and pass it to pathwayHeatmapsMulti for every pathway.
+    :param df:         A pandas dataframe of the raw values
+    :param importance: A pandas dataframe of the variable importances from random forests
+    :return wide:      A pandas dataframe indexed by (type, Genes) with the features ranked by importance as columns
+    :return index:     A dictionary mapping each gene symbol to its row positions in wide
+    """
+    wide = df.pivot_table(index=['type', 'Genes'], columns='feature',
+                          values='value', aggfunc='mean')
+    wide = wide.reindex(columns=importance['Feature'].tolist())
+    index = geneRowIndex(wide.index.get_level_values('Genes'))
+    return wide, index
+
+def pathwayHeatmapsMulti(df, importance, targ, genelists, matrix=None):
+    """
+    Create heatmaps showing data values corresponding to many pathways from a single pivoted matrix.
     :param df:         A pandas dataframe of the raw values
     :param importance: A pandas dataframe of the variable importances from random forests
     :param targ:       A string denoting the target type
-    :param genelist:   A list containing the list of genes to query for the heatmap
-    :return figure:    A matplotlib figure object
-    :return axarr:     A matplotlib axes object
+    :param genelists:  A dictionary mapping the pathway name to a gene list file or a list of genes
+    :param matrix:     The (wide, index) tuple from pathwayMatrix. It is built from df if it is not given.
+    :return figures:   A dictionary mapping the pathway name to the (figure, axarr) tuple
     """
     targ_labels, class_col = colormapper(targ)
+    if matrix is None:
+        matrix = pathwayMatrix(df, importance)
+    wide, index = matrix
 
-    # Read in gene list
-    file = open(genelist, "r")
-    genes = file.read().split('\n')
-    file.close()
-    del genes[0]
-
-    # Get only the values you want:
-    df = df.loc[df['Genes'].isin(genes)]
-    rank = importance['Feature'].tolist()
+    values = wide.to_numpy()
+    rowLabels = wide.index.get_level_values('type').to_numpy()
+    rowGenes = wide.index.get_level_values('Genes').to_numpy()
 
-    # Main figure parameters and arguments
     sns.set_style("whitegrid")
-    figure, axarr = plt.subplots(nrows=1, ncols=3,
-                                 figsize=(7.2, 3.6),
-                                 gridspec_kw={
-                                     'width_ratios': [1, 1, 1],
-                                     'wspace': 0.2
-                                 }, sharex=False)
-
-    # Divide the df into 3 dataframes separated by target label
-    dfs = []
-    for i in range(len(targ_labels)):
-        dfs[i] = df.loc[(df['type'] == targ_labels[i])]
-        dfs[i] = dfs[i].pivot(index='feature', columns='Genes', values='value')
-        dfs[i] = dfs[i].reindex(rank)
-
-        sns.heatmap(dfs[i], cmap='RdBu', robust=True, cbar=False,
-                    square=False, yticklabels=True, ax=axarr[i])
-        axarr[i].set_xlabel('')
-        axarr[i].set_ylabel('')
-        axarr[i].set_title(targ_labels[i])
-
-    figure.tight_layout()
-    return figure, axarr
+    figures = {}
+    for name, genes in genelists.items():
+        if isinstance(genes, str):
+            genes = readGeneList(genes)
+        rows = [index[gene] for gene in genes if gene in index]
+        rows = np.sort(np.concatenate(rows)) if rows else np.empty(0, dtype=int)
+
+        # Main figure parameters and arguments
+        figure, axarr = plt.subplots(nrows=1, ncols=3,
+                                     figsize=(7.2, 3.6),
+                                     gridspec_kw={
+                                         'width_ratios': [1, 1, 1],
+                                         'wspace': 0.2
+                                     }, sharex=False)
+
+        # Divide the rows into 3 panels separated by target label
+        for i in range(len(targ_labels)):
+            panel = rows[rowLabels[rows] == targ_labels[i]]
+            if len(panel) > 0:
+                panelDF = pd.DataFrame(values[panel].T, index=wide.columns, columns=rowGenes[panel])
+                sns.heatmap(panelDF, cmap='RdBu', robust=True, cbar=False,
+                            square=False, yticklabels=True, ax=axarr[i])
+            axarr[i].set_xlabel('')
+            axarr[i].set_ylabel('')
+            axarr[i].set_title(targ_labels[i])
+
+        figure.tight_layout()
+        figures[name] = (figure, axarr)
+    return figures
+
+def pathwayHeatmaps(df, importance, targ, genelist):
+    """
+    Create heatmap showing data values corresponding to specific pathways.
+    :param df:         A pandas dataframe of the raw values
+    :param importance: A pandas dataframe of the variable importances from random forests
+    :param targ:       A string denoting the target type
+    :param genelist:   A string denoting the gene list file to query for the heatmap
+    :return figure:    A matplotlib figure object
+    :return axarr:     A matplotlib axes object
+    """
+    return pathwayHeatmapsMulti(df, importance, targ, {genelist: genelist})[genelist]
 
 if __name__ == "__main__":
     cmPlt = confusionMatrix(cm, targ, stats, normalize=True)
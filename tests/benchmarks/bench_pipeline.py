@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+bench_pipeline.py times and profiles the memory of the MetOncoFit pipeline, and compares the results to a stored
+baseline.
+
+The inputs are synthetic tumor models from utils.synthetic, so no patient data is needed. Three input sizes are used:
+    * small:  200 genes in 3 cell lines
+    * medium: 1,500 genes in 8 cell lines (a typical tissue model)
+    * pan:    1,500 genes in 60 cell lines (the pan-cancer model)
+
+The cases are split into micro benchmarks (single functions, and the start up of the metoncofit.py command line for
+--help and for predict with a saved model) and macro benchmarks (model training, the database build
+and figure rendering). The time is the median wall time over the repeats, and the memory is the peak traced by
+tracemalloc (or the peak resident set size for cases run in a subprocess). A case that fails is reported with its
+error, and the other cases still run.
+
+Usage (from the repository root):
+    python tests/benchmarks/bench_pipeline.py --sizes small medium --save            # record the baseline
+    python tests/benchmarks/bench_pipeline.py --sizes small medium --tolerance 0.2   # compare to the baseline
+
+The vocabulary and the artifact cache are kept in the temporary work directory, so a run never changes data/ or
+output/ in the repository.
+
+A case that fails is recorded with its error in the baseline, and counts as a regression in a comparison, so a broken
+case can not drop out of the check. The comparison exits with status 1 if any case fails, or is slower or uses more
+memory than the baseline allows, and --save exits with status 1 if any case failed. No baseline is
+committed, since the timings are not comparable across machines: the baseline is stored per machine in
+tests/benchmarks/baselines/<machine name>.json, so record one with --save on a clean checkout before the change you
+want to check. Without a baseline, the results are printed and the script exits with status 2, so a regression check
+can not pass by mistake.
+
+@author: Scott Campit
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+
+import numpy as np
+import pandas as pd
+
+repoPath = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+srcPath = os.path.join(repoPath, "src")
+labelFileName = os.path.join(repoPath, "srv", "headers.txt")
+baselinePath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+# The pipeline modules import their siblings directly (ie: `import DataPreparation`)
+for path in [srcPath, os.path.join(srcPath, "utils")]:
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import synthetic
+
+# Number of genes and cell lines in each input size
+inputSizes = {
+    "small": (200, 3),
+    "medium": (1500, 8),
+    "pan": (1500, 60)
+}
+
+
+def writeFigureTables(tablePath, tissue, target, nGenes, topFeatures=10, seed=0):
+    """
+    writeFigureTables writes the importance, figure and confusion tables read by visualization.batch.
+    """
+    rng = np.random.RandomState(seed)
+    features = ["Feature " + str(feature) for feature in range(topFeatures)]
+    labels = ["GAIN", "NEUT", "LOSS"] if target == "CNV" else ["UPREG", "NEUTRAL", "DOWNREG"]
+    stem = os.path.join(tablePath, tissue + "_" + target + "_")
+
+    pd.DataFrame({"Feature": features,
+                  "Gini": np.sort(rng.rand(topFeatures))[::-1],
+                  "R": rng.uniform(-1, 1, topFeatures)}).to_csv(stem + "importance.csv", index=False)
+    pd.DataFrame({"Genes": np.tile(["G" + str(gene) for gene in range(nGenes)], topFeatures),
+                  "feature": np.repeat(features, nGenes),
+                  "value": rng.rand(nGenes * topFeatures),
+                  "type": rng.choice(labels, nGenes * topFeatures)}).to_csv(stem + "figure.csv", index=False)
+    np.savetxt(stem + "confusion.csv", rng.randint(0, 100, (3, 3)), delimiter=",")
+
+
+def makeInputs(workPath, size):
+    """
+    makeInputs writes the synthetic inputs for one size and returns their paths.
+    """
+    nGenes, nCellLines = inputSizes[size]
+    inputs = {"root": os.path.join(workPath, size)}
+    for path in ["data/median", "data/original", "labels", "work", "tables", "figures"]:
+        os.makedirs(os.path.join(inputs["root"], path))
+
+    inputs["model"] = os.path.join(inputs["root"], "data", "original", "breast.csv")
+    synthetic.writeTumorModel(inputs["model"], labelFileName, nGenes=nGenes, nCellLines=nCellLines)
+    # make-db.py lists data/median and reads data/original, with the feature names in labels/real_headers.txt
+    shutil.copy(inputs["model"], os.path.join(inputs["root"], "data", "median", "breast.csv"))
+    shutil.copy(labelFileName, os.path.join(inputs["root"], "labels", "real_headers.txt"))
+
+    inputs["tables"] = os.path.join(inputs["root"], "tables")
+    inputs["figures"] = os.path.join(inputs["root"], "figures")
+    writeFigureTables(inputs["tables"], "breast", "CNV", nGenes)
+    return inputs
+
+
+def _randomForest(inputs):
+    import DataPreparation
+    from classifiers import trees
+
+    Xtrain, Xtest, Ytrain, Ytest = DataPreparation.processDataFromFile(inputs["model"], "CNV", "DE_and_CNV",
+                                                                       labelFileName)
+    return lambda: trees.randomForestClassification(Xtrain, Ytrain, Xtest, Ytest)
+
+
+def _confusionMatrix(inputs):
+    import DataPreparation
+    import validator
+    from sklearn.ensemble import RandomForestClassifier
+
+    Xtrain, _, Ytrain, _ = DataPreparation.processDataFromFile(inputs["model"], "CNV", "DE_and_CNV", labelFileName)
+    RFC = RandomForestClassifier(n_estimators=128, random_state=0).fit(Xtrain, Ytrain)
+    return lambda: validator.computeConfusionMatrix(inputs["model"], "CNV", "DE_and_CNV", labelFileName, RFC,
+                                                    iterations=10)
+
+
+def _oneGeneOnly(inputs):
+    import DataPreparation
+    import process
+    from sklearn.ensemble import RandomForestClassifier
+
+    model, cancer = DataPreparation.load_data(inputs["model"], labelFileName)
+    model = DataPreparation.label_encode(model)
+    model = model.drop(columns=["TCGA gene expression fold change", "CNV gain/loss ratio", "TCGA annotation",
+                                "SURV"])
+    header = model.drop(columns="CNV").columns
+    RFC = RandomForestClassifier(n_estimators=32, random_state=0).fit(model[header], model["CNV"])
+    return lambda: process.one_gene_only(model, "CNV", header, RFC, cancer)
+
+
+def _makeDB(inputs):
+    script = os.path.join(srcPath, "utils", "make-db.py")
+    return lambda: subprocess.run([sys.executable, script], cwd=os.path.join(inputs["root"], "work"),
+                                  check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def _renderFigures(inputs):
+    from visualization import batch
+    return lambda: batch.renderAll(inputs["tables"], inputs["figures"], workers=1, fmt="png", force=True)
+
+
+def _cliStartup(inputs):
+    script = os.path.join(srcPath, "metoncofit.py")
+    return lambda: subprocess.run([sys.executable, script, "--help"], cwd=srcPath, check=True,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def _cliPredict(inputs):
+    import joblib
+    import DataPreparation
+    from sklearn.ensemble import RandomForestClassifier
+
+    Xtrain, _, Ytrain, _ = DataPreparation.processDataFromFile(inputs["model"], "CNV", "DE_and_CNV", labelFileName)
+    modelFile = os.path.join(inputs["root"], "model.pkl")
+    joblib.dump(RandomForestClassifier(n_estimators=128, random_state=0).fit(Xtrain, Ytrain), modelFile)
+
+    script = os.path.join(srcPath, "metoncofit.py")
+    command = [sys.executable, script, "predict", modelFile, inputs["model"], labelFileName,
+               "--output", os.path.join(inputs["root"], "predictions.csv")]
+    return lambda: subprocess.run(command, cwd=srcPath, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def _loadData(inputs):
+    import DataPreparation
+    return lambda: DataPreparation.load_data(inputs["model"], labelFileName)
+
+
+def _processData(inputs):
+    import DataPreparation
+    return lambda: DataPreparation.processDataFromFile(inputs["model"], "CNV", "DE_and_CNV", labelFileName)
+
+
+# Each case maps to (suite, setup, repeats, subprocess). The setup runs once outside of the timer and returns the
+# function that is timed.
+benchmarkCases = {
+    "cli_startup": ("micro", _cliStartup, 5, True),
+    "cli_predict": ("micro", _cliPredict, 3, True),
+    "load_data": ("micro", _loadData, 5, False),
+    "processDataFromFile": ("micro", _processData, 5, False),
+    "one_gene_only": ("micro", _oneGeneOnly, 3, False),
+    "computeConfusionMatrix": ("micro", _confusionMatrix, 1, False),
+    "randomForestClassification": ("macro", _randomForest, 1, False),
+    "makeDB": ("macro", _makeDB, 1, True),
+    "renderFigures": ("macro", _renderFigures, 1, True)
+}
+
+
+def timeCase(function, repeats, inSubprocess=False):
+    """
+    timeCase runs a benchmark function and returns the median wall time and the peak memory in MB.
+    """
+    import resource
+
+    times = []
+    peak = 0.0
+    for _ in range(repeats):
+        if inSubprocess:
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+            # ru_maxrss is in kB on Linux and the largest child seen so far
+            peak = max(peak, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0)
+        else:
+            tracemalloc.start()
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] / 1024.0 ** 2)
+            tracemalloc.stop()
+    return float(np.median(times)), peak
+
+
+def isolateState(workPath):
+    """
+    isolateState points the vocabulary and the artifact cache of the pipeline at the work directory, for this process
+    and the subprocess cases.
+    """
+    settings = {"METONCOFIT_VOCABULARY": os.path.join(workPath, "vocabulary.json"),
+                "METONCOFIT_CACHE": os.path.join(workPath, "cache")}
+    os.environ.update(settings)
+    # Modules imported before read the environment at import
+    for name in ["vocabulary", "utils.vocabulary"]:
+        if name in sys.modules:
+            sys.modules[name].defaultVocabularyFile = settings["METONCOFIT_VOCABULARY"]
+    for name in ["cache", "utils.cache"]:
+        if name in sys.modules:
+            sys.modules[name].defaultPath = settings["METONCOFIT_CACHE"]
+
+
+def runBenchmarks(sizes=("small", "medium"), cases=None, suite=None, workPath=None):
+    """
+    runBenchmarks times every case on every input size.
+
+    :params:
+        sizes:    A list of the input sizes to run (see inputSizes).
+        cases:    A list of the case names to run. The default runs every case.
+        suite:    A string denoting the suite to run ('micro' or 'macro'). The default runs both.
+        workPath: A string denoting the directory the synthetic inputs are written to. The default uses a temporary
+            directory that is removed afterwards.
+
+    :return:
+        results:  A pandas dataframe with the Case, Suite, Size, Time (s), Peak memory (MB) and Error columns.
+    """
+    cases = list(benchmarkCases) if cases is None else cases
+    cleanup = workPath is None
+    workPath = tempfile.mkdtemp(prefix="metoncofit_bench_") if workPath is None else workPath
+    isolateState(workPath)
+
+    rows = []
+    try:
+        for size in sizes:
+            inputs = makeInputs(workPath, size)
+            for case in cases:
+                caseSuite, setup, repeats, inSubprocess = benchmarkCases[case]
+                if suite is not None and caseSuite != suite:
+                    continue
+                print("Running " + case + " (" + size + ")")
+                try:
+                    elapsed, peak = timeCase(setup(inputs), repeats, inSubprocess)
+                    rows.append([case, caseSuite, size, elapsed, peak, ""])
+                except Exception as error:
+                    if tracemalloc.is_tracing():
+                        tracemalloc.stop()
+                    message = getattr(error, "stderr", None) or str(error)
+                    if isinstance(message, bytes):
+                        # Keep the exception line of the subprocess traceback
+                        message = message.decode(errors="replace").strip().splitlines()[-1]
+                    message = message.strip().splitlines()[0] if message.strip() else ""
+                    rows.append([case, caseSuite, size, np.nan, np.nan, type(error).__name__ + ": " + message])
+    finally:
+        if cleanup:
+            shutil.rmtree(workPath, ignore_errors=True)
+
+    return pd.DataFrame(rows, columns=["Case", "Suite", "Size", "Time (s)", "Peak memory (MB)", "Error"])
+
+
+def baselineFile(name=None):
+    """
+    baselineFile returns the path of the stored baseline. Baselines are kept per machine by default, since the
+    timings are not comparable across hardware.
+    """
+    name = platform.node() if name is None else name
+    return os.path.join(baselinePath, name + ".json")
+
+
+def saveBaseline(results, name=None):
+    """
+    saveBaseline stores the benchmark results, along with the machine and package versions, as the baseline. Failed
+    cases are stored with their error.
+    """
+    import sklearn
+
+    if not os.path.exists(baselinePath):
+        os.makedirs(baselinePath)
+    record = {
+        "machine": platform.node(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "sklearn": sklearn.__version__,
+        "results": results.astype(object).where(results.notnull(), None).to_dict(orient="records")
+    }
+    fileName = baselineFile(name)
+    with open(fileName, "w") as fil:
+        json.dump(record, fil, indent=2)
+    return fileName
+
+
+def compareToBaseline(results, name=None, tolerance=0.2):
+    """
+    compareToBaseline joins the benchmark results with the stored baseline.
+
+    :params:
+        results:   A pandas dataframe from runBenchmarks.
+        name:      A string denoting the baseline name. The default uses the machine name.
+        tolerance: A float denoting the allowed relative increase in time or memory before a case is a regression.
+
+    :return:
+        report:    A pandas dataframe with the current and baseline values, their ratios and a Regression column.
+            A case that fails is a regression.
+    """
+    with open(baselineFile(name)) as fil:
+        baseline = pd.DataFrame(json.load(fil)["results"])
+    if "Error" not in baseline.columns:
+        baseline["Error"] = ""
+    baseline["Error"] = baseline["Error"].fillna("")
+
+    report = results.merge(baseline[["Case", "Size", "Time (s)", "Peak memory (MB)", "Error"]], on=["Case", "Size"],
+                           how="left", suffixes=("", " baseline"))
+    for column in ["Time (s)", "Peak memory (MB)", "Time (s) baseline", "Peak memory (MB) baseline"]:
+        report[column] = report[column].astype(float)
+    report["Time ratio"] = report["Time (s)"] / report["Time (s) baseline"]
+    report["Memory ratio"] = report["Peak memory (MB)"] / report["Peak memory (MB) baseline"]
+    report["Regression"] = ((report["Time ratio"] > 1 + tolerance) | (report["Memory ratio"] > 1 + tolerance) |
+                            (report["Error"] != ""))
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the MetOncoFit pipeline against a stored baseline.")
+    parser.add_argument("--sizes", nargs="+", default=["small", "medium"], choices=list(inputSizes))
+    parser.add_argument("--cases", nargs="+", default=None, choices=list(benchmarkCases))
+    parser.add_argument("--suite", default=None, choices=["micro", "macro"])
+    parser.add_argument("--baseline", default=None, help="Baseline name (defaults to the machine name)")
+    parser.add_argument("--save", action="store_true", help="Store the results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = runBenchmarks(args.sizes, args.cases, args.suite)
+    pd.set_option("display.width", 200)
+
+    failed = results.loc[results["Error"] != ""]
+    if args.save:
+        print(results.to_string(index=False))
+        print("Saved the baseline to " + saveBaseline(results, args.baseline))
+        if len(failed) > 0:
+            print("Failed cases: " + ", ".join(failed["Case"] + " (" + failed["Size"] + ")"))
+            sys.exit(1)
+    elif not os.path.exists(baselineFile(args.baseline)):
+        print(results.to_string(index=False))
+        print("No baseline found at " + baselineFile(args.baseline) + ", run with --save to record one")
+        sys.exit(2)
+    else:
+        report = compareToBaseline(results, args.baseline, args.tolerance)
+        print(report.to_string(index=False))
+        if report["Regression"].any():
+            print("Performance regressions: " + ", ".join(report.loc[report["Regression"], "Case"] + " (" +
+                                                           report.loc[report["Regression"], "Size"] + ")"))
+            sys.exit(1)
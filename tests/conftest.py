@@ -0,0 +1,16 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+conftest.py puts the pipeline modules on the path, as the scripts in src/ expect.
+
+@author: Scott Campit
+"""
+import os
+import sys
+
+srcPath = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# The pipeline modules import their siblings directly (ie: `import cache`)
+for path in [srcPath, os.path.join(srcPath, "utils")]:
+    if path not in sys.path:
+        sys.path.insert(0, path)
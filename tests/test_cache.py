@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+test_cache.py checks the keys and the least recently used eviction of utils.cache.
+
+@author: Scott Campit
+"""
+import os
+
+from utils import cache
+
+
+def test_cached_computes_once(tmp_path):
+    store = cache.ArtifactCache(str(tmp_path / "cache"))
+    calls = []
+
+    def square(x):
+        calls.append(x)
+        return x * x
+
+    assert store.cached("square", square, params={"x": 3}, args=(3,)) == 9
+    assert store.cached("square", square, params={"x": 3}, args=(3,)) == 9
+    assert store.cached("square", square, params={"x": 4}, args=(4,)) == 16
+    assert calls == [3, 4]
+
+
+def test_file_contents_change_the_key(tmp_path):
+    store = cache.ArtifactCache(str(tmp_path / "cache"))
+    fileName = str(tmp_path / "breast.csv")
+    with open(fileName, "w") as fil:
+        fil.write("a,b\n1,2\n")
+    before = store.key("model", [fileName])
+
+    with open(fileName, "w") as fil:
+        fil.write("a,b\n1,3\n")
+
+    assert store.key("model", [fileName]) != before
+
+
+def test_evict_removes_least_recently_used(tmp_path):
+    store = cache.ArtifactCache(str(tmp_path / "cache"), maxBytes=10 ** 9)
+    keys = ["a" * 40, "b" * 40, "c" * 40]
+    for age, key in enumerate(keys):
+        fileName = store.put(key, bytes(1000))
+        os.utime(fileName, (1000 + age, 1000 + age))
+
+    # Reading the oldest artifact makes it the most recently used
+    assert store.get(keys[0]) == bytes(1000)
+    size = os.path.getsize(store._object(keys[0]))
+
+    assert store.evict(maxBytes=2 * size) == 1
+    assert store.get(keys[1]) is None
+    assert store.get(keys[0]) is not None
+    assert store.get(keys[2]) is not None
+
+    assert store.clear() == 2
+    assert store.size() == 0
+
+
+def test_corrupt_artifact_is_recomputed(tmp_path):
+    store = cache.ArtifactCache(str(tmp_path / "cache"))
+    key = store.key("square", params={"x": 3})
+    fileName = store.put(key, list(range(1000)))
+    with open(fileName, "r+b") as fil:
+        fil.truncate(20)
+
+    assert store.get(key) is None
+    assert not os.path.exists(fileName)
+    assert store.cached("square", lambda: 9, params={"x": 3}, code=[]) == 9
+
+
+def test_directory_is_created_lazily(tmp_path):
+    path = tmp_path / "cache"
+    store = cache.ArtifactCache(str(path))
+
+    assert store.get("a" * 40) is None
+    assert store.size() == 0
+    assert not path.exists()
+    store.put("a" * 40, 1)
+    assert path.exists()
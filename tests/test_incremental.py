@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+test_incremental.py checks how utils.incremental merges delta rows into a tumor model.
+
+@author: Scott Campit
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import incremental
+
+
+def tumorModel(rows):
+    model = pd.DataFrame(rows, columns=["Gene", "Cell line", "Expression", "SURV"])
+    return model.set_index(["Gene", "Cell line"])
+
+
+@pytest.fixture
+def model():
+    return tumorModel([("A", "MCF7", 1.0, "UPREG"),
+                       ("B", "MCF7", 2.0, "NEUTRAL"),
+                       ("C", "T47D", 3.0, "DOWNREG")])
+
+
+def test_merge_replaces_and_adds_rows(model):
+    delta = tumorModel([("B", "MCF7", 5.0, "UPREG"),
+                        ("D", "T47D", 4.0, "NEUTRAL")])
+
+    merged, changed = incremental.mergeRows(model, delta)
+
+    assert list(changed) == [("B", "MCF7"), ("D", "T47D")]
+    assert list(merged.index) == [("A", "MCF7"), ("B", "MCF7"), ("C", "T47D"), ("D", "T47D")]
+    assert merged.loc[("B", "MCF7"), "Expression"] == 5.0
+    assert merged.loc[("B", "MCF7"), "SURV"] == "UPREG"
+    assert merged.loc[("A", "MCF7")].equals(model.loc[("A", "MCF7")])
+
+
+def test_identical_rows_are_not_changes(model):
+    merged, changed = incremental.mergeRows(model, model.iloc[[1]].copy())
+
+    assert len(changed) == 0
+    assert merged is model
+
+
+def test_last_duplicate_wins(model):
+    delta = tumorModel([("A", "MCF7", 7.0, "UPREG"),
+                        ("A", "MCF7", 8.0, "UPREG")])
+
+    merged, changed = incremental.mergeRows(model, delta)
+
+    assert list(changed) == [("A", "MCF7")]
+    assert merged.loc[("A", "MCF7"), "Expression"] == 8.0
+
+
+def test_missing_columns_are_rejected(model):
+    with pytest.raises(ValueError, match="SURV"):
+        incremental.mergeRows(model, model.drop(columns="SURV"))
+
+
+def test_round_trip_keeps_row_digests(model, tmp_path):
+    model["Expression"] = [0.1, 1.0 / 3.0, np.pi]
+    fileName = str(tmp_path / "breast.csv")
+
+    incremental.writeTumorModel(model, fileName)
+    merged, changed = incremental.mergeRows(model, incremental.readTumorModel(fileName))
+
+    assert len(changed) == 0
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+test_jobqueue.py checks the retries and the results of both job queue backends.
+
+@author: Scott Campit
+"""
+import os
+import time
+
+import numpy as np
+import pytest
+
+from utils import jobqueue
+
+
+def flaky(counter, failures):
+    """
+    flaky raises for the first failures calls with the same counter file, then returns numpy values.
+    """
+    calls = int(open(counter).read()) + 1 if os.path.exists(counter) else 1
+    with open(counter, "w") as fil:
+        fil.write(str(calls))
+    if calls <= failures:
+        raise RuntimeError("attempt " + str(calls))
+    return {"accuracy": np.float64(0.5), "matrix": np.eye(2, dtype=np.int64), "calls": calls}
+
+
+@pytest.fixture(params=["sweep.db", "sweep"])
+def queuePath(request, tmp_path):
+    return str(tmp_path / request.param)
+
+
+def submit(queuePath, counter, failures, maxAttempts=3):
+    queue = jobqueue.openQueue(queuePath, maxAttempts=maxAttempts)
+    return queue, queue.submit([{"task": __name__ + ":flaky", "kwargs": {"counter": counter, "failures": failures}}])
+
+
+def test_retry_until_success(queuePath, tmp_path):
+    queue, (jobId,) = submit(queuePath, str(tmp_path / "counter"), failures=2)
+
+    assert jobqueue.runWorker(queuePath, worker="w1") == 1
+
+    job = queue.results()[jobId]
+    assert job["state"] == "done"
+    assert job["attempts"] == 3
+    assert job["result"] == {"accuracy": 0.5, "matrix": [[1, 0], [0, 1]], "calls": 3}
+
+
+def test_failed_after_max_attempts(queuePath, tmp_path):
+    queue, (jobId,) = submit(queuePath, str(tmp_path / "counter"), failures=5, maxAttempts=2)
+
+    claimed = queue.claim("w1")
+    assert claimed[2] == 1
+    assert queue.fail(jobId, "w1", "attempt 1")
+    claimed = queue.claim("w1")
+    assert claimed[2] == 2
+    assert queue.fail(jobId, "w1", "attempt 2")
+
+    assert queue.claim("w1") is None
+    job = queue.results()[jobId]
+    assert job["state"] == "failed"
+    assert job["error"] == "attempt 2"
+    assert queue.status()["failed"] == 1
+
+
+def test_expired_lease_is_requeued(queuePath, tmp_path):
+    queue, (jobId,) = submit(queuePath, str(tmp_path / "counter"), failures=0)
+
+    assert queue.claim("w1", lease=-1)[0] == jobId
+    # The first worker lost the job, so a second worker gets it and the late result is refused
+    assert queue.claim("w2", lease=60)[0] == jobId
+    assert not queue.complete(jobId, "w1", 1)
+    assert queue.complete(jobId, "w2", 2)
+    assert queue.results()[jobId]["result"] == 2
+
+
+def test_sweep_jobs_seed_is_opt_in():
+    grid = {"tissue": ["breast", "lung"], "target": ["CNV"]}
+
+    assert all("seed" not in payload["kwargs"] for payload in jobqueue.sweepJobs("m:f", grid, iterations=2))
+    seeded = jobqueue.sweepJobs("m:f", grid, iterations=2, seedArgument="seed")
+    assert [payload["kwargs"]["seed"] for payload in seeded] == [0, 1, 0, 1]
+
+
+def test_expiry_during_finish_does_not_requeue(tmp_path):
+    queue = jobqueue.DirectoryQueue(str(tmp_path / "sweep"))
+    (jobId,) = queue.submit([{"task": "m:f"}])
+    queue.claim("w1", lease=60)
+
+    # Another worker expires the lease while the first one is storing its result
+    read = queue._read
+
+    def readThenExpire(fileName):
+        record = read(fileName)
+        queue._expire(time.time() + 3600)
+        return record
+
+    queue._read = readThenExpire
+    assert queue.complete(jobId, "w1", 1)
+    queue._read = read
+
+    assert queue.status() == {"queued": 0, "running": 0, "done": 1, "failed": 0}
+    assert queue.results()[jobId]["result"] == 1
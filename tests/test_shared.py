@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+test_shared.py checks that the shared datasets are read correctly by the workers, and that persistent workers drop the
+memory maps of closed datasets.
+
+@author: Scott Campit
+"""
+import numpy as np
+import pandas as pd
+
+from utils import shared
+
+
+def attachedPaths(handle):
+    """
+    attachedPaths reads a shared dataset in a worker and returns the datasets the worker has mapped.
+    """
+    handle.X.sum()
+    return sorted(shared._attached)
+
+
+def test_handle_reads_the_arrays():
+    index = pd.MultiIndex.from_tuples([("A", "MCF7"), ("B", "MCF7"), ("A", "T47D")], names=["Genes", "Cell Line"])
+    X = np.arange(6, dtype=float).reshape(3, 2)
+    with shared.SharedDataset(X, ["UPREG", "NEUTRAL", "UPREG"], index=index) as dataset:
+        handle = dataset.handle
+        assert np.array_equal(handle.X, X)
+        assert list(handle.labels) == ["UPREG", "NEUTRAL", "UPREG"]
+        assert list(handle.geneNames[handle.genes]) == ["A", "B", "A"]
+        assert list(handle.cellLineNames[handle.cellLines]) == ["MCF7", "MCF7", "T47D"]
+
+
+def test_closed_datasets_are_dropped_in_persistent_workers():
+    from joblib import Parallel, delayed
+
+    seen = []
+    with Parallel(n_jobs=2, backend="loky") as parallel:
+        for i in range(5):
+            with shared.SharedDataset(np.full((4, 3), float(i))) as dataset:
+                mapped = parallel(delayed(attachedPaths)(dataset.handle) for _ in range(4))
+            seen.append(max(len(paths) for paths in mapped))
+            assert all(dataset.path in paths for paths in mapped)
+
+    # The maps of the closed datasets are dropped when a worker attaches the next one
+    assert seen == [1] * 5
+    assert shared._attached == {}
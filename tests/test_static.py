@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+test_static.py checks the gene row index used by the pathway heatmaps.
+
+@author: Scott Campit
+"""
+import numpy as np
+
+from visualization import static
+
+
+def test_gene_row_index():
+    index = static.geneRowIndex(["PKM", "LDHA", "PKM", "HK2", "LDHA"])
+
+    assert sorted(index) == ["HK2", "LDHA", "PKM"]
+    assert list(index["PKM"]) == [0, 2]
+    assert list(index["LDHA"]) == [1, 4]
+    assert list(index["HK2"]) == [3]
+
+
+def test_missing_genes_are_left_out():
+    index = static.geneRowIndex([np.nan, "PKM", "LDHA", None, "PKM"])
+
+    assert sorted(index) == ["LDHA", "PKM"]
+    assert list(index["PKM"]) == [1, 4]
+    assert list(index["LDHA"]) == [2]
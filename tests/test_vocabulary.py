@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+test_vocabulary.py checks that the global category codes stay stable, including when several processes extend the
+vocabulary at once.
+
+@author: Scott Campit
+"""
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from utils import vocabulary
+
+column = "RECON1 subsystem"
+
+
+def extend(fileName, values):
+    vocabulary.Vocabulary(fileName).extend(column, values)
+
+
+def test_codes_are_stable(tmp_path):
+    fileName = str(tmp_path / "vocabulary.json")
+    first = vocabulary.Vocabulary(fileName)
+
+    codes = first.encode(["Glycolysis", np.nan, "Urea cycle", "Glycolysis"], column, grow=True)
+    assert list(codes) == [0, -1, 1, 0]
+    assert codes.dtype == np.int16
+
+    # A new category is appended, and a fresh reader of the file gets the same codes
+    assert list(first.encode(["Urea cycle", "TCA cycle"], column, grow=True)) == [1, 2]
+    second = vocabulary.Vocabulary(fileName)
+    assert list(second.encode(["TCA cycle", "Glycolysis"], column, grow=False)) == [2, 0]
+    assert list(second.decode([2, -1], column)[:1]) == ["TCA cycle"]
+
+
+def test_unknown_categories_are_not_added_by_default(tmp_path):
+    fileName = str(tmp_path / "vocabulary.json")
+    extend(fileName, ["Glycolysis"])
+    words = vocabulary.Vocabulary(fileName)
+
+    assert list(words.encode(["Glycolysis", "Urea cycle", np.nan], column)) == [0, -1, -1]
+    model = pd.DataFrame({column: ["Urea cycle"], "Expression": [1.0]})
+    assert list(vocabulary.encodeColumns(model, fileName=fileName)[column]) == [-1]
+    assert vocabulary.Vocabulary(fileName).categories == {column: ["Glycolysis"]}
+
+
+def test_parallel_extend_under_lock(tmp_path):
+    fileName = str(tmp_path / "vocabulary.json")
+    extend(fileName, ["Shared"])
+    batches = [["Shared", "Tissue " + str(i), "Common " + str(i % 3)] for i in range(12)]
+
+    context = multiprocessing.get_context("fork")
+    with context.Pool(4) as pool:
+        pool.starmap(extend, [(fileName, batch) for batch in batches])
+
+    categories = vocabulary.Vocabulary(fileName).categories[column]
+    expected = {"Shared"} | {"Tissue " + str(i) for i in range(12)} | {"Common " + str(i) for i in range(3)}
+    # No process overwrote the categories added by another, and none was added twice
+    assert len(categories) == len(expected)
+    assert set(categories) == expected
+    assert categories[0] == "Shared"